@@ -21,11 +21,12 @@ del logging, NullHandler
 from .core import Message, KatcpSyntaxError, MessageParser, \
                   DeviceMetaclass, ExcepthookThread, FailReply, \
                   AsyncReply, KatcpDeviceError, KatcpClientError, \
-                  Sensor
+                  Sensor, SensorBatch
 
-from .server import DeviceServerBase, DeviceServer, DeviceLogger
+from .server import DeviceServerBase, DeviceServer, DeviceLogger, inline_request
 
-from .client import DeviceClient, BlockingClient, CallbackClient
+from .client import DeviceClient, BlockingClient, CallbackClient, ClientReactor, \
+                    start_clients
 
 from .sensortree import GenericSensorTree, BooleanSensorTree, AggregateSensorTree
 
@@ -0,0 +1,475 @@
+# benchmark.py
+# -*- coding: utf8 -*-
+# vim:fileencoding=utf8 ai ts=4 sts=4 et sw=4
+# Copyright 2009 SKA South Africa (http://ska.ac.za/)
+# BSD license - see COPYING for details
+
+"""Load generation and latency benchmark for the katcp package.
+
+Starts a :class:`katcp.testutils.DeviceTestServer` on localhost and
+drives it with blocking and callback clients sending a weighted mix of
+requests, polling sensors and subscribing to periodic sensor updates.
+Request sequences are generated from a fixed seed so that runs on
+different commits can be compared directly.
+
+The ``--dispatch`` option instead measures the per-request overhead of
+the :mod:`katcp.kattypes` decorators, without any network traffic.
+
+Usage::
+
+    python -m katcp.benchmark --clients 4 --duration 10
+    python -m katcp.benchmark --dispatch 100000
+"""
+
+import sys
+import time
+import random
+import logging
+import threading
+import optparse
+
+from .core import Message, Sensor
+from .kattypes import request, return_reply, unpack_types, make_reply, \
+                      Int, Float, Str, Bool
+from .client import BlockingClient, CallbackClient
+from .server import DeviceServer
+from .testutils import DeviceTestServer
+from .version import VERSION_STR
+
+log = logging.getLogger("katcp.benchmark")
+
+## @brief Default weighted mix of requests sent by each client.
+DEFAULT_MIX = "watchdog:4,sensor-value:4,sensor-list:1,help:1"
+
+## @brief Request and reply types used by the dispatch benchmark.
+DISPATCH_TYPES = (Int(), Float(), Str(), Bool())
+
+
+def percentile(values, pct):
+    """Return a nearest-rank percentile of a sorted list of values.
+
+    Parameters
+    ----------
+    values : sorted list of floats
+        The values to take the percentile of.
+    pct : float
+        The percentile, between 0 and 100.
+
+    Returns
+    -------
+    value : float or None
+        The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    rank = int(-(-pct * len(values) // 100.0))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def parse_mix(mix):
+    """Parse a request mix of the form "name:weight,name:weight".
+
+    Parameters
+    ----------
+    mix : str
+        Comma separated request names, each optionally followed by a
+        colon and an integer weight (the default weight is one).
+
+    Returns
+    -------
+    names : list of str
+        Request names, each repeated according to its weight.
+    """
+    names = []
+    for item in mix.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if ":" in item:
+            name, weight = item.split(":", 1)
+            weight = int(weight)
+        else:
+            name, weight = item, 1
+        if weight < 0:
+            raise ValueError("Negative weight for request '%s'." % (name,))
+        names.extend([name] * weight)
+    if not names:
+        raise ValueError("Request mix '%s' contains no requests." % (mix,))
+    return names
+
+
+class BenchmarkServer(DeviceTestServer):
+    """Test server with a configurable number of extra sensors.
+
+    Parameters
+    ----------
+    host : str
+        Host to listen on.
+    port : int
+        Port to listen on.
+    num_sensors : int
+        Number of float sensors named bench.sensor.N to add.
+    kwargs : additional keyword arguments
+        Passed to the DeviceTestServer constructor.
+    """
+
+    def __init__(self, host, port, num_sensors=100, **kwargs):
+        self._num_sensors = num_sensors
+        super(BenchmarkServer, self).__init__(host, port, **kwargs)
+
+    def setup_sensors(self):
+        super(BenchmarkServer, self).setup_sensors()
+        for i in range(self._num_sensors):
+            sensor = Sensor(Sensor.FLOAT, "bench.sensor.%d" % (i,),
+                            "Benchmark sensor %d." % (i,), "", [0.0, 1.0])
+            sensor.set_value(0.5)
+            self.add_sensor(sensor)
+
+    def handle_message(self, sock, msg):
+        # skip DeviceTestServer's message recording
+        DeviceServer.handle_message(self, sock, msg)
+
+
+class _StatusCounter(object):
+    """Count #sensor-status informs arriving at a client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def inform_sensor_status(self, msg):
+        """Count a sensor status update."""
+        self._lock.acquire()
+        try:
+            self.count += 1
+        finally:
+            self._lock.release()
+
+
+class BenchmarkBlockingClient(BlockingClient, _StatusCounter):
+    """Blocking client counting sensor updates."""
+
+    def __init__(self, *args, **kwargs):
+        BlockingClient.__init__(self, *args, **kwargs)
+        _StatusCounter.__init__(self)
+
+
+class BenchmarkCallbackClient(CallbackClient, _StatusCounter):
+    """Callback client counting sensor updates."""
+
+    def __init__(self, *args, **kwargs):
+        CallbackClient.__init__(self, *args, **kwargs)
+        _StatusCounter.__init__(self)
+
+
+class Recorder(object):
+    """Collect request latencies from many threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {} # map request names to lists of latencies
+        self.failures = 0
+
+    def record(self, name, latency, ok=True):
+        """Record the latency (in seconds) of one request."""
+        self._lock.acquire()
+        try:
+            self.latencies.setdefault(name, []).append(latency)
+            if not ok:
+                self.failures += 1
+        finally:
+            self._lock.release()
+
+
+class Benchmark(object):
+    """A single benchmark run.
+
+    Parameters
+    ----------
+    clients : int
+        Number of clients of each type (blocking and callback).
+    duration : float in seconds
+        How long to send requests for.
+    mix : str
+        Weighted request mix, see :func:`parse_mix`.
+    sensors : int
+        Number of extra sensors on the server.
+    subscriptions : int
+        Number of sensors each client samples periodically.
+    period : int
+        Sampling period in milliseconds for the subscriptions.
+    window : int
+        Number of requests each callback client keeps in flight.
+    handler_threads : int
+        Number of request handler threads on the server.
+    seed : int
+        Seed for the request sequences.
+    """
+
+    def __init__(self, clients=4, duration=5.0, mix=DEFAULT_MIX, sensors=100,
+                 subscriptions=10, period=100, window=4, handler_threads=0,
+                 seed=0):
+        self.clients = clients
+        self.duration = duration
+        self.mix = parse_mix(mix)
+        self.sensors = sensors
+        self.subscriptions = subscriptions
+        self.period = period
+        self.window = window
+        self.handler_threads = handler_threads
+        self.seed = seed
+        self.recorder = Recorder()
+        self.elapsed = None
+        self.status_updates = 0
+
+    def _next_request(self, rng):
+        """Return the next request message for a client."""
+        name = rng.choice(self.mix)
+        if name == "sensor-value" and self.sensors:
+            return Message.request(name, "bench.sensor.%d"
+                                   % (rng.randrange(self.sensors),))
+        return Message.request(name)
+
+    def _subscribe(self, client, rng):
+        """Subscribe a client to periodic updates of some sensors."""
+        if not self.sensors:
+            return
+        count = min(self.subscriptions, self.sensors)
+        for i in rng.sample(range(self.sensors), count):
+            client.blocking_request(Message.request("sensor-sampling",
+                "bench.sensor.%d" % (i,), "period", str(self.period)))
+
+    def _run_blocking(self, client, rng, deadline):
+        """Send requests one at a time until the deadline."""
+        _time = time.time
+        record = self.recorder.record
+        while _time() < deadline:
+            msg = self._next_request(rng)
+            start = _time()
+            try:
+                reply, _informs = client.blocking_request(msg)
+                ok = reply.reply_ok()
+            except Exception:
+                ok = False
+            record(msg.name, _time() - start, ok)
+
+    def _run_callback(self, client, rng, deadline):
+        """Keep a window of requests in flight until the deadline."""
+        _time = time.time
+        record = self.recorder.record
+        slots = threading.Semaphore(self.window)
+        outstanding = [0]
+        done = threading.Condition()
+
+        def reply_cb(reply, name, start):
+            record(name, _time() - start, reply.reply_ok())
+            done.acquire()
+            try:
+                outstanding[0] -= 1
+                done.notify()
+            finally:
+                done.release()
+            slots.release()
+
+        while _time() < deadline:
+            slots.acquire()
+            msg = self._next_request(rng)
+            done.acquire()
+            try:
+                outstanding[0] += 1
+            finally:
+                done.release()
+            client.request(msg, reply_cb=reply_cb,
+                           user_data=(msg.name, _time()))
+
+        done.acquire()
+        try:
+            while outstanding[0]:
+                done.wait(1.0)
+        finally:
+            done.release()
+
+    def run(self):
+        """Run the benchmark and return the collected results.
+
+        Returns
+        -------
+        recorder : Recorder object
+            The latencies recorded for every request.
+        """
+        server = BenchmarkServer("127.0.0.1", 0, num_sensors=self.sensors,
+                                 handler_threads=self.handler_threads)
+        server.start(timeout=1.0)
+        host, port = server._sock.getsockname()
+
+        clients = []
+        for i in range(self.clients):
+            clients.append((BenchmarkBlockingClient(host, port,
+                                                    auto_reconnect=False),
+                            self._run_blocking))
+            clients.append((BenchmarkCallbackClient(host, port,
+                                                    auto_reconnect=False,
+                                                    use_ids=True),
+                            self._run_callback))
+        try:
+            for client, _runner in clients:
+                client.start(timeout=1.0)
+            for i, (client, _runner) in enumerate(clients):
+                self._subscribe(client, random.Random(self.seed + 1000 + i))
+
+            start = time.time()
+            deadline = start + self.duration
+            threads = []
+            for i, (client, runner) in enumerate(clients):
+                thread = threading.Thread(target=runner, args=(client,
+                            random.Random(self.seed + i), deadline))
+                thread.setDaemon(True)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.time() - start
+            self.status_updates = sum([client.count for client, _r
+                                       in clients])
+        finally:
+            for client, _runner in clients:
+                client.stop()
+            for client, _runner in clients:
+                client.join(timeout=1.0)
+            server.stop()
+            server.join(timeout=1.0)
+        return self.recorder
+
+    def report(self, out=sys.stdout):
+        """Write a summary of the results.
+
+        Parameters
+        ----------
+        out : file-like object
+            Where to write the report.
+        """
+        out.write("katcp %s benchmark: %d blocking + %d callback clients,"
+                  " %.1f s, seed %d\n" % (VERSION_STR, self.clients,
+                  self.clients, self.duration, self.seed))
+        out.write("sensors %d, subscriptions %d x %d ms, window %d,"
+                  " handler threads %d\n" % (self.sensors, self.subscriptions,
+                  self.period, self.window, self.handler_threads))
+        out.write("%-16s %8s %10s %9s %9s %9s\n" % ("request", "count",
+                  "req/s", "p50 ms", "p99 ms", "p99.9 ms"))
+
+        def row(name, latencies):
+            latencies = sorted(latencies)
+            out.write("%-16s %8d %10.1f %9.3f %9.3f %9.3f\n" % (name,
+                      len(latencies), len(latencies) / self.elapsed,
+                      percentile(latencies, 50) * 1e3,
+                      percentile(latencies, 99) * 1e3,
+                      percentile(latencies, 99.9) * 1e3))
+
+        everything = []
+        for name, latencies in sorted(self.recorder.latencies.items()):
+            row(name, latencies)
+            everything.extend(latencies)
+        if everything:
+            row("total", everything)
+        out.write("failures %d, sensor updates %d (%.1f/s)\n"
+                  % (self.recorder.failures, self.status_updates,
+                     self.status_updates / self.elapsed))
+
+
+class _DispatchDevice(object):
+    """Request handlers for measuring kattypes decorator overhead."""
+
+    def request_bench(self, sock, i, f, s, b):
+        return ("ok", i, f, s, b)
+
+    def generic_bench(self, sock, msg):
+        """Dispatch by unpacking and packing with the generic helpers."""
+        args = unpack_types(DISPATCH_TYPES, msg.arguments,
+                            ["i", "f", "s", "b"])
+        return make_reply(msg.name, DISPATCH_TYPES,
+                          self.request_bench(sock, *args))
+
+    compiled_bench = request(*DISPATCH_TYPES)(
+        return_reply(*DISPATCH_TYPES)(request_bench))
+
+
+def dispatch_benchmark(iterations=100000, out=sys.stdout):
+    """Compare generic and compiled kattypes request dispatch.
+
+    Parameters
+    ----------
+    iterations : int
+        Number of requests to dispatch with each method.
+    out : file-like object
+        Where to write the report.
+
+    Returns
+    -------
+    times : dict
+        Map from method name ("generic" or "compiled") to the average
+        time per request in seconds.
+    """
+    device = _DispatchDevice()
+    msg = Message.request("bench", "42", "3.25", "spectrum", "1")
+    times = {}
+    out.write("katcp %s dispatch benchmark: %d requests, types %s\n"
+              % (VERSION_STR, iterations,
+                 " ".join([t.name for t in DISPATCH_TYPES])))
+    for name in ("generic", "compiled"):
+        handler = getattr(device, name + "_bench")
+        start = time.time()
+        for _i in xrange(iterations):
+            handler(None, msg)
+        times[name] = (time.time() - start) / iterations
+        out.write("%-10s %9.3f us/request\n" % (name, times[name] * 1e6))
+    out.write("speedup    %9.2fx\n" % (times["generic"] / times["compiled"]))
+    return times
+
+
+def main(argv=None):
+    """Run the benchmark from the command line."""
+    parser = optparse.OptionParser(usage="%prog [options]",
+                                   description="Benchmark the katcp stack.")
+    parser.add_option("-c", "--clients", type="int", default=4,
+                      help="clients of each type (default %default)")
+    parser.add_option("-d", "--duration", type="float", default=5.0,
+                      help="seconds to send requests for (default %default)")
+    parser.add_option("-m", "--mix", default=DEFAULT_MIX,
+                      help="weighted request mix (default %default)")
+    parser.add_option("-s", "--sensors", type="int", default=100,
+                      help="extra server sensors (default %default)")
+    parser.add_option("--subscriptions", type="int", default=10,
+                      help="sensors sampled per client (default %default)")
+    parser.add_option("--period", type="int", default=100,
+                      help="sampling period in ms (default %default)")
+    parser.add_option("-w", "--window", type="int", default=4,
+                      help="requests in flight per callback client"
+                           " (default %default)")
+    parser.add_option("-t", "--handler-threads", type="int", default=0,
+                      help="server request handler threads"
+                           " (default %default)")
+    parser.add_option("--seed", type="int", default=0,
+                      help="random seed (default %default)")
+    parser.add_option("--dispatch", type="int", default=0, metavar="N",
+                      help="only time N requests through the kattypes"
+                           " decorators")
+    opts, args = parser.parse_args(argv)
+    if args:
+        parser.error("unexpected arguments: %s" % " ".join(args))
+
+    if opts.dispatch:
+        dispatch_benchmark(opts.dispatch)
+        return
+
+    benchmark = Benchmark(clients=opts.clients, duration=opts.duration,
+                          mix=opts.mix, sensors=opts.sensors,
+                          subscriptions=opts.subscriptions, period=opts.period,
+                          window=opts.window,
+                          handler_threads=opts.handler_threads,
+                          seed=opts.seed)
+    benchmark.run()
+    benchmark.report()
+
+
+if __name__ == "__main__":
+    main()
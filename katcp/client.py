@@ -15,8 +15,11 @@ import select
 import time
 import logging
 import errno
+import os
+import fcntl
+import random
 from .core import DeviceMetaclass, MessageParser, Message, ExcepthookThread, \
-                   KatcpClientError
+                   KatcpClientError, SocketSelector
 
 #logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger("katcp")
@@ -63,6 +66,15 @@ class DeviceClient(object):
 
     __metaclass__ = DeviceMetaclass
 
+    ## @brief Seconds allowed for a connection attempt to complete.
+    CONNECT_TIMEOUT = 5.0
+
+    ## @brief Delay in seconds before retrying after a first failure.
+    RECONNECT_DELAY_MIN = 0.5
+
+    ## @brief Upper limit in seconds on the delay between retries.
+    RECONNECT_DELAY_MAX = 30.0
+
     def __init__(self, host, port, tb_limit=20, logger=log,
                  auto_reconnect=True):
         self._parser = MessageParser()
@@ -77,6 +89,9 @@ class DeviceClient(object):
         self._logger = logger
         self._auto_reconnect = auto_reconnect
         self._connect_failures = 0
+        self._reactor = None
+        self._detached = threading.Event()
+        self._stopping = threading.Event()
 
     def request(self, msg):
         """Send a request messsage.
@@ -141,40 +156,121 @@ class DeviceClient(object):
             self._logger.error(msg)
             self._disconnect()
 
-    def _connect(self):
-        """Connect to the server."""
+    def _begin_connect(self):
+        """Start a non-blocking connection attempt.
+
+        Returns
+        -------
+        sock : socket.socket object or None
+            The connecting socket, or None if the attempt failed at once.
+        done : bool
+            Whether the connection completed immediately.
+        """
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
         try:
-            sock.connect(self._bindaddr)
-            sock.setblocking(0)
+            err = sock.connect_ex(self._bindaddr)
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                raise socket.error(err, os.strerror(err))
+        except Exception, e:
+            self._connect_failed(sock, e)
+            return None, False
+        return sock, err == 0
+
+    def _complete_connect(self, sock):
+        """Finish a connection attempt started by _begin_connect.
+
+        Parameters
+        ----------
+        sock : socket.socket object
+            A socket that is connected or has been reported as writable.
+
+        Returns
+        -------
+        connected : bool
+            Whether the connection succeeded.
+        """
+        try:
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise socket.error(err, os.strerror(err))
             if hasattr(socket, 'TCP_NODELAY'):
                 # our message packets are small, don't delay sending them.
                 sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
-            if self._connect_failures >= 5:
-                self._logger.warn("Reconnected to %r" % (self._bindaddr,))
-            self._connect_failures = 0
         except Exception, e:
-            self._connect_failures += 1
-            if self._connect_failures % 5 == 0:
-                # warn on every fifth failure
-                self._logger.warn("Failed to connect to %r: %s" % (self._bindaddr, e))
-            else:
-                self._logger.debug("Failed to connect to %r: %s" % (self._bindaddr, e))
-            sock.close()
-            sock = None
-
-        if sock is None:
-            return
+            self._connect_failed(sock, e)
+            return False
 
+        if self._connect_failures >= 5:
+            self._logger.warn("Reconnected to %r" % (self._bindaddr,))
+        self._connect_failures = 0
         self._sock = sock
         self._waiting_chunk = ""
         self._connected.set()
+        if self._reactor is not None:
+            self._reactor.wake(self)
 
         try:
             self.notify_connected(True)
         except Exception:
             self._logger.exception("Notify connect failed. Disconnecting.")
             self._disconnect()
+        return self._sock is sock
+
+    def _connect_failed(self, sock, e):
+        """Log and clean up after a failed connection attempt."""
+        self._connect_failures += 1
+        if self._connect_failures % 5 == 0:
+            # warn on every fifth failure
+            self._logger.warn("Failed to connect to %r: %s" % (self._bindaddr, e))
+        else:
+            self._logger.debug("Failed to connect to %r: %s" % (self._bindaddr, e))
+        sock.close()
+
+    def _connect(self, timeout=None):
+        """Connect to the server.
+
+        Parameters
+        ----------
+        timeout : float in seconds or None
+            Seconds to wait for the connection to be established.
+            Defaults to CONNECT_TIMEOUT.
+        """
+        if timeout is None:
+            timeout = self.CONNECT_TIMEOUT
+        sock, done = self._begin_connect()
+        if sock is None:
+            return
+        if not done:
+            try:
+                _readers, writers, errors = select.select(
+                    [], [sock], [sock], timeout)
+            except Exception, e:
+                self._connect_failed(sock, e)
+                return
+            if not (writers or errors):
+                self._connect_failed(sock, "timed out after %g seconds"
+                                     % (timeout,))
+                return
+        self._complete_connect(sock)
+
+    def _reconnect_delay(self):
+        """Seconds to wait before the next connection attempt.
+
+        The delay doubles with each consecutive failure from
+        RECONNECT_DELAY_MIN up to RECONNECT_DELAY_MAX. The upper half of
+        each delay is randomised so that many clients which lost their
+        connections at the same moment do not retry in lock step.
+
+        Returns
+        -------
+        delay : float in seconds
+            The delay before the next attempt.
+        """
+        failures = max(self._connect_failures, 1)
+        delay = min(self.RECONNECT_DELAY_MAX,
+                    self.RECONNECT_DELAY_MIN * 2 ** min(failures - 1, 16))
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
 
     def _disconnect(self):
         """Disconnect and cleanup."""
@@ -186,8 +282,30 @@ class DeviceClient(object):
         if sock is not None:
             sock.close()
             self._connected.clear()
+            if self._reactor is not None:
+                self._reactor.wake(self)
             self.notify_connected(False)
 
+    def _handle_read(self, sock):
+        """Read available data from the server socket and process it.
+
+        Parameters
+        ----------
+        sock : socket.socket object
+            The socket select reported as readable.
+        """
+        try:
+            chunk = sock.recv(4096)
+        except socket.error:
+            # an error when sock was within ready list presumably
+            # means the client needs to be ditched.
+            chunk = ""
+        if chunk:
+            self._handle_chunk(chunk)
+        else:
+            # EOF from server
+            self._disconnect()
+
     def _handle_chunk(self, chunk):
         """Handle a chunk of data from the server.
 
@@ -348,9 +466,8 @@ class DeviceClient(object):
         # even while Python is setting module globals to
         # None.
         _select = select.select
-        _socket_error = socket.error
-        _sleep = time.sleep
 
+        self._stopping.clear()
         if not self._auto_reconnect:
             self._connect()
             if not self.is_connected():
@@ -377,17 +494,7 @@ class DeviceClient(object):
                     self._disconnect()
 
                 elif readers:
-                    try:
-                        chunk = sock.recv(4096)
-                    except _socket_error:
-                        # an error when sock was within ready list presumably
-                        # means the client needs to be ditched.
-                        chunk = ""
-                    if chunk:
-                        self._handle_chunk(chunk)
-                    else:
-                        # EOF from server
-                        self._disconnect()
+                    self._handle_read(sock)
             else:
                 # not currently connected so attempt to connect
                 # if auto_reconnect is set
@@ -397,12 +504,12 @@ class DeviceClient(object):
                 else:
                     self._connect()
                     if not self.is_connected():
-                        _sleep(timeout)
+                        self._stopping.wait(self._reconnect_delay())
 
         self._disconnect()
         self._logger.debug("Stopping thread %s" % (threading.currentThread().getName()))
 
-    def start(self, timeout=None, daemon=None, excepthook=None):
+    def start(self, timeout=None, daemon=None, excepthook=None, reactor=None):
         """Start the client in a new thread.
 
         Parameters
@@ -415,14 +522,21 @@ class DeviceClient(object):
         excepthook : function
             Function to call if the client throws an exception. Signature
             is as for sys.excepthook.
+        reactor : ClientReactor object
+            If given, the client's socket is serviced by this shared
+            reactor instead of by a thread of its own. The daemon and
+            excepthook parameters are ignored in this case.
         """
-        if self._thread:
+        if self._thread or self._reactor:
             raise RuntimeError("Device client already started.")
 
-        self._thread = ExcepthookThread(target=self.run, excepthook=excepthook)
-        if daemon is not None:
-            self._thread.setDaemon(daemon)
-        self._thread.start()
+        if reactor is not None:
+            reactor.add_client(self)
+        else:
+            self._thread = ExcepthookThread(target=self.run, excepthook=excepthook)
+            if daemon is not None:
+                self._thread.setDaemon(daemon)
+            self._thread.start()
         if timeout:
             self._connected.wait(timeout)
             if not self._connected.isSet():
@@ -436,6 +550,12 @@ class DeviceClient(object):
         timeout : float in seconds
             Seconds to wait for thread to finish.
         """
+        if self._reactor is not None:
+            self._detached.wait(timeout)
+            if self._detached.isSet():
+                self._reactor = None
+            return
+
         if not self._thread:
             raise RuntimeError("Device client thread not started.")
 
@@ -455,6 +575,10 @@ class DeviceClient(object):
         if not self._running.isSet():
             raise RuntimeError("Attempt to stop client that wasn't running.")
         self._running.clear()
+        self._stopping.set()
+        reactor = self._reactor
+        if reactor is not None:
+            reactor.wake(self)
 
     def running(self):
         """Whether the client is running.
@@ -512,6 +636,372 @@ class DeviceClient(object):
         pass
 
 
+class ClientReactor(object):
+    """Service the sockets of many DeviceClients from a single thread.
+
+    Each DeviceClient normally runs its own thread blocked in select on
+    a single socket. A process talking to many devices can instead
+    start its clients on a shared reactor, which waits on all of their
+    sockets at once (using epoll where available) and dispatches
+    received data to each client's usual handler methods. Reconnection
+    of clients with auto_reconnect set is also handled by the reactor,
+    using non-blocking connects so that an unreachable host does not
+    delay the others.
+
+    Handlers of clients attached to a reactor run in the reactor thread
+    and so must not block; in particular blocking_request must not be
+    called from inside a handler.
+
+    Parameters
+    ----------
+    logger : object
+        Python Logger object to log to.
+
+    Examples
+    --------
+    >>> reactor = ClientReactor()
+    >>> reactor.start()
+    >>> clients = [MyClient(host, 7147) for host in hosts]
+    >>> for c in clients:
+    ...     c.start(reactor=reactor)
+    ...
+    >>> # stopping the reactor disconnects and stops all its clients
+    >>> reactor.stop()
+    >>> reactor.join()
+    """
+
+    def __init__(self, logger=log):
+        self._logger = logger
+        self._selector = SocketSelector()
+        self._lock = threading.Lock()
+        # clients attached to the reactor
+        self._clients = set()
+        # clients added since the reactor thread last looked
+        self._added = set()
+        # clients whose state must be re-examined by the reactor thread
+        self._changed = set()
+        # socket -> client for registered client sockets
+        self._sock_clients = {}
+        # client -> registered socket
+        self._client_socks = {}
+        # client -> time of next connection attempt
+        self._reconnects = {}
+        # socket -> (client, deadline) for connections in progress
+        self._connecting = {}
+        self._wake_recv, self._wake_send = os.pipe()
+        for fd in (self._wake_recv, self._wake_send):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._selector.register(self._wake_recv)
+        self._running = threading.Event()
+        self._thread = None
+
+    def add_client(self, client):
+        """Attach a client to the reactor.
+
+        Usually called via client.start(reactor=reactor).
+
+        Parameters
+        ----------
+        client : DeviceClient object
+            The client to service. It is connected by the reactor thread.
+        """
+        client._reactor = self
+        client._detached.clear()
+        client._running.set()
+        self._lock.acquire()
+        try:
+            self._clients.add(client)
+            self._added.add(client)
+        finally:
+            self._lock.release()
+        self.wake(client)
+
+    def clients(self):
+        """Return a list of the attached clients."""
+        self._lock.acquire()
+        try:
+            return list(self._clients)
+        finally:
+            self._lock.release()
+
+    def wake(self, client):
+        """Ask the reactor thread to re-examine a client's state.
+
+        Called by clients whenever they connect, disconnect or are
+        stopped.
+
+        Parameters
+        ----------
+        client : DeviceClient object
+            The client whose state has changed.
+        """
+        self._lock.acquire()
+        try:
+            notify = not self._changed
+            self._changed.add(client)
+        finally:
+            self._lock.release()
+        if notify:
+            try:
+                os.write(self._wake_send, "x")
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def _drain_wake(self):
+        try:
+            while os.read(self._wake_recv, 4096):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _detach(self, client):
+        """Remove a client from the reactor and mark it stopped."""
+        self._unregister(client)
+        self._reconnects.pop(client, None)
+        for sock, (connecting, _deadline) in self._connecting.items():
+            if connecting is client:
+                del self._connecting[sock]
+                self._selector.unregister(sock)
+                sock.close()
+        self._lock.acquire()
+        try:
+            self._clients.discard(client)
+        finally:
+            self._lock.release()
+        client._disconnect()
+        client._running.clear()
+        client._detached.set()
+
+    def _unregister(self, client):
+        sock = self._client_socks.pop(client, None)
+        if sock is not None:
+            self._sock_clients.pop(sock, None)
+            self._selector.unregister(sock)
+
+    def _update_client(self, client):
+        """Bring the reactor's view of a client in line with its state."""
+        if not client._running.isSet():
+            self._detach(client)
+            return
+        sock = client._sock
+        registered = self._client_socks.get(client)
+        if registered is sock:
+            return
+        self._unregister(client)
+        if sock is not None:
+            self._reconnects.pop(client, None)
+            self._client_socks[client] = sock
+            self._sock_clients[sock] = client
+            self._selector.register(sock)
+        elif client._auto_reconnect:
+            # connection lost, try again straight away
+            self._reconnects.setdefault(client, time.time())
+        else:
+            self._detach(client)
+
+    def _process_changes(self, now):
+        self._lock.acquire()
+        try:
+            added, self._added = self._added, set()
+            changed, self._changed = self._changed, set()
+        finally:
+            self._lock.release()
+        for client in added:
+            self._reconnects[client] = now
+        for client in changed:
+            self._update_client(client)
+
+    def _schedule_reconnect(self, client, now):
+        """Arrange the next connection attempt after a failed one."""
+        if client._auto_reconnect and client._running.isSet():
+            self._reconnects[client] = now + client._reconnect_delay()
+        else:
+            if client._running.isSet():
+                self._logger.error("Failed to connect to %r"
+                                   % (client._bindaddr,))
+            self._detach(client)
+
+    def _finish_connect(self, client, sock, now):
+        if client._complete_connect(sock):
+            self._update_client(client)
+        else:
+            self._schedule_reconnect(client, now)
+
+    def _process_reconnects(self, now):
+        due = [client for client, when in self._reconnects.iteritems()
+               if when <= now]
+        for client in due:
+            del self._reconnects[client]
+            if not client._running.isSet():
+                self._detach(client)
+                continue
+            sock, done = client._begin_connect()
+            if sock is None:
+                self._schedule_reconnect(client, now)
+            elif done:
+                self._finish_connect(client, sock, now)
+            else:
+                self._connecting[sock] = (client, now + client.CONNECT_TIMEOUT)
+                self._selector.register(sock, SocketSelector.WRITE)
+
+    def _process_connect_timeouts(self, now):
+        expired = [(sock, client) for sock, (client, deadline)
+                   in self._connecting.iteritems() if deadline <= now]
+        for sock, client in expired:
+            del self._connecting[sock]
+            self._selector.unregister(sock)
+            client._connect_failed(sock, "timed out after %g seconds"
+                                   % (client.CONNECT_TIMEOUT,))
+            self._schedule_reconnect(client, now)
+
+    def _handle_connecting(self, sock, now):
+        client, _deadline = self._connecting.pop(sock)
+        self._selector.unregister(sock)
+        if client._running.isSet():
+            self._finish_connect(client, sock, now)
+        else:
+            sock.close()
+            self._detach(client)
+
+    def _check_sockets(self):
+        """Disconnect clients whose sockets were closed behind our back."""
+        for sock in self._selector.closed():
+            client = self._sock_clients.get(sock)
+            if client is not None and sock is client._sock:
+                client._disconnect()
+            else:
+                self._selector.unregister(sock)
+
+    def _next_wakeup(self, now, timeout):
+        """Seconds until the next reconnect or connect deadline is due."""
+        times = self._reconnects.values() + \
+                [deadline for _client, deadline in self._connecting.values()]
+        if not times:
+            return timeout
+        return max(0.0, min(timeout, min(times) - now))
+
+    def run(self):
+        """Service the attached clients until stopped."""
+        self._logger.debug("Starting thread %s" % (threading.currentThread().getName()))
+        timeout = 0.5 # s
+
+        # save globals so that the thread can run cleanly
+        # even while Python is setting module globals to
+        # None.
+        _time = time.time
+        _read, _error = SocketSelector.READ, SocketSelector.ERROR
+
+        last_check = _time()
+        self._running.set()
+        while self._running.isSet():
+            now = _time()
+            self._process_changes(now)
+            self._process_connect_timeouts(now)
+            self._process_reconnects(now)
+
+            try:
+                ready = self._selector.select(self._next_wakeup(now, timeout))
+            except Exception, e:
+                self._logger.error("Select error: %s" % (e,))
+                ready = []
+
+            now = _time()
+            if not ready or now - last_check > timeout:
+                last_check = now
+                self._check_sockets()
+
+            for sock, events in ready:
+                if sock == self._wake_recv:
+                    self._drain_wake()
+                    continue
+                if sock in self._connecting:
+                    self._handle_connecting(sock, now)
+                    continue
+                client = self._sock_clients.get(sock)
+                if client is None or sock is not client._sock:
+                    continue
+                if events & _error:
+                    client._disconnect()
+                elif events & _read:
+                    client._handle_read(sock)
+
+        for client in self.clients():
+            self._detach(client)
+        self._logger.debug("Stopping thread %s" % (threading.currentThread().getName()))
+
+    def start(self, timeout=None, daemon=None, excepthook=None):
+        """Start the reactor in a new thread.
+
+        Parameters
+        ----------
+        timeout : float in seconds
+            Seconds to wait for the reactor thread to start.
+        daemon : boolean
+            If not None, the thread's setDaemon method is called with this
+            parameter before the thread is started.
+        excepthook : function
+            Function to call if the reactor throws an exception. Signature
+            is as for sys.excepthook.
+        """
+        if self._thread:
+            raise RuntimeError("Client reactor already started.")
+
+        self._thread = ExcepthookThread(target=self.run, excepthook=excepthook)
+        if daemon is not None:
+            self._thread.setDaemon(daemon)
+        self._thread.start()
+        if timeout:
+            self._running.wait(timeout)
+            if not self._running.isSet():
+                raise RuntimeError("Client reactor failed to start.")
+
+    def join(self, timeout=None):
+        """Rejoin the reactor thread.
+
+        Parameters
+        ----------
+        timeout : float in seconds
+            Seconds to wait for thread to finish.
+        """
+        if not self._thread:
+            raise RuntimeError("Client reactor thread not started.")
+
+        self._thread.join(timeout)
+        if not self._thread.isAlive():
+            self._thread = None
+
+    def stop(self, timeout=1.0):
+        """Stop the reactor and all its clients (from another thread).
+
+        Parameters
+        ----------
+        timeout : float in seconds
+           Seconds to wait for the reactor thread to have *started*.
+        """
+        self._running.wait(timeout)
+        if not self._running.isSet():
+            raise RuntimeError("Attempt to stop reactor that wasn't running.")
+        self._running.clear()
+        try:
+            os.write(self._wake_send, "x")
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def running(self):
+        """Whether the reactor is running.
+
+        Returns
+        -------
+        running : bool
+            Whether the reactor is running.
+        """
+        return self._running.isSet()
+
+
 class BlockingClient(DeviceClient):
     """Implement blocking requests on top of DeviceClient.
 
@@ -989,3 +1479,50 @@ class CallbackClient(DeviceClient):
                 e_type, e_value, trace, self._tb_limit
             ))
             self._logger.error("Callback reply %s FAIL: %s" % (msg.name, reason))
+
+
+def start_clients(clients, timeout=5.0, reactor=None, daemon=None,
+                  stop_failed=False):
+    """Start a collection of clients and wait for them to connect.
+
+    All clients connect in parallel so the total wait is bounded by
+    timeout however many hosts are unreachable. Clients that have already
+    been started are only waited for.
+
+    Parameters
+    ----------
+    clients : list of DeviceClient objects
+        The clients to start.
+    timeout : float in seconds
+        Seconds to wait for all of the clients to connect.
+    reactor : ClientReactor object
+        If given, clients are started on this reactor rather than in
+        threads of their own.
+    daemon : boolean
+        Passed to the start method of threaded clients.
+    stop_failed : boolean
+        Whether to stop the clients that did not connect in time.
+
+    Returns
+    -------
+    connected : list of DeviceClient objects
+        The clients that connected within the timeout.
+    failed : list of DeviceClient objects
+        The clients that did not. Unless stop_failed is set they keep
+        trying to connect in the background if auto_reconnect is set.
+    """
+    for client in clients:
+        if not (client._thread or client._reactor):
+            client.start(daemon=daemon, reactor=reactor)
+
+    deadline = time.time() + timeout
+    connected, failed = [], []
+    for client in clients:
+        if client.wait_connected(max(0.0, deadline - time.time())):
+            connected.append(client)
+        else:
+            failed.append(client)
+    if stop_failed:
+        for client in failed:
+            client.stop()
+    return connected, failed
@@ -12,6 +12,14 @@ import threading
 import sys
 import re
 import time
+import select
+import errno
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Message(object):
     """Represents a KAT device control language message.
@@ -473,7 +481,379 @@ class ExcepthookThread(threading.Thread):
                 raise
 
 
-from .kattypes import Int, Float, Bool, Discrete, Lru, Str, Timestamp
+class SocketSelector(object):
+    """Readiness notification for a changing set of file descriptors.
+
+    Uses select.epoll where the platform provides it so that the cost of
+    each wait depends on the number of ready descriptors rather than on
+    the number registered. Falls back to select.select elsewhere.
+
+    Registered objects are either sockets (anything with a fileno method)
+    or raw integer file descriptors. The descriptor number is recorded at
+    registration time so that objects closed behind the selector's back
+    can still be unregistered.
+
+    Parameters
+    ----------
+    use_epoll : bool or None
+        Whether to use epoll. None (the default) uses epoll if available.
+    """
+
+    ## @brief Event flag: the object is ready for reading.
+    READ = 1
+    ## @brief Event flag: the object is ready for writing.
+    WRITE = 2
+    ## @brief Event flag: the object is in an error state.
+    ERROR = 4
+
+    def __init__(self, use_epoll=None):
+        if use_epoll is None:
+            use_epoll = hasattr(select, "epoll")
+        self._epoll = select.epoll() if use_epoll else None
+        self._lock = threading.Lock()
+        # object -> (fd, events) and fd -> object
+        self._entries = {}
+        self._objects = {}
+
+    def _epoll_mask(self, events):
+        mask = 0
+        if events & self.READ:
+            mask |= select.EPOLLIN | select.EPOLLPRI
+        if events & self.WRITE:
+            mask |= select.EPOLLOUT
+        return mask
+
+    def register(self, obj, events=READ):
+        """Start watching an object.
+
+        Parameters
+        ----------
+        obj : socket or int
+            The socket or file descriptor to watch.
+        events : int
+            Bitwise or of READ and WRITE.
+        """
+        fd = obj if isinstance(obj, (int, long)) else obj.fileno()
+        self._lock.acquire()
+        try:
+            stale = self._objects.get(fd)
+            if stale is not None and stale is not obj:
+                # the descriptor was closed and its number reused
+                del self._entries[stale]
+            self._entries[obj] = (fd, events)
+            self._objects[fd] = obj
+            if self._epoll is not None:
+                try:
+                    self._epoll.register(fd, self._epoll_mask(events))
+                except IOError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                    self._epoll.modify(fd, self._epoll_mask(events))
+        finally:
+            self._lock.release()
+
+    def modify(self, obj, events):
+        """Change the events watched for on a registered object.
+
+        Parameters
+        ----------
+        obj : socket or int
+            The registered socket or file descriptor.
+        events : int
+            Bitwise or of READ and WRITE.
+        """
+        self._lock.acquire()
+        try:
+            fd, _old_events = self._entries[obj]
+            self._entries[obj] = (fd, events)
+            if self._epoll is not None:
+                self._epoll.modify(fd, self._epoll_mask(events))
+        finally:
+            self._lock.release()
+
+    def unregister(self, obj):
+        """Stop watching an object.
+
+        Unregistering an object that has already been closed (or was
+        never registered) is not an error.
+
+        Parameters
+        ----------
+        obj : socket or int
+            The socket or file descriptor to stop watching.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(obj, None)
+            if entry is None:
+                return
+            fd = entry[0]
+            if self._objects.get(fd) is not obj:
+                return
+            del self._objects[fd]
+            if self._epoll is not None:
+                try:
+                    self._epoll.unregister(fd)
+                except (IOError, ValueError):
+                    # closed descriptors have already left the epoll set
+                    pass
+        finally:
+            self._lock.release()
+
+    def registered(self):
+        """Return a list of the objects currently registered."""
+        self._lock.acquire()
+        try:
+            return self._entries.keys()
+        finally:
+            self._lock.release()
+
+    def closed(self):
+        """Return the registered sockets that have since been closed.
+
+        Closed descriptors silently drop out of an epoll set, so callers
+        should check for them from time to time and unregister them.
+
+        Returns
+        -------
+        closed : list of sockets
+            Registered sockets whose descriptor is no longer valid.
+        """
+        self._lock.acquire()
+        try:
+            entries = self._entries.items()
+        finally:
+            self._lock.release()
+        closed = []
+        for obj, (fd, _events) in entries:
+            if isinstance(obj, (int, long)):
+                continue
+            try:
+                if obj.fileno() != fd:
+                    closed.append(obj)
+            except Exception:
+                closed.append(obj)
+        return closed
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, obj):
+        return obj in self._entries
+
+    def select(self, timeout=None):
+        """Wait for registered objects to become ready.
+
+        Parameters
+        ----------
+        timeout : float in seconds or None
+            Maximum time to wait. None waits indefinitely.
+
+        Returns
+        -------
+        ready : list of (object, events) tuples
+            The ready objects and a bitwise or of READ, WRITE and ERROR.
+        """
+        if self._epoll is not None:
+            return self._select_epoll(timeout)
+        return self._select_select(timeout)
+
+    def _select_epoll(self, timeout):
+        try:
+            fd_events = self._epoll.poll(-1 if timeout is None else timeout)
+        except IOError, e:
+            if e.errno == errno.EINTR:
+                return []
+            raise
+        ready = []
+        objects = self._objects
+        for fd, mask in fd_events:
+            obj = objects.get(fd)
+            if obj is None:
+                continue
+            events = 0
+            if mask & (select.EPOLLIN | select.EPOLLPRI | select.EPOLLHUP):
+                events |= self.READ
+            if mask & select.EPOLLOUT:
+                events |= self.WRITE
+            if mask & select.EPOLLERR:
+                events |= self.ERROR
+            ready.append((obj, events))
+        return ready
+
+    def _select_select(self, timeout):
+        self._lock.acquire()
+        try:
+            entries = self._entries.items()
+        finally:
+            self._lock.release()
+        readers = [fd for _obj, (fd, ev) in entries if ev & self.READ]
+        writers = [fd for _obj, (fd, ev) in entries if ev & self.WRITE]
+        fds = [fd for _obj, (fd, _ev) in entries]
+        ready = {}
+        try:
+            r, w, x = select.select(readers, writers, fds, timeout)
+        except (select.error, ValueError, TypeError), e:
+            if isinstance(e, select.error) and e.args[0] == errno.EINTR:
+                return []
+            # find the offending descriptors one at a time
+            r, w, x = [], [], []
+            for fd in fds:
+                try:
+                    select.select([fd], [], [], 0)
+                except Exception:
+                    x.append(fd)
+        for flag, fdlist in ((self.READ, r), (self.WRITE, w),
+                             (self.ERROR, x)):
+            for fd in fdlist:
+                ready[fd] = ready.get(fd, 0) | flag
+        objects = self._objects
+        return [(objects[fd], events) for fd, events in ready.iteritems()
+                if fd in objects]
+
+    def close(self):
+        """Release the resources held by the selector."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._objects.clear()
+            if self._epoll is not None:
+                self._epoll.close()
+                self._epoll = None
+        finally:
+            self._lock.release()
+
+
+class SensorHistory(object):
+    """Fixed-size ring buffer of sensor readings.
+
+    Timestamps, statuses and values are held in preallocated numpy arrays
+    so that recording a reading does not allocate and queries over the
+    history are vectorized. Once the buffer is full each new reading
+    replaces the oldest.
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of readings to keep.
+    dtype : numpy dtype or str
+        Type of the value array. Use object for string-valued sensors.
+    """
+
+    __slots__ = ["size", "_timestamps", "_statuses", "_values", "_next",
+                 "_count", "_lock"]
+
+    def __init__(self, size, dtype=float):
+        if numpy is None:
+            raise ImportError("Sensor history requires numpy.")
+        if size < 1:
+            raise ValueError("Sensor history size must be positive.")
+        self.size = size
+        self._timestamps = numpy.zeros(size, dtype=numpy.float64)
+        self._statuses = numpy.zeros(size, dtype=numpy.int8)
+        self._values = numpy.zeros(size, dtype=dtype)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, status, value):
+        """Record a reading, replacing the oldest if the buffer is full.
+
+        Parameters
+        ----------
+        timestamp : float in seconds
+            The time at which the value was determined.
+        status : Sensor status constant
+            The status of the reading.
+        value : object
+            The sensor value.
+        """
+        self._lock.acquire()
+        try:
+            i = self._next
+            self._timestamps[i] = timestamp
+            self._statuses[i] = status
+            self._values[i] = value
+            self._next = (i + 1) % self.size
+            if self._count < self.size:
+                self._count += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Discard all recorded readings."""
+        self._lock.acquire()
+        try:
+            self._next = 0
+            self._count = 0
+        finally:
+            self._lock.release()
+
+    def _take(self, n):
+        """Copy out the n most recent readings in time order."""
+        self._lock.acquire()
+        try:
+            n = min(n, self._count)
+            idx = numpy.arange(self._next - n, self._next) % self.size
+            return (self._timestamps[idx], self._statuses[idx],
+                    self._values[idx])
+        finally:
+            self._lock.release()
+
+    def last(self, n=None):
+        """Return the most recent readings, oldest first.
+
+        Parameters
+        ----------
+        n : int or None
+            Number of readings to return. None returns all of them.
+
+        Returns
+        -------
+        timestamps : numpy array of float
+            Reading timestamps in seconds.
+        statuses : numpy array of int
+            Sensor status constants.
+        values : numpy array
+            Sensor values.
+        """
+        if n is None:
+            n = self.size
+        return self._take(max(n, 0))
+
+    def window(self, start=None, end=None):
+        """Return the readings with timestamps in a time window, oldest first.
+
+        Parameters
+        ----------
+        start : float in seconds or None
+            Earliest timestamp to include. None means no lower bound.
+        end : float in seconds or None
+            Latest timestamp to include. None means no upper bound.
+
+        Returns
+        -------
+        timestamps : numpy array of float
+            Reading timestamps in seconds.
+        statuses : numpy array of int
+            Sensor status constants.
+        values : numpy array
+            Sensor values.
+        """
+        timestamps, statuses, values = self._take(self.size)
+        mask = numpy.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps <= end
+        return timestamps[mask], statuses[mask], values[mask]
+
+
+from .kattypes import Int, Float, Bool, Discrete, Lru, Str, Timestamp, \
+                      NdArray, Vector
 
 class Sensor(object):
     """Instantiate a new sensor object.
@@ -502,6 +882,9 @@ class Sensor(object):
             of the sensor value.
           * For :const:`DISCRETE` the list should contain all
             possible values the sensor may take.
+          * For :const:`VECTOR` the list must give the length of
+            the vector, optionally followed by the element dtype
+            (float64 by default).
           * For all other types, params should be omitted.
     default : object
         An initial value for the sensor. By default this is
@@ -512,6 +895,12 @@ class Sensor(object):
     # is an abstract class used only outside this module
     # pylint: disable-msg = R0902
 
+    # Devices may have thousands of sensors so avoid a per-instance dict.
+    __slots__ = ["_sensor_type", "_observers", "_timestamp", "_status",
+                 "_value", "_kattype", "_formatter", "_parser", "_history",
+                 "stype", "name", "description", "units", "params",
+                 "formatted_params", "__weakref__"]
+
     # Type names and formatters
     #
     # Formatters take the sensor object and the value to
@@ -522,7 +911,8 @@ class Sensor(object):
     # parse as arguments
     #
     # type -> (name, formatter, parser)
-    INTEGER, FLOAT, BOOLEAN, LRU, DISCRETE, STRING, TIMESTAMP = range(7)
+    INTEGER, FLOAT, BOOLEAN, LRU, DISCRETE, STRING, TIMESTAMP, NDARRAY, \
+        VECTOR = range(9)
 
     ## @brief Mapping from sensor type to tuple containing the type name,
     #  a kattype with functions to format and parse a value and a
@@ -535,6 +925,8 @@ class Sensor(object):
         DISCRETE: (Discrete, "unknown"),
         STRING: (Str, ""),
         TIMESTAMP: (Timestamp, 0.0),
+        NDARRAY: (NdArray, numpy.zeros(0) if numpy is not None else None),
+        VECTOR: (Vector, None),
     }
 
     SENSOR_SHORTCUTS = {
@@ -582,6 +974,20 @@ class Sensor(object):
     ## @brief kattype Timestamp instance for encoding and decoding timestamps
     TIMESTAMP_TYPE = Timestamp()
 
+    ## @brief Mapping from sensor type to the numpy dtype used to record
+    #  values of that type in a SensorHistory.
+    HISTORY_DTYPES = {
+        INTEGER: "int64",
+        FLOAT: "float64",
+        BOOLEAN: "bool",
+        LRU: "int8",
+        DISCRETE: object,
+        STRING: object,
+        TIMESTAMP: "float64",
+        NDARRAY: object,
+        VECTOR: object,
+    }
+
     ## @var stype
     # @brief Sensor type constant.
 
@@ -608,6 +1014,7 @@ class Sensor(object):
         self._observers = set()
         self._timestamp = time.time()
         self._status = Sensor.UNKNOWN
+        self._history = None
 
         typeclass, self._value = self.SENSOR_TYPES[sensor_type]
 
@@ -618,6 +1025,12 @@ class Sensor(object):
         elif self._sensor_type == Sensor.DISCRETE:
             self._value = params[0]
             self._kattype = typeclass(params)
+        elif self._sensor_type == Sensor.VECTOR:
+            if not params or params[0] is None:
+                raise ValueError("Vector sensor %r needs a length parameter."
+                                 % (name,))
+            self._kattype = typeclass(*params)
+            self._value = self._kattype.get_default()
         else:
             self._kattype = typeclass()
 
@@ -629,7 +1042,10 @@ class Sensor(object):
         self.description = description
         self.units = units
         self.params = params
-        self.formatted_params = [self._formatter(p, True) for p in params]
+        if self._sensor_type == Sensor.VECTOR:
+            self.formatted_params = [str(p) for p in params]
+        else:
+            self.formatted_params = [self._formatter(p, True) for p in params]
 
         if default is not None:
             self._value = default
@@ -669,6 +1085,37 @@ class Sensor(object):
         for o in list(self._observers):
             o.update(self)
 
+    @staticmethod
+    def notify_many(sensors):
+        """Notify the observers of several sensors in a single pass.
+
+        Each observer is called once. Observers with an
+        update_batch(sensors) method receive the list of their sensors that
+        changed, in the order given. Other observers have update(sensor)
+        called for each of them.
+
+        Parameters
+        ----------
+        sensors : sequence of Sensor objects
+            The sensors whose values have changed.
+        """
+        batches = {}
+        observers = []
+        for sensor in sensors:
+            for o in list(sensor._observers):
+                batch = batches.get(o)
+                if batch is None:
+                    batch = batches[o] = []
+                    observers.append(o)
+                batch.append(sensor)
+        for o in observers:
+            update_batch = getattr(o, "update_batch", None)
+            if update_batch is not None:
+                update_batch(batches[o])
+            else:
+                for sensor in batches[o]:
+                    o.update(sensor)
+
     def parse_value(self, s_value):
         """Parse a value from a string.
 
@@ -698,9 +1145,29 @@ class Sensor(object):
             The value of the sensor (the type should be appropriate to the
             sensor's type).
         """
-        self._timestamp, self._status, self._value = timestamp, status, value
+        self._set_reading(timestamp, status, value)
         self.notify()
 
+    def _set_reading(self, timestamp, status, value):
+        """Store a new reading without notifying observers.
+
+        Both :meth:`set` and :meth:`SensorBatch.commit` store readings
+        through this method, so subclasses that change how a reading is
+        stored should override it rather than :meth:`set`.
+
+        Parameters
+        ----------
+        timestamp : float in seconds
+           The time at which the sensor value was determined.
+        status : Sensor status constant
+            Whether the value represents an error condition or not.
+        value : object
+            The value of the sensor.
+        """
+        self._timestamp, self._status, self._value = timestamp, status, value
+        if self._history is not None:
+            self._history.append(timestamp, status, value)
+
     def set_formatted(self, raw_timestamp, raw_status, raw_value):
         """Set the current value of the sensor.
 
@@ -715,7 +1182,11 @@ class Sensor(object):
         """
         timestamp = self.TIMESTAMP_TYPE.decode(raw_timestamp)
         status = self.STATUS_NAMES[raw_status]
-        value = self.parse_value(raw_value)
+        if self._sensor_type == Sensor.VECTOR:
+            # sampled vectors may be sent as deltas against the last value
+            value = self._kattype.decode_delta(raw_value, self._value)
+        else:
+            value = self.parse_value(raw_value)
         self.set(timestamp, status, value)
 
     def read_formatted(self):
@@ -770,6 +1241,28 @@ class Sensor(object):
             timestamp = time.time()
         self.set(timestamp, status, value)
 
+    def enable_history(self, size):
+        """Start recording the sensor's readings in a ring buffer.
+
+        Requires numpy. Any previously recorded history is discarded.
+
+        Parameters
+        ----------
+        size : int
+            Number of readings to keep.
+        """
+        self._history = SensorHistory(size,
+                                      self.HISTORY_DTYPES[self._sensor_type])
+
+    def disable_history(self):
+        """Stop recording the sensor's readings and discard the history."""
+        self._history = None
+
+    @property
+    def history(self):
+        """The sensor's SensorHistory object, or None if history is off."""
+        return self._history
+
     def value(self):
         """Read the current sensor value.
 
@@ -817,8 +1310,123 @@ class Sensor(object):
             The parsed parameters.
         """
         typeclass, _value = cls.SENSOR_TYPES[sensor_type]
+        if sensor_type == cls.VECTOR:
+            if not formatted_params:
+                raise ValueError("Vector sensor parameters must give a length.")
+            return [int(formatted_params[0])] + list(formatted_params[1:])
         if sensor_type == cls.DISCRETE:
             kattype = typeclass([])
         else:
             kattype = typeclass()
         return [kattype.decode(x) for x in formatted_params]
+
+
+class SensorBatch(object):
+    """Collect sensor updates and apply them together.
+
+    Values are checked as they are added to the batch but no sensor is
+    changed until the batch is committed. Committing stores every reading
+    (through Sensor._set_reading, as Sensor.set does) and then notifies
+    observers with Sensor.notify_many, so that an observer
+    watching many of the sensors (a sensor tree, for example) does its
+    work once per batch rather than once per sensor.
+
+    Used as a context manager the batch is committed when the block exits
+    normally and discarded if it raises.
+
+    Parameters
+    ----------
+    timestamp : float in seconds or None
+        Timestamp for updates that do not give their own. If None, the
+        time at which the batch is committed is used.
+
+    Examples
+    --------
+    >>> with SensorBatch() as batch:
+    ...     for beam, rms in adc_rms.items():
+    ...         batch.set_value(rms_sensors[beam], rms)
+    """
+
+    def __init__(self, timestamp=None):
+        self._timestamp = timestamp
+        self._updates = []
+
+    def __len__(self):
+        return len(self._updates)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    def set(self, sensor, timestamp, status, value):
+        """Add an unchecked update to the batch.
+
+        Parameters
+        ----------
+        sensor : Sensor object
+            The sensor to update.
+        timestamp : float in seconds or None
+            The time at which the value was determined. None uses the
+            batch timestamp.
+        status : Sensor status constant
+            Whether the value represents an error condition or not.
+        value : object
+            The value of the sensor.
+        """
+        self._updates.append((sensor, timestamp, status, value))
+
+    def set_value(self, sensor, value, status=Sensor.NOMINAL, timestamp=None):
+        """Check a value and add it to the batch.
+
+        Parameters
+        ----------
+        sensor : Sensor object
+            The sensor to update.
+        value : object
+            Value of the appropriate type for the sensor.
+        status : Sensor status constant
+            Whether the value represents an error condition or not.
+        timestamp : float in seconds or None
+            The time at which the value was determined. None uses the
+            batch timestamp.
+        """
+        sensor._kattype.check(value)
+        self._updates.append((sensor, timestamp, status, value))
+
+    def discard(self):
+        """Drop all updates added so far."""
+        self._updates = []
+
+    def commit(self):
+        """Apply all updates and then notify observers once.
+
+        If a sensor appears in the batch more than once it takes the last
+        value given, and its observers are notified only once.
+
+        Returns
+        -------
+        sensors : list of Sensor objects
+            The sensors that were updated.
+        """
+        updates, self._updates = self._updates, []
+        default_timestamp = self._timestamp
+        if default_timestamp is None:
+            default_timestamp = time.time()
+
+        sensors = []
+        seen = set()
+        for sensor, timestamp, status, value in updates:
+            if timestamp is None:
+                timestamp = default_timestamp
+            sensor._set_reading(timestamp, status, value)
+            if sensor not in seen:
+                seen.add(sensor)
+                sensors.append(sensor)
+
+        Sensor.notify_many(sensors)
+        return sensors
@@ -12,6 +12,11 @@ import struct
 import re
 from .core import Message, FailReply
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # KATCP Type Classes
 #
 
@@ -373,6 +378,208 @@ class Struct(KatcpType):
             raise ValueError("Could not unpack %s from struct with format %s: %s" % (value, self._fmt, e))
 
 
+class NdArray(KatcpType):
+    """KatcpType for packing numpy arrays as a single binary parameter.
+
+    The packed value is a header giving the array's dtype and shape,
+    followed by the array's contents in C order, e.g. "<f4:2,512:...".
+    Unpacked values are read-only arrays viewing the message argument,
+    so no copy is made unless a dtype conversion is needed. Only simple
+    (non-structured, non-object) dtypes are supported. Requires numpy.
+
+    Parameters
+    ----------
+    dtype : numpy dtype or str
+        The dtype values are converted to when packed and unpacked.
+        Values of any simple dtype are accepted if not given.
+    shape : tuple of ints or None
+        The required shape of values. A None entry matches any length
+        along that axis. Values of any shape are accepted if not given.
+    """
+
+    name = "ndarray"
+
+    def __init__(self, dtype=None, shape=None, **kwargs):
+        if numpy is None:
+            raise ImportError("The ndarray type requires numpy.")
+        super(NdArray, self).__init__(**kwargs)
+        if dtype is not None:
+            dtype = self._simple_dtype(numpy.dtype(dtype))
+        self._dtype = dtype
+        self._shape = shape is not None and tuple(shape) or None
+
+    @staticmethod
+    def _simple_dtype(dtype):
+        if dtype.fields is not None or dtype.hasobject:
+            raise ValueError("Array dtype %s is not a simple dtype." % (dtype,))
+        return dtype
+
+    def encode(self, value):
+        value = numpy.require(value, dtype=self._dtype, requirements="C")
+        dtype = self._simple_dtype(value.dtype)
+        return "%s:%s:%s" % (dtype.str, ",".join([str(n) for n in value.shape]),
+                             value.tobytes())
+
+    def decode(self, value):
+        try:
+            dtype, shape, data = value.split(":", 2)
+            dtype = self._simple_dtype(numpy.dtype(dtype))
+            shape = tuple([int(n) for n in shape.split(",") if n])
+            array = numpy.frombuffer(data, dtype=dtype).reshape(shape)
+        except Exception, e:
+            raise ValueError("Could not parse value as ndarray: %s" % (e,))
+        if self._dtype is not None and dtype != self._dtype:
+            self.check(array)
+            array = array.astype(self._dtype)
+        return array
+
+    def check(self, value):
+        """Check the value's dtype and shape.
+
+        Raise a ValueError if the value cannot be converted to the dtype
+        or does not have the required shape.
+        """
+        value = numpy.asarray(value)
+        if self._dtype is not None and not numpy.can_cast(value.dtype,
+                                                          self._dtype,
+                                                          "same_kind"):
+            raise ValueError("Array dtype %s cannot be converted to %s."
+                % (value.dtype, self._dtype))
+        shape = self._shape
+        if shape is not None and (len(value.shape) != len(shape) or
+                                  [n for n, m in zip(value.shape, shape)
+                                   if m is not None and n != m]):
+            raise ValueError("Array shape %s does not match %s."
+                % (value.shape, shape))
+
+
+class Vector(KatcpType):
+    """KatcpType for fixed-length numeric vectors.
+
+    Vectors are packed as comma separated elements, e.g. "1.5,2,0.25",
+    and unpacked into one dimensional numpy arrays. Updates may instead
+    be packed as a delta against the previous value, listing only the
+    changed elements as "~index=value,index=value". Requires numpy.
+
+    Parameters
+    ----------
+    length : int or None
+        The required number of elements. Vectors of any length are
+        accepted if not given.
+    dtype : numpy dtype or str
+        The integer or float dtype of the elements.
+    """
+
+    name = "vector"
+
+    def __init__(self, length=None, dtype="float64", **kwargs):
+        if numpy is None:
+            raise ImportError("The vector type requires numpy.")
+        dtype = numpy.dtype(dtype)
+        if dtype.kind not in "iuf":
+            raise ValueError("Vector dtype %s is not an integer or float"
+                             " dtype." % (dtype,))
+        if length is not None and kwargs.get("default") is None:
+            kwargs["default"] = numpy.zeros(length, dtype=dtype)
+        super(Vector, self).__init__(**kwargs)
+        self._length = length
+        self._dtype = dtype
+        if dtype.kind == "f":
+            self._fmt, self._convert = "%.15g", float
+        else:
+            self._fmt, self._convert = "%d", int
+
+    def encode(self, value):
+        fmt = self._fmt
+        return ",".join([fmt % x for x in numpy.asarray(value).tolist()])
+
+    def decode(self, value):
+        convert = self._convert
+        try:
+            return numpy.array([convert(x) for x in value.split(",") if x],
+                               dtype=self._dtype)
+        except ValueError:
+            raise ValueError("Could not parse value '%s' as vector." % value)
+
+    def check(self, value):
+        """Check the value's length and dtype.
+
+        Raise a ValueError if the value is not a vector of the right
+        length or cannot be converted to the dtype.
+        """
+        value = numpy.asarray(value)
+        if value.ndim != 1:
+            raise ValueError("Vector must be one dimensional, not %d."
+                % (value.ndim,))
+        if self._length is not None and len(value) != self._length:
+            raise ValueError("Vector length %d is not %d."
+                % (len(value), self._length))
+        if not numpy.can_cast(value.dtype, self._dtype, "same_kind"):
+            raise ValueError("Vector dtype %s cannot be converted to %s."
+                % (value.dtype, self._dtype))
+
+    def encode_delta(self, value, last_value):
+        """Pack a value as a delta against the last value packed.
+
+        The full value is packed if there is no last value or if most of
+        the elements have changed.
+
+        Parameters
+        ----------
+        value : array of numbers
+            The value to pack.
+        last_value : array of numbers or None
+            The value the receiver already has.
+
+        Returns
+        -------
+        packed_value : str
+            The unescaped KATCP string representing the value.
+        """
+        value = numpy.asarray(value)
+        if last_value is None or numpy.shape(last_value) != value.shape:
+            return self.encode(value)
+        changed = numpy.flatnonzero(value != last_value)
+        if 2 * len(changed) > len(value):
+            return self.encode(value)
+        fmt = "%d=" + self._fmt
+        return "~" + ",".join([fmt % (i, x) for i, x
+                               in zip(changed.tolist(),
+                                      value[changed].tolist())])
+
+    def decode_delta(self, packed_value, last_value):
+        """Parse a full or delta packed value into a new vector.
+
+        Parameters
+        ----------
+        packed_value : str
+            The unescaped KATCP string to parse.
+        last_value : array of numbers or None
+            The value a delta should be applied to. It is not modified.
+
+        Returns
+        -------
+        value : array of numbers
+            The vector the KATCP string represented.
+        """
+        if not packed_value.startswith("~"):
+            return self.decode(packed_value)
+        if last_value is None:
+            raise ValueError("Vector delta '%s' has no value to apply to."
+                % (packed_value,))
+        value = numpy.array(last_value, dtype=self._dtype)
+        convert = self._convert
+        try:
+            for item in packed_value[1:].split(","):
+                if item:
+                    index, x = item.split("=")
+                    value[int(index)] = convert(x)
+        except (ValueError, IndexError):
+            raise ValueError("Could not parse value '%s' as vector delta."
+                % (packed_value,))
+        return value
+
+
 class Regex(Str):
     """String type that checks values using a regular expression.
 
@@ -540,21 +747,21 @@ def request(*types, **options):
         # Get other parameter names
         argnames = all_argnames[params_start:]
 
-        def raw_handler(self, *args):
-            if has_sock:
-                (sock, msg) = args
-                new_args = unpack_types(types, msg.arguments, argnames)
-                if include_msg:
-                    return handler(self, sock, msg, *new_args)
-                else:
-                    return handler(self, sock, *new_args)
-            else:
-                (msg,) = args
-                new_args = unpack_types(types, msg.arguments, argnames)
-                if include_msg:
-                    return handler(self, msg, *new_args)
-                else:
-                    return handler(self, *new_args)
+        # Build the argument unpacker once rather than on every call
+        unpacker = compile_unpacker(types, argnames)
+
+        if has_sock and include_msg:
+            def raw_handler(self, sock, msg):
+                return handler(self, sock, msg, *unpacker(msg.arguments))
+        elif has_sock:
+            def raw_handler(self, sock, msg):
+                return handler(self, sock, *unpacker(msg.arguments))
+        elif include_msg:
+            def raw_handler(self, msg):
+                return handler(self, msg, *unpacker(msg.arguments))
+        else:
+            def raw_handler(self, msg):
+                return handler(self, *unpacker(msg.arguments))
 
         raw_handler.__name__ = handler.__name__
         raw_handler.__doc__ = handler.__doc__
@@ -600,9 +807,9 @@ def return_reply(*types):
         if not handler.__name__.startswith("request_"):
             raise ValueError("This decorator can only be used on a katcp request handler.")
         msgname = handler.__name__[8:].replace("_","-")
+        replier = compile_reply(types)
         def raw_handler(self, *args):
-            reply_args = handler(self, *args)
-            return make_reply(msgname, types, reply_args)
+            return replier(msgname, handler(self, *args))
         raw_handler.__name__ = handler.__name__
         raw_handler.__doc__ = handler.__doc__
 
@@ -642,11 +849,13 @@ def send_reply(*types):
     ...
     """
     def decorator(handler):
+        replier = compile_reply(types)
+
         def raw_handler(self, *args):
             reply_args = handler(self, *args)
             sock = reply_args[0]
             msg = reply_args[1]
-            reply = make_reply(msg.name, types, reply_args[2:])
+            reply = replier(msg.name, reply_args[2:])
             self.reply(sock, reply, msg)
         return raw_handler
 
@@ -711,3 +920,189 @@ def pack_types(types, args):
         raise ValueError("Too many arguments to pack.")
     # if len(args) < len(types) this passes in None for missing args
     return map(lambda ktype, arg: ktype.pack(arg), types, args)
+
+def _compile_unpack_param(position, name, kattype):
+    """Return a function unpacking a single request parameter.
+
+    Values of the plain Int, Float, Str and Bool types are decoded and
+    checked inline. Other types, and missing values that need a
+    default, go through :meth:`Parameter.unpack`. Error messages are
+    identical in both cases.
+    """
+    param = Parameter(position, name, kattype)
+    generic = param.unpack
+    ktype = type(kattype)
+    prefix = "Error in parameter %s (%s): " % (position, name)
+
+    if ktype is Str:
+        def unpack(value):
+            if value is None:
+                return generic(value)
+            return value
+    elif ktype is Bool:
+        def unpack(value):
+            if value is None:
+                return generic(value)
+            if value == "1":
+                return True
+            if value == "0":
+                return False
+            raise FailReply(prefix + "Boolean value must be 0 or 1.")
+    elif ktype is Int or ktype is Float:
+        convert, typename = (ktype is Int) and (int, "integer") \
+                            or (float, "float")
+        if kattype._min is None and kattype._max is None:
+            check = None
+        else:
+            check = kattype.check
+
+        def unpack(value):
+            if value is None:
+                return generic(value)
+            try:
+                value = convert(value)
+            except:
+                raise FailReply(prefix + "Could not parse value '%s' as %s."
+                                % (value, typename))
+            if check is not None:
+                try:
+                    check(value)
+                except ValueError, message:
+                    raise FailReply(prefix + str(message))
+            return value
+    else:
+        unpack = generic
+    return unpack
+
+def compile_unpacker(types, argnames):
+    """Build a function that unpacks arguments according to a types list.
+
+    The returned function behaves like :func:`unpack_types` but does
+    the per-parameter setup once, when it is built.
+
+    Parameters
+    ----------
+    types : list of kattypes
+        The types of the arguments (in order).
+    argnames : list of strings
+        The names of the arguments.
+
+    Returns
+    -------
+    unpacker : function
+        Function taking a list of argument strings and returning a
+        list of unpacked values.
+    """
+    unpackers = []
+    for i, kattype in enumerate(types):
+        name = ""
+        if i < len(argnames):
+            name = argnames[i]
+        unpackers.append(_compile_unpack_param(i+1, name, kattype))
+    ntypes = len(unpackers)
+
+    def unpacker(args):
+        nargs = len(args)
+        if nargs == ntypes:
+            return [unpack(arg) for unpack, arg in zip(unpackers, args)]
+        if nargs > ntypes:
+            raise FailReply("Too many parameters given.")
+        # missing arguments are unpacked from None (i.e. defaults)
+        args = list(args) + [None] * (ntypes - nargs)
+        return [unpack(arg) for unpack, arg in zip(unpackers, args)]
+    return unpacker
+
+def _compile_pack_param(kattype):
+    """Return a function packing a single value with the given kattype.
+
+    The plain Int, Float, Str and Bool types are checked and encoded
+    inline. Other types, and None values, use :meth:`KatcpType.pack`.
+    """
+    generic = kattype.pack
+    ktype = type(kattype)
+
+    if ktype is Str:
+        def pack(value):
+            if value is None:
+                return generic(value)
+            return value
+    elif ktype is Bool:
+        def pack(value):
+            if value is None:
+                return generic(value)
+            return value and "1" or "0"
+    elif ktype is Int or ktype is Float:
+        fmt = (ktype is Int) and "%d" or "%.15g"
+        if kattype._min is None and kattype._max is None:
+            check = None
+        else:
+            check = kattype.check
+
+        def pack(value):
+            if value is None:
+                return generic(value)
+            if check is not None:
+                check(value)
+            return fmt % (value,)
+    else:
+        pack = generic
+    return pack
+
+def compile_packer(types):
+    """Build a function that packs arguments according to a types list.
+
+    The returned function behaves like :func:`pack_types` but does the
+    per-type setup once, when it is built.
+
+    Parameters
+    ----------
+    types : list of kattypes
+        The types of the arguments (in order).
+
+    Returns
+    -------
+    packer : function
+        Function taking a list of values and returning a list of
+        unescaped KATCP strings.
+    """
+    packers = [_compile_pack_param(kattype) for kattype in types]
+    ntypes = len(packers)
+
+    def packer(args):
+        nargs = len(args)
+        if nargs == ntypes:
+            return [pack(arg) for pack, arg in zip(packers, args)]
+        if nargs > ntypes:
+            raise ValueError("Too many arguments to pack.")
+        # missing arguments are packed from None (i.e. defaults)
+        args = list(args) + [None] * (ntypes - nargs)
+        return [pack(arg) for pack, arg in zip(packers, args)]
+    return packer
+
+def compile_reply(types):
+    """Build a function constructing replies like :func:`make_reply`.
+
+    Parameters
+    ----------
+    types : list of kattypes
+        The types of the reply message parameters (in order).
+
+    Returns
+    -------
+    replier : function
+        Function taking the name of the reply message and the
+        (unpacked) reply message parameters, and returning a reply
+        message.
+    """
+    pack_ok = compile_packer((Str(),) + tuple(types))
+    pack_fail = compile_packer((Str(), Str()))
+    reply = Message.reply
+
+    def replier(msgname, arguments):
+        status = arguments[0]
+        if status == "ok":
+            return reply(msgname, *pack_ok(arguments))
+        if status == "fail":
+            return reply(msgname, *pack_fail(arguments))
+        raise ValueError("First returned value must be 'ok' or 'fail'.")
+    return replier
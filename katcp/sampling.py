@@ -11,11 +11,29 @@
 import threading
 import time
 import logging
-import heapq
 from .core import Message, Sensor, ExcepthookThread
 
 log = logging.getLogger("katcp.sampling")
 
+try:
+    import numpy
+    from numpy import ndarray, array_equal
+except ImportError:
+    numpy = ndarray = None
+
+
+def value_changed(value, last_value):
+    """Return whether a sensor value differs from the last value sent.
+
+    Array values (from ndarray sensors) are compared element-wise. As
+    with other values, an array should be replaced rather than modified
+    in place when the sensor is updated.
+    """
+    if ndarray is not None and isinstance(value, ndarray):
+        return not (isinstance(last_value, ndarray)
+                    and array_equal(value, last_value))
+    return value != last_value
+
 # pylint: disable-msg=W0142
 
 class SampleStrategy(object):
@@ -33,7 +51,7 @@ class SampleStrategy(object):
     """
 
     # Sampling strategy constants
-    NONE, AUTO, PERIOD, EVENT, DIFFERENTIAL = range(5)
+    NONE, AUTO, PERIOD, EVENT, DIFFERENTIAL, EVENT_RATE = range(6)
 
     ## @brief Mapping from strategy constant to strategy name.
     SAMPLING_LOOKUP = {
@@ -42,6 +60,7 @@ class SampleStrategy(object):
         PERIOD: "period",
         EVENT: "event",
         DIFFERENTIAL: "differential",
+        EVENT_RATE: "event-rate",
     }
 
     # SAMPLING_LOOKUP not found by pylint
@@ -53,10 +72,20 @@ class SampleStrategy(object):
 
     # pylint: enable-msg = E0602
 
+    ## @brief SampleReactor the strategy has been added to (set by the reactor).
+    _reactor = None
+
+    ## @brief Last value sent for a vector sensor, which later updates are
+    #  sent as deltas against (None until the first full value is sent).
+    _lastSent = None
+
     def __init__(self, inform_callback, sensor, *params):
         self._inform_callback = inform_callback
         self._sensor = sensor
         self._params = params
+        # held while an inform is sampled and sent, so that vector deltas
+        # reach the client in the order they were computed
+        self._sendLock = threading.Lock()
 
     @classmethod
     def get_strategy(cls, strategyName, inform_callback, sensor, *params):
@@ -93,6 +122,8 @@ class SampleStrategy(object):
             return SampleDifferential(inform_callback, sensor, *params)
         elif strategyType == cls.PERIOD:
             return SamplePeriod(inform_callback, sensor, *params)
+        elif strategyType == cls.EVENT_RATE:
+            return SampleEventRate(inform_callback, sensor, *params)
 
     def update(self, sensor):
         """Callback used by the sensor's notify method.
@@ -132,11 +163,59 @@ class SampleStrategy(object):
         """
         pass
 
+    def sampling_period(self):
+        """Return the fixed period at which the strategy samples its sensor.
+
+        Strategies with the same period that use the :meth:`periodic` of
+        :class:`SamplePeriod` and the standard :meth:`inform` are sampled
+        together by the :class:`SampleReactor` via :meth:`sample` instead
+        of having :meth:`periodic` called separately for each of them.
+
+        Returns
+        -------
+        period : float in seconds or None
+            The sampling period, or None if the strategy schedules itself
+            using :meth:`periodic`.
+        """
+        return None
+
+    def sample(self):
+        """Return a sensor-status inform describing the sensor.
+
+        Vector sensors are reported in full the first time and after
+        that as deltas listing only the elements that have changed
+        since the last inform this strategy sent.
+
+        Returns
+        -------
+        msg : Message object
+            A #sensor-status inform with the sensor's current reading.
+        """
+        sensor = self._sensor
+        if sensor._sensor_type == Sensor.VECTOR:
+            timestamp, status, value = sensor.read()
+            packed = sensor._kattype.encode_delta(value, self._lastSent)
+            self._lastSent = numpy.array(value)
+            return Message.inform("sensor-status",
+                        Sensor.TIMESTAMP_TYPE.encode(timestamp), "1",
+                        sensor.name, Sensor.STATUSES[status], packed)
+        timestamp_ms, status, value = sensor.read_formatted()
+        return Message.inform("sensor-status",
+                    timestamp_ms, "1", sensor.name, status, value)
+
     def inform(self):
-        """Inform strategy creator of the sensor status."""
-        timestamp_ms, status, value = self._sensor.read_formatted()
-        self._inform_callback(Message.inform("sensor-status",
-                    timestamp_ms, "1", self._sensor.name, status, value))
+        """Inform strategy creator of the sensor status.
+
+        Sampling and sending happen under a per-strategy lock, so informs
+        from the sensor's thread and the reactor's thread cannot overtake
+        one another (a vector delta applied out of order would leave the
+        client with the wrong value).
+        """
+        self._sendLock.acquire()
+        try:
+            self._inform_callback(self.sample())
+        finally:
+            self._sendLock.release()
 
     def get_sampling(self):
         """Return the Strategy constant for this sampling strategy.
@@ -206,7 +285,8 @@ class SampleEvent(SampleStrategy):
         if self._nextTime is not None and (self._nextTime > now):
             return
 
-        if sensor._status != self._lastStatus or sensor._value != self._lastValue:
+        if (sensor._status != self._lastStatus
+                or value_changed(sensor._value, self._lastValue)):
             self._lastStatus = sensor._status
             self._lastValue = sensor._value
             if self._minTimeSep:
@@ -221,6 +301,120 @@ class SampleEvent(SampleStrategy):
         super(SampleEvent, self).attach()
 
 
+class SampleEventRate(SampleStrategy):
+    """Event strategy with a minimum and maximum time between updates.
+
+    Updates are sent when the sensor value or status changes, but never
+    closer together than the shortest period. A change that arrives
+    sooner is held back and the sensor's latest reading is sent as soon
+    as the shortest period has passed, so the client always ends up
+    with the final state. If the longest period is non-zero an update
+    is also sent whenever that long has passed without one.
+
+    Delayed updates are sent by the :class:`SampleReactor` the strategy
+    was added to.
+
+    Parameters
+    ----------
+    inform_callback : callable
+        Callback to send inform messages with,
+        used as inform_callback(msg).
+    sensor : Sensor object
+        Sensor to sample.
+    params : list of objects
+        The shortest and longest periods in milliseconds. A longest
+        period of zero disables the forced refresh.
+    """
+
+    ## @brief Number of milliseconds in a second (as a float).
+    MILLISECOND = 1e3
+
+    def __init__(self, inform_callback, sensor, *params):
+        SampleStrategy.__init__(self, inform_callback, sensor, *params)
+        if len(params) != 2:
+            raise ValueError("The 'event-rate' strategy takes two parameters.")
+        shortest, longest = float(params[0]), float(params[1])
+        if shortest < 0 or longest < 0:
+            raise ValueError("The event-rate periods must not be negative.")
+        if longest and longest < shortest:
+            raise ValueError("The longest period must be zero or at least"
+                             " as long as the shortest period.")
+        self._shortest = shortest / self.MILLISECOND
+        self._longest = longest / self.MILLISECOND
+        self._lock = threading.Lock()
+        self._lastStatus = None
+        self._lastValue = None
+        self._lastTime = None
+        self._pending = False
+
+    def _next_time(self):
+        """Return the time of the next delayed update (lock must be held)."""
+        if self._pending:
+            return self._lastTime + self._shortest
+        if self._longest:
+            return self._lastTime + self._longest
+        return None
+
+    def _take_sample(self, timestamp):
+        """Record that an update is being sent (lock must be held).
+
+        The inform itself is sampled and sent by :meth:`inform` once the
+        lock has been released.
+        """
+        self._lastStatus = self._sensor._status
+        self._lastValue = self._sensor._value
+        self._lastTime = timestamp
+        self._pending = False
+        return True
+
+    def update(self, sensor):
+        now = time.time()
+        send, next_time = False, None
+        self._lock.acquire()
+        try:
+            if self._lastTime is None:
+                # not sampled by the reactor yet
+                return
+            changed = (sensor._status != self._lastStatus
+                       or value_changed(sensor._value, self._lastValue))
+            if not changed:
+                # back to the value last sent, nothing to catch up on
+                self._pending = False
+                return
+            if now >= self._lastTime + self._shortest:
+                send = self._take_sample(now)
+                next_time = self._next_time()
+            elif not self._pending:
+                self._pending = True
+                next_time = self._next_time()
+        finally:
+            self._lock.release()
+
+        reactor = self._reactor
+        if next_time is not None and reactor is not None:
+            reactor.schedule(self, next_time)
+        if send:
+            self.inform()
+
+    def periodic(self, timestamp):
+        send = False
+        self._lock.acquire()
+        try:
+            if self._lastTime is None or self._pending or \
+                    (self._longest and
+                     timestamp >= self._lastTime + self._longest):
+                send = self._take_sample(timestamp)
+            next_time = self._next_time()
+        finally:
+            self._lock.release()
+        if send:
+            self.inform()
+        return next_time
+
+    def get_sampling(self):
+        return SampleStrategy.EVENT_RATE
+
+
 class SampleAuto(SampleStrategy):
     """Strategy which sends updates whenever the sensor itself is updated."""
 
@@ -253,18 +447,20 @@ class SampleNone(SampleStrategy):
 
 
 class SampleDifferential(SampleStrategy):
-    """Differential sampling strategy for integer and float sensors.
+    """Differential sampling strategy for integer, float and vector sensors.
 
     Sends updates only when the value has changed by more than some
-    specified threshold, or the status changes.
+    specified threshold, or the status changes. For vector sensors
+    the largest change of any element is compared to the threshold.
     """
 
     def __init__(self, inform_callback, sensor, *params):
         SampleStrategy.__init__(self, inform_callback, sensor, *params)
         if len(params) != 1:
             raise ValueError("The 'differential' strategy takes one parameter.")
-        if sensor._sensor_type not in (Sensor.INTEGER, Sensor.FLOAT, Sensor.TIMESTAMP):
-            raise ValueError("The 'differential' strategy is only valid for float, integer and timestamp sensors.")
+        if sensor._sensor_type not in (Sensor.INTEGER, Sensor.FLOAT, Sensor.TIMESTAMP, Sensor.VECTOR):
+            raise ValueError("The 'differential' strategy is only valid for float, integer, timestamp and vector sensors.")
+        self._difference = lambda value, last: abs(value - last)
         if sensor._sensor_type == Sensor.INTEGER:
             self._threshold = int(params[0])
             if self._threshold <= 0:
@@ -273,6 +469,11 @@ class SampleDifferential(SampleStrategy):
             self._threshold = float(params[0])
             if self._threshold <= 0:
                 raise ValueError("The diff amount must be a positive float.")
+        elif sensor._sensor_type == Sensor.VECTOR:
+            self._threshold = float(params[0])
+            if self._threshold <= 0:
+                raise ValueError("The diff amount must be a positive number.")
+            self._difference = lambda value, last: abs(value - last).max()
         else:
             # _sensor_type must be Sensor.TIMESTAMP
             self._threshold = int(params[0]) / 1000.0 # convert threshold in ms to s
@@ -282,7 +483,7 @@ class SampleDifferential(SampleStrategy):
         self._lastValue = None
 
     def update(self, sensor):
-        if sensor._status != self._lastStatus or abs(sensor._value - self._lastValue) > self._threshold:
+        if sensor._status != self._lastStatus or self._difference(sensor._value, self._lastValue) > self._threshold:
             self._lastStatus = sensor._status
             self._lastValue = sensor._value
             self.inform()
@@ -319,10 +520,129 @@ class SamplePeriod(SampleStrategy):
         self.inform()
         return timestamp + self._period
 
+    def sampling_period(self):
+        return self._period
+
     def get_sampling(self):
         return SampleStrategy.PERIOD
 
 
+def merge_sensor_status(msgs):
+    """Combine #sensor-status informs into multi-sensor informs.
+
+    Consecutive informs with the same timestamp are merged into a
+    single inform of the form::
+
+        #sensor-status timestamp count name status value [name status value ...]
+
+    A sensor is never repeated within one merged inform, so a second
+    reading of a sensor at the same timestamp starts a new inform.
+
+    Parameters
+    ----------
+    msgs : list of Message objects
+        #sensor-status informs in the order they should be reported.
+
+    Returns
+    -------
+    merged : list of Message objects
+        The merged informs, in the same order.
+    """
+    merged = []
+    timestamp, readings, names = None, [], set()
+    for msg in msgs:
+        args = msg.arguments
+        msg_timestamp = args[0]
+        msg_names = args[2::3]
+        if readings and (msg_timestamp != timestamp
+                         or names.intersection(msg_names)):
+            merged.append(Message.inform("sensor-status", timestamp,
+                                         str(len(readings) // 3), *readings))
+            readings, names = [], set()
+        timestamp = msg_timestamp
+        readings.extend(args[2:])
+        names.update(msg_names)
+    if readings:
+        merged.append(Message.inform("sensor-status", timestamp,
+                                     str(len(readings) // 3), *readings))
+    return merged
+
+
+class _PeriodGroup(object):
+    """Strategies sharing a sampling period, sampled together.
+
+    The group is scheduled on the :class:`SampleReactor` as a single
+    item. Inform callbacks with a batch method (such as those created
+    by :class:`katcp.DeviceServer`) receive all of a tick's informs for
+    their client in one call.
+
+    Parameters
+    ----------
+    period : float in seconds
+        The sampling period shared by the strategies.
+    logger : logging.Logger object
+        Python logger to write logs to.
+    """
+    def __init__(self, period, logger=log):
+        self.period = period
+        self._logger = logger
+        # replaced rather than modified so that periodic can iterate over
+        # it while strategies are added and removed
+        self._members = ()
+
+    def __len__(self):
+        return len(self._members)
+
+    def add(self, strategy):
+        """Add a strategy to the group."""
+        self._members = self._members + (strategy,)
+
+    def remove(self, strategy):
+        """Remove a strategy from the group."""
+        self._members = tuple(s for s in self._members if s is not strategy)
+
+    def periodic(self, timestamp):
+        """Sample every strategy in the group and send the informs.
+
+        Each strategy's send lock is held from sampling until its inform
+        has been sent, as in :meth:`SampleStrategy.inform`.
+        """
+        batches = {}
+        held = []
+        try:
+            for strategy in self._members:
+                strategy._sendLock.acquire()
+                try:
+                    msg = strategy.sample()
+                except Exception, e:
+                    strategy._sendLock.release()
+                    self._logger.exception(e)
+                    continue
+                callback = strategy._inform_callback
+                if hasattr(callback, "batch"):
+                    # released once the batch has been sent
+                    held.append(strategy._sendLock)
+                    batches.setdefault(callback, []).append(msg)
+                    continue
+                try:
+                    callback(msg)
+                finally:
+                    strategy._sendLock.release()
+            for callback, msgs in batches.iteritems():
+                try:
+                    callback.batch(msgs)
+                except Exception, e:
+                    self._logger.exception(e)
+        finally:
+            for lock in held:
+                lock.release()
+        return timestamp + self.period
+
+
+## @brief Slot minimum of an empty timer wheel slot.
+_NEVER = float("inf")
+
+
 class SampleReactor(ExcepthookThread):
     """SampleReactor manages sampling strategies.
 
@@ -330,21 +650,186 @@ class SampleReactor(ExcepthookThread):
     is currently used to sample each one.  It also provides a
     thread that calls periodic sampling strategies as needed.
 
+    Scheduled items are kept in a hashed timer wheel so that adding and
+    removing them is cheap no matter how many are scheduled. Each slot
+    also keeps the earliest deadline of its items, so the time of the next
+    wake is the smallest of the slot minimums. Strategies
+    which report a :meth:`SampleStrategy.sampling_period` (and do not
+    override how :class:`SamplePeriod` samples and sends) are gathered
+    into one scheduled group per period rather than being scheduled
+    individually. A strategy joining an existing group takes on the
+    group's phase.
+
     Parameters
     ----------
     logger : logging.Logger object
         Python logger to write logs to.
     """
+
+    ## @brief Width of a timer wheel slot in seconds.
+    RESOLUTION = 0.005
+
+    ## @brief Number of slots in the timer wheel.
+    WHEEL_SIZE = 2048
+
     def __init__(self, logger=log):
         super(SampleReactor, self).__init__()
         self._strategies = set()
         self._stopEvent = threading.Event()
         self._wakeEvent = threading.Event()
-        self._heap = []
         self._logger = logger
+        # lock for the wheel, scheduled items and groups
+        self._lock = threading.Lock()
+        self._wheel = [set() for _i in range(self.WHEEL_SIZE)]
+        # earliest deadline of the items in each wheel slot (_NEVER if empty)
+        self._slot_min = [_NEVER] * self.WHEEL_SIZE
+        self._entries = {} # map scheduled items to (deadline, tick)
+        self._cursor = int(time.time() / self.RESOLUTION) # next tick to check
+        self._groups = {} # map periods to _PeriodGroup objects
+        self._grouped = {} # map grouped strategies to their groups
         # set daemon True so that the app can stop even if the thread is running
         self.setDaemon(True)
 
+    def _schedule(self, item, deadline):
+        """Place an item in the wheel (lock must be held)."""
+        self._unschedule(item)
+        tick = max(int(deadline / self.RESOLUTION), self._cursor)
+        self._entries[item] = (deadline, tick)
+        index = tick % self.WHEEL_SIZE
+        self._wheel[index].add(item)
+        if deadline < self._slot_min[index]:
+            self._slot_min[index] = deadline
+
+    def _unschedule(self, item):
+        """Take an item out of the wheel if present (lock must be held)."""
+        entry = self._entries.pop(item, None)
+        if entry is not None:
+            index = entry[1] % self.WHEEL_SIZE
+            self._wheel[index].discard(item)
+            if entry[0] == self._slot_min[index]:
+                self._update_slot_min(index)
+
+    def _update_slot_min(self, index):
+        """Recalculate the earliest deadline in a slot (lock must be held)."""
+        slot = self._wheel[index]
+        if slot:
+            entries = self._entries
+            self._slot_min[index] = min([entries[item][0] for item in slot])
+        else:
+            self._slot_min[index] = _NEVER
+
+    def _pop_due(self, now):
+        """Remove and return the (deadline, item) pairs due by now."""
+        size = self.WHEEL_SIZE
+        now_tick = int(now / self.RESOLUTION)
+        due = []
+        self._lock.acquire()
+        try:
+            cursor = self._cursor
+            if now_tick - cursor >= size:
+                ticks = range(cursor, cursor + size)
+            else:
+                ticks = range(cursor, now_tick + 1)
+            for tick in ticks:
+                index = tick % size
+                if self._slot_min[index] > now:
+                    continue
+                slot = self._wheel[index]
+                for item in list(slot):
+                    deadline = self._entries[item][0]
+                    if deadline <= now:
+                        slot.discard(item)
+                        del self._entries[item]
+                        due.append((deadline, item))
+                self._update_slot_min(index)
+            self._cursor = max(cursor, now_tick)
+        finally:
+            self._lock.release()
+        due.sort()
+        return due
+
+    def _next_deadline(self):
+        """Return the earliest deadline in the wheel (None if empty)."""
+        self._lock.acquire()
+        try:
+            deadline = min(self._slot_min)
+            return None if deadline == _NEVER else deadline
+        finally:
+            self._lock.release()
+
+    def _reschedule(self, item, deadline):
+        """Put an item that was due back in the wheel if still wanted."""
+        self._lock.acquire()
+        try:
+            if isinstance(item, _PeriodGroup):
+                active = self._groups.get(item.period) is item
+            elif isinstance(item, SampleStrategy):
+                active = item in self._strategies
+            else:
+                # scheduled directly via schedule()
+                active = True
+            entry = self._entries.get(item)
+            # keep an earlier deadline set by schedule() in the meantime
+            if active and (entry is None or deadline < entry[0]):
+                self._schedule(item, deadline)
+        finally:
+            self._lock.release()
+
+    def schedule(self, item, deadline):
+        """Arrange for item.periodic(deadline) to be called at deadline.
+
+        The item is rescheduled for whatever time its periodic method
+        returns, unless it returns None. Scheduling an item that is
+        already scheduled moves it to the new deadline. Strategies that
+        are not (or no longer) added to the reactor are ignored, so a
+        strategy racing :meth:`remove_strategy` cannot schedule itself
+        again.
+
+        Parameters
+        ----------
+        item : object with a periodic method
+            The item to schedule.
+        deadline : float in seconds
+            The time at which to call item.periodic.
+        """
+        self._lock.acquire()
+        try:
+            if (isinstance(item, SampleStrategy)
+                    and item not in self._strategies):
+                return
+            self._schedule(item, deadline)
+        finally:
+            self._lock.release()
+        self._wakeEvent.set()
+
+    def cancel(self, item):
+        """Cancel an item scheduled with :meth:`schedule`.
+
+        Parameters
+        ----------
+        item : object
+            The item to remove from the schedule. Items that are not
+            scheduled are ignored.
+        """
+        self._lock.acquire()
+        try:
+            self._unschedule(item)
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _groupable(strategy):
+        """Whether a strategy can be sampled as part of a period group.
+
+        Groups call :meth:`SampleStrategy.sample` directly, so strategies
+        that change what :class:`SamplePeriod` does in :meth:`periodic`
+        or :meth:`inform` are scheduled on their own.
+        """
+        cls = type(strategy)
+        return (strategy.sampling_period() is not None
+                and cls.periodic.im_func is SamplePeriod.periodic.im_func
+                and cls.inform.im_func is SampleStrategy.inform.im_func)
+
     def add_strategy(self, strategy):
         """Add a sensor strategy to the reactor.
 
@@ -358,12 +843,36 @@ class SampleReactor(ExcepthookThread):
         strategy : SampleStrategy object
             The sampling strategy to add to the reactor.
         """
-        self._strategies.add(strategy)
+        self._lock.acquire()
+        try:
+            self._strategies.add(strategy)
+        finally:
+            self._lock.release()
+        strategy._reactor = self
         strategy.attach()
 
-        next_time = strategy.periodic(time.time())
+        now = time.time()
+        if self._groupable(strategy):
+            period = strategy.sampling_period()
+            strategy.inform()
+            self._lock.acquire()
+            try:
+                if strategy in self._strategies:
+                    group = self._groups.get(period)
+                    if group is None:
+                        group = _PeriodGroup(period, self._logger)
+                        self._groups[period] = group
+                        self._schedule(group, now + period)
+                    group.add(strategy)
+                    self._grouped[strategy] = group
+            finally:
+                self._lock.release()
+            self._wakeEvent.set()
+            return
+
+        next_time = strategy.periodic(now)
         if next_time is not None:
-            heapq.heappush(self._heap, (next_time, strategy))
+            self._reschedule(strategy, next_time)
             self._wakeEvent.set()
 
     def remove_strategy(self, strategy):
@@ -377,7 +886,20 @@ class SampleReactor(ExcepthookThread):
             The sampling strategy to remove from the reactor.
         """
         strategy.detach()
-        self._strategies.remove(strategy)
+        strategy._reactor = None
+        self._lock.acquire()
+        try:
+            self._strategies.remove(strategy)
+            group = self._grouped.pop(strategy, None)
+            if group is not None:
+                group.remove(strategy)
+                if not group:
+                    del self._groups[group.period]
+                    self._unschedule(group)
+            else:
+                self._unschedule(strategy)
+        finally:
+            self._lock.release()
 
     def stop(self):
         """Send event to processing thread and wait for it to stop."""
@@ -387,7 +909,6 @@ class SampleReactor(ExcepthookThread):
     def run(self):
         """Run the sample reactor."""
         self._logger.debug("Starting thread %s" % (threading.currentThread().getName()))
-        heap = self._heap
         wake = self._wakeEvent
 
         # save globals so that the thread can run cleanly
@@ -395,31 +916,28 @@ class SampleReactor(ExcepthookThread):
         # None.
         _time = time.time
         _currentThread = threading.currentThread
-        _push = heapq.heappush
-        _pop = heapq.heappop
 
         while not self._stopEvent.isSet():
             wake.clear()
-            if heap:
-                next_time, strategy = _pop(heap)
-                if strategy not in self._strategies:
-                    continue
-
-                wake.wait(next_time - _time())
-                if wake.isSet():
-                    _push(heap, (next_time, strategy))
-                    continue
-
+            due = self._pop_due(_time())
+            for deadline, item in due:
                 try:
-                    next_time = strategy.periodic(next_time)
-                    _push(heap, (next_time, strategy))
+                    next_time = item.periodic(deadline)
                 except Exception, e:
                     self._logger.exception(e)
                     # push ten seconds into the future and hope whatever was wrong
                     # sorts itself out
-                    _push(heap, (next_time + 10.0, strategy))
-            else:
+                    next_time = deadline + 10.0
+                if next_time is not None:
+                    self._reschedule(item, next_time)
+            if due:
+                continue
+
+            next_time = self._next_deadline()
+            if next_time is None:
                 wake.wait()
+            else:
+                wake.wait(max(next_time - _time(), 0.0))
 
         self._stopEvent.clear()
         self._logger.debug("Stopping thread %s" % (_currentThread().getName()))
@@ -20,8 +20,15 @@
 
    The acyclic requirement on the graph structure is required to ensure
    that the update chain eventually terminates. It is not enforced.
+
+   Recalculation can be deferred with :meth:`GenericSensorTree.hold_updates`
+   (or the :meth:`GenericSensorTree.deferred` context manager). While
+   updates are held, changed sensors only mark their parents dirty, and
+   each dirty parent is recalculated once when the updates are flushed.
    """
 
+import contextlib
+
 
 class GenericSensorTree(object):
     """Holds a tree of boolean sensors.
@@ -41,6 +48,12 @@ class GenericSensorTree(object):
         self._child_to_parents = {}
         # map of parent -> set of all child sensors
         self._parent_to_children = {}
+        # number of unreleased hold_updates calls
+        self._held = 0
+        # map of dirty parent -> (list of changed children, set of the
+        # same children), and the order in which the parents became dirty
+        self._dirty = {}
+        self._dirty_order = []
 
     def update(self, sensor):
         """Update callback used by sensors to notify obervers of changes.
@@ -50,10 +63,98 @@ class GenericSensorTree(object):
         sensor : :class:`katcp.Sensor`
             The sensor whose value has changed.
         """
+        if self._held:
+            self._mark_dirty(sensor)
+            return
         parents = self._child_to_parents[sensor]
         for parent in parents:
             self.recalculate(parent, (sensor,))
 
+    def update_batch(self, sensors):
+        """Update callback used by Sensor.notify_many for several sensors.
+
+        Each affected parent is recalculated once with all of its children
+        that changed.
+
+        Parameters
+        ----------
+        sensors : sequence of :class:`katcp.Sensor`
+            The sensors whose values have changed.
+        """
+        self.hold_updates()
+        try:
+            for sensor in sensors:
+                self._mark_dirty(sensor)
+        finally:
+            self.release_updates()
+
+    def _mark_dirty(self, sensor):
+        """Mark the parents of a changed sensor for recalculation."""
+        dirty = self._dirty
+        for parent in self._child_to_parents[sensor]:
+            entry = dirty.get(parent)
+            if entry is None:
+                dirty[parent] = ([sensor], set([sensor]))
+                self._dirty_order.append(parent)
+            elif sensor not in entry[1]:
+                entry[0].append(sensor)
+                entry[1].add(sensor)
+
+    def hold_updates(self):
+        """Defer recalculation until the matching :meth:`release_updates`.
+
+        Calls may be nested. While updates are held, a changed sensor only
+        marks its parents dirty. Call :meth:`flush` to recalculate the
+        dirty parents while still holding updates (once per tick, say).
+        """
+        self._held += 1
+
+    def release_updates(self):
+        """Undo one :meth:`hold_updates` call.
+
+        The dirty parents are recalculated once the last hold is released.
+        """
+        if self._held <= 0:
+            raise ValueError("Sensor tree updates are not being held.")
+        self._held -= 1
+        if not self._held:
+            self.flush()
+
+    @contextlib.contextmanager
+    def deferred(self):
+        """Context manager holding updates for the duration of a block.
+
+        Examples
+        --------
+        >>> with tree.deferred():
+        ...     for flag, value in flags:
+        ...         flag.set_value(value)
+        """
+        self.hold_updates()
+        try:
+            yield self
+        finally:
+            self.release_updates()
+
+    def flush(self):
+        """Recalculate every dirty parent once.
+
+        Parents whose values change as a result mark their own parents
+        dirty, which are recalculated in turn once the current set of
+        dirty parents has been handled.
+        """
+        self._held += 1
+        try:
+            while self._dirty_order:
+                dirty, order = self._dirty, self._dirty_order
+                self._dirty, self._dirty_order = {}, []
+                for parent in order:
+                    # skip parents removed from the tree since being marked
+                    if parent in self:
+                        self.recalculate(parent, dirty[parent][0])
+        finally:
+            self._held -= 1
+
     def recalculate(self, parent, updates):
         """Re-calculate the value of parent sensor.
 
@@ -283,7 +384,8 @@ class BooleanSensorTree(GenericSensorTree):
             The child sensors which triggered the update.
         """
         not_ok = self._parent_to_not_ok[parent]
-        children = self.children(parent) if parent in self else set()
+        # look up the child set directly rather than copying it on each update
+        children = self._parent_to_children.get(parent, ())
         for sensor in updates:
             if sensor not in children or sensor.value():
                 not_ok.discard(sensor)
@@ -9,16 +9,20 @@
 
 import socket
 import errno
-import select
 import threading
 import traceback
 import logging
 import sys
 import re
 import time
+import bisect
+import math
+import Queue
+from collections import deque
 from .core import DeviceMetaclass, ExcepthookThread, Message, MessageParser, \
-                   FailReply, AsyncReply
-from .sampling import SampleReactor, SampleStrategy, SampleNone
+                   FailReply, AsyncReply, SocketSelector, Sensor
+from .sampling import SampleReactor, SampleStrategy, SampleNone, \
+                      merge_sensor_status
 
 # logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger("katcp")
@@ -51,6 +55,337 @@ def construct_name_filter(pattern):
     return True, lambda name: name == pattern
 
 
+def regex_literal_prefix(regex):
+    """Return a literal prefix every name matched by an anchored regex has.
+
+    Parameters
+    ----------
+    regex : str
+        A regular expression as passed to re.search.
+
+    Returns
+    -------
+    prefix : str or None
+        If the expression is anchored to the start of the name with '^',
+        the longest literal string all matching names must start with
+        (possibly the empty string). None if the expression is not
+        anchored, contains alternatives or sets flags.
+    """
+    if not regex.startswith("^") or "|" in regex or "(?" in regex:
+        return None
+    prefix = []
+    i, n = 1, len(regex)
+    while i < n:
+        char = regex[i]
+        if char == "\\":
+            if i + 1 < n and not regex[i + 1].isalnum():
+                char = regex[i + 1]
+                i += 1
+            else:
+                # character classes, back references, etc.
+                break
+        elif char in ".^$*+?{}[]()":
+            break
+        i += 1
+        if i < n and regex[i] in "*?{":
+            # the previous character is optional or repeated
+            break
+        prefix.append(char)
+    return "".join(prefix)
+
+
+class SensorNameIndex(object):
+    """Sorted index of sensor names supporting pattern queries.
+
+    Patterns are interpreted as for :func:`construct_name_filter`. The
+    results of regular expression queries are cached until the set of
+    names changes. Regular expressions anchored with '^' that start with
+    literal text only scan names sharing that prefix.
+    """
+
+    ## @brief Maximum number of query results to cache.
+    CACHE_SIZE = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = [] # sorted list of names
+        self._cache = {} # map from regex patterns to lists of names
+
+    def add(self, name):
+        """Add a name to the index (no-op if already present)."""
+        self._lock.acquire()
+        try:
+            i = bisect.bisect_left(self._names, name)
+            if i == len(self._names) or self._names[i] != name:
+                self._names.insert(i, name)
+                self._cache.clear()
+        finally:
+            self._lock.release()
+
+    def remove(self, name):
+        """Remove a name from the index (no-op if not present)."""
+        self._lock.acquire()
+        try:
+            i = bisect.bisect_left(self._names, name)
+            if i < len(self._names) and self._names[i] == name:
+                del self._names[i]
+                self._cache.clear()
+        finally:
+            self._lock.release()
+
+    def _prefixed(self, prefix):
+        """Return the sorted names starting with prefix (lock held)."""
+        names = self._names
+        start = bisect.bisect_left(names, prefix)
+        if not prefix:
+            return names[start:]
+        # every name with the prefix sorts before prefix + a max char
+        end = bisect.bisect_left(names, prefix + "\xff", start)
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+        return names[start:end]
+
+    def match(self, pattern):
+        """Return the sorted names matching a pattern.
+
+        Parameters
+        ----------
+        pattern : None or str
+            None to match all names, a regular expression between
+            slashes or an exact name.
+
+        Returns
+        -------
+        exact : bool
+            True if the pattern was an exact name.
+        names : list of str
+            The matching names in sorted order.
+        """
+        self._lock.acquire()
+        try:
+            if pattern is None:
+                return False, list(self._names)
+            if not (pattern.startswith('/') and pattern.endswith('/')):
+                i = bisect.bisect_left(self._names, pattern)
+                if i < len(self._names) and self._names[i] == pattern:
+                    return True, [pattern]
+                return True, []
+            names = self._cache.get(pattern)
+            if names is None:
+                regex = pattern[1:-1]
+                name_re = re.compile(regex)
+                prefix = regex_literal_prefix(regex)
+                if prefix is None:
+                    candidates = self._names
+                else:
+                    candidates = self._prefixed(prefix)
+                names = [name for name in candidates
+                         if name_re.search(name) is not None]
+                if len(self._cache) >= self.CACHE_SIZE:
+                    self._cache.clear()
+                self._cache[pattern] = names
+            return False, list(names)
+        finally:
+            self._lock.release()
+
+
+def inline_request(handler):
+    """Decorator for request handlers which should never use the worker pool.
+
+    When a device server dispatches requests to a pool of handler threads,
+    handlers marked with this decorator are still run directly on the
+    server thread (provided the client has no earlier requests waiting
+    in the pool). It is intended for cheap requests that should be
+    answered promptly while slow requests are busy.
+
+    Should be applied outside any other request decorators.
+
+    Examples
+    --------
+    >>> class MyDevice(DeviceServer):
+    ...     @inline_request
+    ...     def request_ping(self, sock, msg):
+    ...         return Message.reply("ping", "ok")
+    ...
+    """
+    handler._inline_request = True
+    return handler
+
+
+class ServerStats(object):
+    """Statistics on the load a device server is handling.
+
+    Updates are cheap counter increments. Derived values such as rates
+    and percentiles are only calculated when asked for.
+    """
+
+    ## @brief Number of recent latencies kept for each request name.
+    LATENCY_SAMPLES = 1000
+
+    ## @brief Time window (in seconds) over which rates are calculated.
+    RATE_WINDOW = 10.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {} # map request names to deques of latencies
+        self._requests = deque() # times of recent requests
+        self._informs = deque() # (time, count) pairs for recent informs
+        self._bytes_in = {} # map client sockets to bytes received
+        self._bytes_out = {} # map client sockets to bytes sent
+
+    def _trim(self, events, now):
+        """Drop events older than the rate window (lock must be held)."""
+        cutoff = now - self.RATE_WINDOW
+        while events and events[0][0] < cutoff:
+            events.popleft()
+
+    def request_handled(self, name, latency):
+        """Record that a request was handled.
+
+        Parameters
+        ----------
+        name : str
+            Name of the request.
+        latency : float in seconds
+            Time taken to handle the request and send the reply.
+        """
+        now = time.time()
+        self._lock.acquire()
+        try:
+            latencies = self._latencies.get(name)
+            if latencies is None:
+                latencies = self._latencies[name] = \
+                    deque(maxlen=self.LATENCY_SAMPLES)
+            latencies.append(latency)
+            self._requests.append((now, 1))
+            self._trim(self._requests, now)
+        finally:
+            self._lock.release()
+
+    def informs_sent(self, count=1):
+        """Record that inform messages were sent."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._informs.append((now, count))
+            self._trim(self._informs, now)
+        finally:
+            self._lock.release()
+
+    def received(self, sock, nbytes):
+        """Record bytes received from a client."""
+        self._lock.acquire()
+        try:
+            self._bytes_in[sock] = self._bytes_in.get(sock, 0) + nbytes
+        finally:
+            self._lock.release()
+
+    def sent(self, sock, nbytes):
+        """Record bytes sent to a client."""
+        self._lock.acquire()
+        try:
+            self._bytes_out[sock] = self._bytes_out.get(sock, 0) + nbytes
+        finally:
+            self._lock.release()
+
+    def forget(self, sock):
+        """Discard the byte counts of a client that has gone away."""
+        self._lock.acquire()
+        try:
+            self._bytes_in.pop(sock, None)
+            self._bytes_out.pop(sock, None)
+        finally:
+            self._lock.release()
+
+    def bytes_in(self, sock):
+        """Return the number of bytes received from a client."""
+        return self._bytes_in.get(sock, 0)
+
+    def bytes_out(self, sock):
+        """Return the number of bytes sent to a client."""
+        return self._bytes_out.get(sock, 0)
+
+    def _rate(self, events):
+        """Return events per second over the rate window."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._trim(events, now)
+            total = sum([count for _t, count in events])
+        finally:
+            self._lock.release()
+        return total / self.RATE_WINDOW
+
+    def request_rate(self):
+        """Return the number of requests handled per second."""
+        return self._rate(self._requests)
+
+    def inform_rate(self):
+        """Return the number of informs sent per second."""
+        return self._rate(self._informs)
+
+    def latency_percentile(self, name, percentile):
+        """Return a percentile of the recent latencies of a request.
+
+        Parameters
+        ----------
+        name : str
+            Name of the request.
+        percentile : float
+            The percentile to return, between 0 and 100.
+
+        Returns
+        -------
+        latency : float in seconds
+            The latency below which the given percentage of recent
+            requests completed (0.0 if there have been none).
+        """
+        self._lock.acquire()
+        try:
+            latencies = sorted(self._latencies.get(name, ()))
+        finally:
+            self._lock.release()
+        if not latencies:
+            return 0.0
+        # nearest-rank percentile
+        rank = int(math.ceil(percentile / 100.0 * len(latencies)))
+        return latencies[min(max(rank, 1), len(latencies)) - 1]
+
+
+class ComputedSensor(Sensor):
+    """A sensor whose value is calculated each time it is read.
+
+    Such sensors are never set, so only the period sampling strategy
+    reports changes in their value.
+
+    Parameters
+    ----------
+    sensor_type : Sensor type constant
+        The type of sensor.
+    name : str
+        The name of the sensor.
+    description : str
+        A short description of the sensor.
+    units : str
+        The units of the sensor value.
+    params : list
+        Additional parameters, as for :class:`Sensor`.
+    reader : callable
+        Called with no arguments to get the sensor's current value.
+    """
+
+    __slots__ = ["_reader"]
+
+    def __init__(self, sensor_type, name, description, units, params, reader):
+        super(ComputedSensor, self).__init__(sensor_type, name, description,
+                                             units, params)
+        self._reader = reader
+        self._status = Sensor.NOMINAL
+
+    def read(self):
+        return (time.time(), Sensor.NOMINAL, self._reader())
+
+
 class DeviceServerBase(object):
     """Base class for device servers.
 
@@ -81,11 +416,23 @@ class DeviceServerBase(object):
         Maximum number of stack frames to send in error tracebacks.
     logger : logging.Logger object
         Logger to log messages to.
+    handler_threads : int
+        Number of threads to run request handlers on. If zero (the
+        default) requests are handled directly on the server thread.
+        Otherwise requests are handled by a pool of this many threads.
+        Requests from a single client are always handled one at a time
+        and in the order they arrived so that replies to each client
+        remain ordered. Handlers decorated with :func:`inline_request`
+        are run on the server thread whenever that does not break the
+        ordering.
     """
 
     __metaclass__ = DeviceMetaclass
 
-    def __init__(self, host, port, tb_limit=20, logger=log):
+    ## @brief Number of pending connections the server socket will queue.
+    LISTEN_BACKLOG = 128
+
+    def __init__(self, host, port, tb_limit=20, logger=log, handler_threads=0):
         self._parser = MessageParser()
         self._bindaddr = (host, port)
         self._tb_limit = tb_limit
@@ -99,6 +446,17 @@ class DeviceServerBase(object):
         self._socks = [] # list of client sockets
         self._waiting_chunks = {} # map from client sockets to partial messages
         self._sock_locks = {} # map from client sockets to socket sending locks
+        self._selector = None # SocketSelector while the server is running
+        self._stats = None # ServerStats object if statistics are kept
+
+        # request handler pool
+        self._handler_threads = handler_threads
+        self._handler_pool = [] # worker threads while the server is running
+        self._handler_queue = None # client sockets with work to do
+        self._pending_lock = threading.Lock()
+        # map from client sockets to deques of requests not yet completed,
+        # the request at the head of each deque is the one being handled
+        self._pending = {}
 
     def _log_msg(self, level_name, msg, name, timestamp=None):
         """Create a katcp logging inform message.
@@ -127,7 +485,7 @@ class DeviceServerBase(object):
             # our message packets are small, don't delay sending them.
             sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
         sock.bind(bindaddr)
-        sock.listen(5)
+        sock.listen(self.LISTEN_BACKLOG)
         return sock
 
     def _add_socket(self, sock):
@@ -137,12 +495,23 @@ class DeviceServerBase(object):
             self._socks.append(sock)
             self._waiting_chunks[sock] = ""
             self._sock_locks[sock] = threading.Lock()
+            if self._selector is not None:
+                self._selector.register(sock)
         finally:
             self._data_lock.release()
 
     def _remove_socket(self, sock):
         """Remove a client socket from the socket and chunk lists."""
+        selector = self._selector
+        if selector is not None:
+            selector.unregister(sock)
         sock.close()
+        self._pending_lock.acquire()
+        try:
+            # requests already running are allowed to finish
+            self._pending.pop(sock, None)
+        finally:
+            self._pending_lock.release()
         self._data_lock.acquire()
         try:
             if sock in self._socks:
@@ -222,6 +591,44 @@ class DeviceServerBase(object):
     def handle_request(self, sock, msg):
         """Dispatch a request message to the appropriate method.
 
+        If the server has a pool of handler threads the request is
+        queued for the pool, otherwise it is handled immediately.
+
+        Parameters
+        ----------
+        sock : socket.socket object
+            The socket the message was from.
+        msg : Message object
+            The request message to process.
+        """
+        if not self._handler_pool:
+            self._dispatch_request(sock, msg)
+            return
+
+        handler = self._request_handlers.get(msg.name)
+        inline = handler is None or getattr(handler, "_inline_request", False)
+
+        self._pending_lock.acquire()
+        try:
+            pending = self._pending.get(sock)
+            if pending is None:
+                # if nothing is queued ahead of an inline request
+                # it can run straight away without breaking ordering
+                if not inline:
+                    self._pending[sock] = deque([msg])
+                    self._handler_queue.put(sock)
+            else:
+                pending.append(msg)
+                inline = False
+        finally:
+            self._pending_lock.release()
+
+        if inline:
+            self._dispatch_request(sock, msg)
+
+    def _dispatch_request(self, sock, msg):
+        """Call the handler for a request and send the reply.
+
         Parameters
         ----------
         sock : socket.socket object
@@ -229,6 +636,9 @@ class DeviceServerBase(object):
         msg : Message object
             The request message to process.
         """
+        stats = self._stats
+        if stats is not None:
+            start = time.time()
         send_reply = True
         if msg.name in self._request_handlers:
             try:
@@ -258,6 +668,72 @@ class DeviceServerBase(object):
 
         if send_reply:
             self.reply(sock, reply, msg)
+        if stats is not None:
+            stats.request_handled(msg.name, time.time() - start)
+
+    def _handler_worker(self, _queue):
+        """Handle queued requests until a None client is received.
+
+        Each item taken from the queue is a client with pending requests.
+        The worker handles only the request at the head of that client's
+        queue and then, if more requests are waiting, puts the client
+        back at the end of the queue so that busy clients cannot starve
+        the others. A request that raises AsyncReply counts as handled.
+        """
+        while True:
+            sock = _queue.get()
+            if sock is None:
+                break
+
+            self._pending_lock.acquire()
+            try:
+                pending = self._pending.get(sock)
+                msg = pending[0] if pending else None
+            finally:
+                self._pending_lock.release()
+            if msg is None:
+                # client disconnected while waiting
+                continue
+
+            self._dispatch_request(sock, msg)
+
+            self._pending_lock.acquire()
+            try:
+                if self._pending.get(sock) is pending:
+                    pending.popleft()
+                    if pending:
+                        _queue.put(sock)
+                    else:
+                        del self._pending[sock]
+            finally:
+                self._pending_lock.release()
+
+    def _start_handler_pool(self):
+        """Start the request handler threads, if any."""
+        # each pool gets a fresh queue so that workers left running by
+        # an earlier pool never take work from the current one
+        self._handler_queue = Queue.Queue()
+        for i in range(self._handler_threads):
+            thread = ExcepthookThread(target=self._handler_worker,
+                                      args=(self._handler_queue,),
+                                      name="katcp-handler-%d" % (i,))
+            thread.setDaemon(True)
+            thread.start()
+            self._handler_pool.append(thread)
+
+    def _stop_handler_pool(self, timeout=1.0):
+        """Stop the request handler threads and discard pending requests."""
+        pool, self._handler_pool = self._handler_pool, []
+        self._pending_lock.acquire()
+        try:
+            self._pending.clear()
+        finally:
+            self._pending_lock.release()
+        for _thread in pool:
+            self._handler_queue.put(None)
+        self._handler_queue = None
+        for thread in pool:
+            thread.join(timeout)
 
     def handle_inform(self, sock, msg):
         """Dispatch an inform message to the appropriate method.
@@ -316,15 +792,33 @@ class DeviceServerBase(object):
         msg : Message object
             The message to send.
         """
-        # TODO: should probably implement this as a queue of sockets and messages to send.
-        #       and have the queue processed in the main loop
         data = str(msg) + "\n"
-        datalen = len(data)
-        totalsent = 0
 
         # Log all sent messages here so no one else has to.
         self._logger.debug(data)
 
+        if self._stats is not None and msg.mtype == Message.INFORM:
+            self._stats.informs_sent()
+        self._send_data(sock, data)
+
+    def _send_data(self, sock, data):
+        """Send already encoded message data to a particular client.
+
+        Note that failed sends disconnect the client sock and call
+        on_client_disconnect. They do not raise exceptions.
+
+        Parameters
+        ----------
+        sock : socket.socket object
+            The socket to send the data to.
+        data : str
+            One or more encoded messages, each terminated by a newline.
+        """
+        # TODO: should probably implement this as a queue of sockets and messages to send.
+        #       and have the queue processed in the main loop
+        datalen = len(data)
+        totalsent = 0
+
         # sends are locked per-socket -- i.e. only one send per socket at a time
         lock = self._sock_locks.get(sock)
         if lock is None:
@@ -358,6 +852,9 @@ class DeviceServerBase(object):
         finally:
             lock.release()
 
+        if self._stats is not None:
+            self._stats.sent(sock, totalsent)
+
         if send_failed:
             try:
                 client_name = sock.getpeername()
@@ -389,19 +886,71 @@ class DeviceServerBase(object):
         assert (msg.mtype == Message.INFORM)
         self._send_message(sock, msg)
 
-    def mass_inform(self, msg):
+    def inform_batch(self, sock, msgs):
+        """Send several inform messages to a particular client at once.
+
+        The messages are encoded together and sent with a single write
+        where possible.
+
+        Parameters
+        ----------
+        sock : socket.socket object
+            The client to send the messages to.
+        msgs : list of Message objects
+            The inform messages to send, in order.
+        """
+        if getattr(self.inform, "im_func", None) is not \
+                DeviceServerBase.inform.im_func:
+            # keep subclasses that intercept inform working
+            for msg in msgs:
+                self.inform(sock, msg)
+            return
+
+        for msg in msgs:
+            assert (msg.mtype == Message.INFORM)
+        data = "".join([str(msg) + "\n" for msg in msgs])
+        if not data:
+            return
+        self._logger.debug(data)
+        if self._stats is not None:
+            self._stats.informs_sent(len(msgs))
+        self._send_data(sock, data)
+
+    def mass_inform(self, msg, sock_filter=None):
         """Send an inform message to all clients.
 
+        The message is encoded once and the same data is sent to every
+        client. Recipients are chosen before the message is encoded, so
+        nothing is encoded if no client wants the message.
+
         Parameters
         ----------
         msg : Message object
             The inform message to send.
+        sock_filter : function or None
+            If given, called with each client socket and the message is
+            only sent to clients for which it returns True.
         """
         assert (msg.mtype == Message.INFORM)
-        for sock in list(self._socks):
-            if sock is self._sock:
-                continue
-            self.inform(sock, msg)
+        socks = [sock for sock in list(self._socks) if sock is not self._sock]
+        if sock_filter is not None:
+            socks = [sock for sock in socks if sock_filter(sock)]
+        if not socks:
+            return
+
+        if getattr(self.inform, "im_func", None) is not \
+                DeviceServerBase.inform.im_func:
+            # keep subclasses that intercept inform working
+            for sock in socks:
+                self.inform(sock, msg)
+            return
+
+        data = str(msg) + "\n"
+        self._logger.debug(data)
+        if self._stats is not None:
+            self._stats.informs_sent(len(socks))
+        for sock in socks:
+            self._send_data(sock, data)
 
     def reply(self, sock, reply, orig_req):
         """Send an asynchronous reply to an earlier request.
@@ -439,6 +988,106 @@ class DeviceServerBase(object):
         inform.mid = orig_req.mid
         self._send_message(sock, inform)
 
+    @staticmethod
+    def encode_inform_line(name, *args):
+        """Encode an inform for use with :meth:`reply_with_encoded_informs`.
+
+        Parameters
+        ----------
+        name : str
+            The name of the inform.
+        args : list of str
+            The inform arguments.
+
+        Returns
+        -------
+        line : str
+            The escaped arguments of the inform (each preceded by a
+            space) followed by a newline. The inform's type and name,
+            and any message id, are added when the inform is sent.
+        """
+        return str(Message.inform(name, *args))[len(name) + 1:] + "\n"
+
+    def can_send_encoded(self):
+        """Return True if replies may be sent as pre-encoded data.
+
+        This is not the case when :meth:`reply` or :meth:`reply_inform`
+        have been replaced (by a subclass or a test harness, say), since
+        pre-encoded data would bypass them.
+        """
+        return getattr(self.reply_inform, "im_func", None) is \
+                DeviceServerBase.reply_inform.im_func and \
+            getattr(self.reply, "im_func", None) is \
+                DeviceServerBase.reply.im_func
+
+    def reply_with_encoded_informs(self, sock, name, lines, reply, orig_req):
+        """Send pre-encoded informs and a reply with a single write.
+
+        The message id of the original request is spliced into each of
+        the informs and the reply.
+
+        Parameters
+        ----------
+        sock : socket.socket object
+            The client to send the informs and reply to.
+        name : str
+            The name of the informs.
+        lines : list of str
+            The informs, each encoded by :meth:`encode_inform_line`.
+        reply : Message object
+            The reply message to send after the informs.
+        orig_req : Message object
+            The request message being replied to.
+        """
+        assert (reply.mtype == Message.REPLY)
+        mid = orig_req.mid
+        if mid is None:
+            prefix = "#" + name
+        else:
+            prefix = "#%s[%s]" % (name, mid)
+        reply.mid = mid
+        data = "".join([prefix + line for line in lines]) + str(reply) + "\n"
+        self._logger.debug(data)
+        if self._stats is not None:
+            self._stats.informs_sent(len(lines))
+        self._send_data(sock, data)
+
+    def _rebind(self):
+        """Replace a dead server socket with a new one on the same address."""
+        self._logger.warn("Server socket died, attempting to restart it.")
+        self._selector.unregister(self._sock)
+        self._sock.close()
+        self._sock = self._bind(self._bindaddr)
+        self._selector.register(self._sock)
+
+    def _accept(self):
+        """Accept all pending client connections on the server socket."""
+        while True:
+            try:
+                client, addr = self._sock.accept()
+            except socket.error, e:
+                if e.args[0] in (errno.EINTR, errno.ECONNABORTED):
+                    # connection went away before we got to it
+                    continue
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # no more connections waiting
+                    return
+                raise
+            client.setblocking(0)
+            self.mass_inform(Message.inform("client-connected",
+                "New client connected from %s" % (addr,)))
+            self._add_socket(client)
+            self.on_client_connect(client)
+
+    def _check_sockets(self):
+        """Remove sockets that were closed without going through the server."""
+        for sock in self._selector.closed():
+            if sock is self._sock:
+                self._rebind()
+            else:
+                self._remove_socket(sock)
+                self.on_client_disconnect(sock, "Client socket died", False)
+
     def run(self):
         """Listen for clients and process their requests."""
         timeout = 0.5 # s
@@ -446,77 +1095,86 @@ class DeviceServerBase(object):
         # save globals so that the thread can run cleanly
         # even while Python is setting module globals to
         # None.
-        _select = select.select
         _socket_error = socket.error
+        _time = time.time
+        _read, _error = SocketSelector.READ, SocketSelector.ERROR
 
         self._sock = self._bind(self._bindaddr)
         # replace bindaddr with real address so we can rebind
         # to the same port.
         self._bindaddr = self._sock.getsockname()
 
+        # sockets are registered with the selector as they come and go
+        # rather than being collected up on every pass through the loop.
+        self._data_lock.acquire()
+        try:
+            self._selector = SocketSelector()
+            self._selector.register(self._sock)
+            for sock in self._socks:
+                self._selector.register(sock)
+        finally:
+            self._data_lock.release()
+        last_check = _time()
+
+        self._start_handler_pool()
         self._running.set()
         while self._running.isSet():
-            all_socks = self._socks + [self._sock]
             try:
-                readers, _writers, errors = _select(
-                    all_socks, [], all_socks, timeout
-                )
+                ready = self._selector.select(timeout)
             except Exception, e:
                 # catch Exception because class of exception thrown
                 # varies drastically between Mac and Linux
                 self._logger.debug("Select error: %s" % (e,))
+                ready = []
 
-                # search for broken socket
-                for sock in list(self._socks):
-                    try:
-                        _readers, _writers, _errors = _select([sock], [], [], 0)
-                    except Exception, e:
-                        self._remove_socket(sock)
-                        self.on_client_disconnect(sock, "Client socket died with error %s" % (e,), False)
-                # check server socket
-                try:
-                    _readers, _writers, _errors = _select([self._sock], [], [], 0)
-                except:
-                    self._logger.warn("Server socket died, attempting to restart it.")
-                    self._sock = self._bind(self._bindaddr)
-                # try select again
-                continue
+            # look for sockets closed behind our back whenever the
+            # loop is idle and at least once per timeout when busy
+            now = _time()
+            if not ready or now - last_check > timeout:
+                last_check = now
+                self._check_sockets()
 
-            for sock in errors:
+            for sock, events in ready:
                 if sock is self._sock:
-                    # server socket died, attempt restart
-                    self._sock = self._bind(self._bindaddr)
-                else:
+                    if events & _error:
+                        # server socket died, attempt restart
+                        self._rebind()
+                    else:
+                        self._accept()
+                    continue
+
+                if sock not in self._sock_locks:
+                    # removed earlier in this pass
+                    continue
+                if events & _error:
                     # client socket died, remove it
                     self._remove_socket(sock)
                     self.on_client_disconnect(sock, "Client socket died", False)
+                    continue
 
-            for sock in readers:
-                if sock is self._sock:
-                    client, addr = sock.accept()
-                    client.setblocking(0)
-                    self.mass_inform(Message.inform("client-connected",
-                        "New client connected from %s" % (addr,)))
-                    self._add_socket(client)
-                    self.on_client_connect(client)
+                try:
+                    chunk = sock.recv(4096)
+                except _socket_error:
+                    # an error when sock was within ready list presumably
+                    # means the client needs to be ditched.
+                    chunk = ""
+                if chunk:
+                    if self._stats is not None:
+                        self._stats.received(sock, len(chunk))
+                    self._handle_chunk(sock, chunk)
                 else:
-                    try:
-                        chunk = sock.recv(4096)
-                    except _socket_error:
-                        # an error when sock was within ready list presumably
-                        # means the client needs to be ditched.
-                        chunk = ""
-                    if chunk:
-                        self._handle_chunk(sock, chunk)
-                    else:
-                        # no data, assume socket EOF
-                        self._remove_socket(sock)
-                        self.on_client_disconnect(sock, "Socket EOF", False)
+                    # no data, assume socket EOF
+                    self._remove_socket(sock)
+                    self.on_client_disconnect(sock, "Socket EOF", False)
+
+        self._stop_handler_pool()
 
         for sock in list(self._socks):
             self.on_client_disconnect(sock, "Device server shutting down.", True)
             self._remove_socket(sock)
 
+        self._selector.close()
+        self._selector = None
         self._sock.close()
 
     def start(self, timeout=None, daemon=None, excepthook=None):
@@ -612,6 +1270,89 @@ class DeviceServerBase(object):
         pass
 
 
+class ClientInformer(object):
+    """Inform callback for sampling strategies belonging to one client.
+
+    Calling the informer sends a single inform to the client. Its
+    batch method sends several informs together, which the sample
+    reactor uses when many strategies fire at the same time.
+
+    If the server has sensor status batching enabled (see
+    :meth:`DeviceServer.set_sensor_status_batching`) #sensor-status
+    informs are held back for the flush interval and then sent as
+    multi-sensor informs.
+
+    Parameters
+    ----------
+    server : DeviceServer object
+        The server to send informs through.
+    sock : socket.socket object
+        The client to send informs to.
+    """
+    __slots__ = ["_server", "_sock", "_lock", "_pending"]
+
+    def __init__(self, server, sock):
+        self._server = server
+        self._sock = sock
+        self._lock = threading.Lock()
+        self._pending = [] # #sensor-status informs waiting to be flushed
+
+    def __call__(self, msg):
+        if msg.name == "sensor-status" and self._hold([msg]):
+            return
+        self._server.inform(self._sock, msg)
+
+    def batch(self, msgs):
+        """Send a list of informs to the client."""
+        if self._hold(msgs):
+            return
+        self._server.inform_batch(self._sock, msgs)
+
+    def _hold(self, msgs):
+        """Queue informs until the next flush if batching is enabled.
+
+        Returns True if the informs were queued.
+        """
+        interval = getattr(self._server, "_status_flush_interval", None)
+        reactor = getattr(self._server, "_reactor", None)
+        if not interval or reactor is None:
+            return False
+        self._lock.acquire()
+        try:
+            first = not self._pending
+            self._pending.extend(msgs)
+        finally:
+            self._lock.release()
+        if first:
+            reactor.schedule(self, time.time() + interval)
+        return True
+
+    def periodic(self, timestamp):
+        """Flush pending informs when called by the sample reactor."""
+        self.flush()
+
+    def flush(self):
+        """Send any pending #sensor-status informs as combined informs."""
+        self._lock.acquire()
+        try:
+            msgs, self._pending = self._pending, []
+        finally:
+            self._lock.release()
+        if msgs:
+            self._server.inform_batch(self._sock, merge_sensor_status(msgs))
+
+    def cancel(self):
+        """Discard pending informs (e.g. because the client went away)."""
+        reactor = getattr(self._server, "_reactor", None)
+        if reactor is not None:
+            reactor.cancel(self)
+        self._lock.acquire()
+        try:
+            self._pending = []
+        finally:
+            self._lock.release()
+
+
 class DeviceServer(DeviceServerBase):
     """Implements some standard messages on top of DeviceServerBase.
 
@@ -628,6 +1369,7 @@ class DeviceServer(DeviceServerBase):
       * halt
       * help
       * log-level
+      * client-log-level
       * restart [#restartf1]_
       * client-list
       * sensor-list
@@ -666,6 +1408,13 @@ class DeviceServer(DeviceServerBase):
     ## @brief Device server build / instance information.
     BUILD_INFO = ("name", 0, 1, "")
 
+    ## @brief Whether to add sensors describing the server's own load.
+    PERFORMANCE_SENSORS = False
+
+    ## @brief Latency percentiles reported for each request by the
+    # performance sensors.
+    LATENCY_PERCENTILES = (50, 90, 99)
+
     ## @var log
     # @brief DeviceLogger instance for sending log messages to the client.
 
@@ -677,11 +1426,26 @@ class DeviceServer(DeviceServerBase):
         self.log = DeviceLogger(self, python_logger=self._logger)
         self._restart_queue = None
         self._sensors = {} # map names to sensor objects
+        self._sensor_index = SensorNameIndex()
+        # map sensor names to memoized #sensor-list inform lines
+        self._sensor_list_lines = {}
+        # memoized #help inform lines (for all requests, and by name)
+        self._help_lines = None
+        self._help_line = {}
         self._reactor = None # created in run
         # map client sockets to map of sensors -> sampling strategies
         self._strategies = {}
+        # map client sockets to inform callbacks for their strategies
+        self._informers = {}
+        # time to collect #sensor-status informs for (None to disable)
+        self._status_flush_interval = None
         # strat lock (should be held for updates to _strategies)
         self._strat_lock = threading.Lock()
+        # map client sockets to their performance sensors
+        self._client_sensors = {}
+        if self.PERFORMANCE_SENSORS:
+            self._stats = ServerStats()
+            self._add_performance_sensors()
         self.setup_sensors()
 
     # pylint: enable-msg = W0142
@@ -697,8 +1461,11 @@ class DeviceServer(DeviceServerBase):
         self._strat_lock.acquire()
         try:
             self._strategies[sock] = {} # map of sensors -> sampling strategies
+            self._informers[sock] = ClientInformer(self, sock)
         finally:
             self._strat_lock.release()
+        if self._stats is not None:
+            self._add_client_sensors(sock)
         self.inform(sock, Message.inform("version", self.version()))
         self.inform(sock, Message.inform("build-state", self.build_state()))
 
@@ -715,9 +1482,16 @@ class DeviceServer(DeviceServerBase):
             True if sock is still open for sending,
             False otherwise.
         """
+        self.log.set_client_log_level(sock, None)
+        if self._stats is not None:
+            self._remove_client_sensors(sock)
+
         self._strat_lock.acquire()
         try:
             strategies = self._strategies.pop(sock, None)
+            informer = self._informers.pop(sock, None)
+            if informer is not None:
+                informer.cancel()
             if strategies is not None:
                 for sensor, strategy in list(strategies.items()):
                     del strategies[sensor]
@@ -728,6 +1502,84 @@ class DeviceServer(DeviceServerBase):
         if sock_valid:
             self.inform(sock, Message.inform("disconnect", msg))
 
+    def _pending_requests(self, sock=None):
+        """Return the number of requests given to the handler threads.
+
+        These are the requests received but not yet answered, counting
+        the ones being handled as well as the ones waiting for a thread.
+        Requests handled on the server thread are never counted. This is
+        an inbound measure; replies waiting to be sent are not included.
+
+        Parameters
+        ----------
+        sock : socket.socket object or None
+            Count only this client's requests, or all requests if None.
+        """
+        self._pending_lock.acquire()
+        try:
+            if sock is not None:
+                return len(self._pending.get(sock, ()))
+            return sum([len(pending) for pending in self._pending.values()])
+        finally:
+            self._pending_lock.release()
+
+    def _add_performance_sensors(self):
+        """Add sensors describing the load on the server."""
+        stats = self._stats
+        self.add_sensor(ComputedSensor(Sensor.FLOAT, "server.request-rate",
+            "Requests handled per second.", "Hz", [0.0, 1e9],
+            stats.request_rate))
+        self.add_sensor(ComputedSensor(Sensor.FLOAT, "server.inform-rate",
+            "Informs sent per second.", "Hz", [0.0, 1e9],
+            stats.inform_rate))
+        self.add_sensor(ComputedSensor(Sensor.INTEGER,
+            "server.pending-requests",
+            "Requests queued for or running on a handler thread.", "",
+            [0, 2**31 - 1], self._pending_requests))
+        self.add_sensor(ComputedSensor(Sensor.INTEGER, "server.clients",
+            "Number of connected clients.", "", [0, 2**31 - 1],
+            lambda: len(self._socks)))
+
+        def latency(name, percentile):
+            return lambda: stats.latency_percentile(name, percentile) * 1e3
+
+        for name in sorted(self._request_handlers):
+            for percentile in self.LATENCY_PERCENTILES:
+                self.add_sensor(ComputedSensor(Sensor.FLOAT,
+                    "server.request.%s.latency-p%d" % (name, percentile),
+                    "%dth percentile of recent ?%s latencies."
+                    % (percentile, name), "ms", [0.0, 1e9],
+                    latency(name, percentile)))
+
+    def _add_client_sensors(self, sock):
+        """Add performance sensors for a newly connected client."""
+        stats = self._stats
+        try:
+            prefix = "server.client.%s:%d" % sock.getpeername()[:2]
+        except socket.error:
+            return
+        sensors = [
+            ComputedSensor(Sensor.INTEGER, prefix + ".bytes-in",
+                "Bytes received from the client.", "B", [0, 2**63 - 1],
+                lambda: stats.bytes_in(sock)),
+            ComputedSensor(Sensor.INTEGER, prefix + ".bytes-out",
+                "Bytes sent to the client.", "B", [0, 2**63 - 1],
+                lambda: stats.bytes_out(sock)),
+            ComputedSensor(Sensor.INTEGER, prefix + ".pending-requests",
+                "Client requests queued for or running on a handler thread.",
+                "", [0, 2**31 - 1], lambda: self._pending_requests(sock)),
+        ]
+        self._client_sensors[sock] = sensors
+        for sensor in sensors:
+            self.add_sensor(sensor)
+
+    def _remove_client_sensors(self, sock):
+        """Remove the performance sensors of a departing client."""
+        for sensor in self._client_sensors.pop(sock, ()):
+            if self._sensors.get(sensor.name) is sensor:
+                self.remove_sensor(sensor)
+        self._stats.forget(sock)
+
     def build_state(self):
         """Return a build state string in the form name-major.minor[(a|b|rc)n]"""
         return "%s-%s.%s%s" % self.BUILD_INFO
@@ -747,6 +1599,8 @@ class DeviceServer(DeviceServerBase):
             The sensor object to register with the device server.
         """
         self._sensors[sensor.name] = sensor
+        self._sensor_list_lines.pop(sensor.name, None)
+        self._sensor_index.add(sensor.name)
 
     def remove_sensor(self, sensor):
         """Remove a sensor from the device.
@@ -759,6 +1613,8 @@ class DeviceServer(DeviceServerBase):
             The sensor object to remove from the device server.
         """
         del self._sensors[sensor.name]
+        self._sensor_index.remove(sensor.name)
+        self._sensor_list_lines.pop(sensor.name, None)
 
         self._strat_lock.acquire()
         try:
@@ -770,6 +1626,29 @@ class DeviceServer(DeviceServerBase):
         finally:
             self._strat_lock.release()
 
+    def _match_sensors(self, pattern):
+        """Return the (name, sensor) pairs matching a name pattern.
+
+        Parameters
+        ----------
+        pattern : None or str
+            Pattern as for :func:`construct_name_filter`.
+
+        Returns
+        -------
+        exact : bool
+            True if the pattern was an exact sensor name.
+        sensors : list of (str, Sensor object) tuples
+            The matching sensors, sorted by name.
+        """
+        exact, names = self._sensor_index.match(pattern)
+        sensors = []
+        for name in names:
+            sensor = self._sensors.get(name)
+            if sensor is not None:
+                sensors.append((name, sensor))
+        return exact, sensors
+
     def get_sensor(self, sensor_name):
         """Fetch the sensor with the given name.
 
@@ -810,6 +1689,34 @@ class DeviceServer(DeviceServerBase):
         """
         self._restart_queue = restart_queue
 
+    def set_sensor_status_batching(self, flush_interval):
+        """Combine #sensor-status informs sent to each client.
+
+        When enabled, sampling updates for a client are collected for up
+        to flush_interval seconds and then sent as multi-sensor informs,
+        one per distinct timestamp::
+
+            #sensor-status 1244631611415.231 2 beam0.rms nominal 3.1 beam1.rms nominal 2.9
+
+        Clients must therefore accept #sensor-status informs with a
+        sensor count greater than one.
+
+        Parameters
+        ----------
+        flush_interval : float in seconds or None
+            How long to collect updates for before sending them. None or
+            zero sends each update immediately (the default).
+        """
+        self._status_flush_interval = flush_interval or None
+        if not flush_interval:
+            self._strat_lock.acquire()
+            try:
+                informers = self._informers.values()
+            finally:
+                self._strat_lock.release()
+            for informer in informers:
+                informer.flush()
+
     def setup_sensors(self):
         """Populate the dictionary of sensors.
 
@@ -833,6 +1740,7 @@ class DeviceServer(DeviceServerBase):
     # they're used
     # pylint: disable-msg = W0613
 
+    @inline_request
     def request_halt(self, sock, msg):
         """Halt the device server.
 
@@ -854,6 +1762,7 @@ class DeviceServer(DeviceServerBase):
         # has been sent.
         return Message.reply("halt", "ok")
 
+    @inline_request
     def request_help(self, sock, msg):
         """Return help on the available requests.
 
@@ -893,20 +1802,33 @@ class DeviceServer(DeviceServerBase):
             !help ok 1
         """
         if not msg.arguments:
-            for name, method in sorted(self._request_handlers.items()):
-                doc = method.__doc__
-                self.reply_inform(sock, Message.inform("help", name, doc), msg)
-            num_methods = len(self._request_handlers)
-            return Message.reply("help", "ok", str(num_methods))
+            lines = self._help_lines
+            if lines is None:
+                lines = self._help_lines = [
+                    self.encode_inform_line("help", name, method.__doc__)
+                    for name, method in sorted(self._request_handlers.items())]
+            reply = Message.reply("help", "ok", str(len(lines)))
         else:
             name = msg.arguments[0]
-            if name in self._request_handlers:
-                method = self._request_handlers[name]
-                doc = method.__doc__.strip()
-                self.reply_inform(sock, Message.inform("help", name, doc), msg)
-                return Message.reply("help", "ok", "1")
-            return Message.reply("help", "fail", "Unknown request method.")
-
+            if name not in self._request_handlers:
+                return Message.reply("help", "fail", "Unknown request method.")
+            line = self._help_line.get(name)
+            if line is None:
+                doc = self._request_handlers[name].__doc__.strip()
+                line = self._help_line[name] = self.encode_inform_line("help",
+                                                                       name, doc)
+            lines = [line]
+            reply = Message.reply("help", "ok", "1")
+
+        if not self.can_send_encoded():
+            parser = MessageParser()
+            for line in lines:
+                self.reply_inform(sock, parser.parse("#help" + line[:-1]), msg)
+            return reply
+        self.reply_with_encoded_informs(sock, "help", lines, reply, msg)
+        raise AsyncReply()
+
+    @inline_request
     def request_log_level(self, sock, msg):
         """Query or set the current logging level.
 
@@ -939,6 +1861,48 @@ class DeviceServer(DeviceServerBase):
                 raise FailReply(str(e))
         return Message.reply("log-level", "ok", self.log.level_name())
 
+    @inline_request
+    def request_client_log_level(self, sock, msg):
+        """Query or set the logging level for the requesting client only.
+
+        Parameters
+        ----------
+        level : {'all', 'trace', 'debug', 'info', 'warn', 'error', 'fatal', 'off', 'default'}, optional
+            Name of the logging level to send this client log messages at. 'default' makes the client follow the device server's level again (the default is to leave the client's level unchanged).
+
+        Returns
+        -------
+        success : {'ok', 'fail'}
+            Whether the request succeeded.
+        level : {'all', 'trace', 'debug', 'info', 'warn', 'error', 'fatal', 'off'}
+            The client's log level after processing the request.
+
+        Examples
+        --------
+        ::
+
+            ?client-log-level
+            !client-log-level ok warn
+
+            ?client-log-level debug
+            !client-log-level ok debug
+
+            ?client-log-level default
+            !client-log-level ok warn
+        """
+        if msg.arguments:
+            if msg.arguments[0] == "default":
+                level = None
+            else:
+                try:
+                    level = self.log.level_from_name(msg.arguments[0])
+                except ValueError, e:
+                    raise FailReply(str(e))
+            self.log.set_client_log_level(sock, level)
+        return Message.reply("client-log-level", "ok",
+                             self.log.level_name(self.log.client_log_level(sock)))
+
+    @inline_request
     def request_restart(self, sock, msg):
         """Restart the device server.
 
@@ -963,6 +1927,7 @@ class DeviceServer(DeviceServerBase):
         # has been sent.
         return Message.reply("restart", "ok")
 
+    @inline_request
     def request_client_list(self, sock, msg):
         """Request the list of connected clients.
 
@@ -1002,6 +1967,7 @@ class DeviceServer(DeviceServerBase):
             self.reply_inform(sock, Message.inform("client-list", addr), msg)
         return Message.reply("client-list", "ok", str(num_clients))
 
+    @inline_request
     def request_sensor_list(self, sock, msg):
         """Request the list of sensors.
 
@@ -1051,20 +2017,33 @@ class DeviceServer(DeviceServerBase):
             #sensor-list cpu.power.on Whether\_CPU\_hase\_power. \@ boolean
             !sensor-list ok 1
         """
-        exact, name_filter = construct_name_filter(msg.arguments[0]
+        exact, sensors = self._match_sensors(msg.arguments[0]
                     if msg.arguments else None)
-        sensors = [(name, sensor) for name, sensor in
-                    sorted(self._sensors.iteritems()) if name_filter(name)]
 
         if exact and not sensors:
             return Message.reply("sensor-list", "fail", "Unknown sensor name.")
 
+        list_lines = self._sensor_list_lines
+        lines = []
         for name, sensor in sensors:
-            self.reply_inform(sock, Message.inform("sensor-list",
-                name, sensor.description, sensor.units, sensor.stype,
-                *sensor.formatted_params), msg)
-        return Message.reply("sensor-list", "ok", str(len(sensors)))
-
+            line = list_lines.get(name)
+            if line is None:
+                line = list_lines[name] = self.encode_inform_line(
+                    "sensor-list", name, sensor.description, sensor.units,
+                    sensor.stype, *sensor.formatted_params)
+            lines.append(line)
+        reply = Message.reply("sensor-list", "ok", str(len(sensors)))
+
+        if not self.can_send_encoded():
+            parser = MessageParser()
+            for line in lines:
+                self.reply_inform(sock, parser.parse("#sensor-list" + line[:-1]),
+                                  msg)
+            return reply
+        self.reply_with_encoded_informs(sock, "sensor-list", lines, reply, msg)
+        raise AsyncReply()
+
+    @inline_request
     def request_sensor_value(self, sock, msg):
         """Request the value of a sensor or sensors.
 
@@ -1110,10 +2089,8 @@ class DeviceServer(DeviceServerBase):
             #sensor-value 1244631611415.231 1 cpu.power.on 0
             !sensor-value ok 1
         """
-        exact, name_filter = construct_name_filter(msg.arguments[0]
+        exact, sensors = self._match_sensors(msg.arguments[0]
                     if msg.arguments else None)
-        sensors = [(name, sensor) for name, sensor in
-                    sorted(self._sensors.iteritems()) if name_filter(name)]
 
         if exact and not sensors:
             return Message.reply("sensor-value", "fail", "Unknown sensor name.")
@@ -1124,6 +2101,7 @@ class DeviceServer(DeviceServerBase):
                     timestamp_ms, "1", name, status, value), msg)
         return Message.reply("sensor-value", "ok", str(len(sensors)))
 
+    @inline_request
     def request_sensor_sampling(self, sock, msg):
         """Configure or query the way a sensor is sampled.
 
@@ -1134,7 +2112,7 @@ class DeviceServer(DeviceServerBase):
         ----------
         name : str
             Name of the sensor whose sampling strategy to query or configure.
-        strategy : {'none', 'auto', 'event', 'differential', 'period'}, optional
+        strategy : {'none', 'auto', 'event', 'differential', 'period', 'event-rate'}, optional
             Type of strategy to use to report the sensor value. The differential
             strategy type may only be used with integer or float sensors.
         params : list of str, optional
@@ -1144,6 +2122,9 @@ class DeviceServer(DeviceServerBase):
             updated value is sent. For the period strategy, the parameter is the
             period to sample at in milliseconds. For the event strategy, an
             optional minimum time between updates in milliseconds may be given.
+            For the event-rate strategy, the parameters are the shortest and
+            longest times between updates in milliseconds (a longest time of
+            zero means no updates are sent unless the sensor changes).
 
         Returns
         -------
@@ -1151,7 +2132,7 @@ class DeviceServer(DeviceServerBase):
             Whether the sensor-sampling request succeeded.
         name : str
             Name of the sensor queried or configured.
-        strategy : {'none', 'auto', 'event', 'differential', 'period'}
+        strategy : {'none', 'auto', 'event', 'differential', 'period', 'event-rate'}
             Name of the new or current sampling strategy for the sensor.
         params : list of str
             Additional strategy parameters (see description under Parameters).
@@ -1184,9 +2165,9 @@ class DeviceServer(DeviceServerBase):
             if strategy not in SampleStrategy.SAMPLING_LOOKUP_REV:
                 raise FailReply("Unknown strategy name.")
 
-            def inform_callback(cb_msg):
-                """Inform callback for sensor strategy."""
-                self.inform(sock, cb_msg)
+            inform_callback = self._informers.get(sock)
+            if inform_callback is None:
+                inform_callback = ClientInformer(self, sock)
 
             new_strategy = SampleStrategy.get_strategy(strategy,
                                         inform_callback, sensor, *params)
@@ -1217,6 +2198,7 @@ class DeviceServer(DeviceServerBase):
         return Message.reply("sensor-sampling", "ok", name, strategy, *params)
 
 
+    @inline_request
     def request_watchdog(self, sock, msg):
         """Check that the server is still alive.
 
@@ -1258,6 +2240,15 @@ class DeviceLogger(object):
     a particular name. Names use dotted notation to form
     a virtual hierarchy of loggers with the device.
 
+    By default log messages are sent to clients on the thread that logs
+    them. After :meth:`enable_async` they are instead put on a bounded
+    queue and sent in batches by a background thread. If the queue is
+    full, messages are dropped and counted instead of blocking the
+    caller.
+
+    Clients may be given their own logging level with
+    :meth:`set_client_log_level`. Other clients use the logger's level.
+
     Parameters
     ----------
     device_server : DeviceServerBase object
@@ -1266,6 +2257,13 @@ class DeviceLogger(object):
         The name of the root logger.
     """
 
+    ## @brief Default number of log messages waiting to be sent before
+    # further messages are dropped.
+    QUEUE_SIZE = 1000
+
+    ## @brief Maximum number of log messages sent in one batch.
+    BATCH_SIZE = 100
+
     # level values are used as indexes into the LEVELS list
     # so these to lists should be in the same order
     ALL, TRACE, DEBUG, INFO, WARN, ERROR, FATAL, OFF = range(8)
@@ -1289,6 +2287,15 @@ class DeviceLogger(object):
         self._python_logger = python_logger
         self._log_level = self.WARN
         self._root_logger_name = root_logger
+        self._client_levels = {} # map client sockets to logging levels
+        self._min_level = self._log_level # lowest level any client wants
+        # asynchronous forwarding
+        self._queue = None
+        self._sender = None
+        self._stop_sender = None # set to ask the sender to finish
+        self._drop_lock = threading.Lock()
+        self._dropped = 0 # total messages dropped
+        self._unreported = 0 # dropped messages not yet reported to clients
 
     def level_name(self, level=None):
         """Return the name of the given level value.
@@ -1339,6 +2346,7 @@ class DeviceLogger(object):
             The value to set the logging level to.
         """
         self._log_level = level
+        self._update_min_level()
 
     def set_log_level_by_name(self, level_name):
         """Set the logging level using a level name.
@@ -1348,7 +2356,163 @@ class DeviceLogger(object):
         level_name : str
             The name of the logging level.
         """
-        self._log_level = self.level_from_name(level_name)
+        self.set_log_level(self.level_from_name(level_name))
+
+    def set_client_log_level(self, sock, level):
+        """Set the logging level for a single client.
+
+        Parameters
+        ----------
+        sock : socket.socket object
+            The client whose logging level to set.
+        level : logging level constant or None
+            The level to send the client messages at. None makes the
+            client follow the logger's level again.
+        """
+        levels = dict(self._client_levels)
+        if level is None:
+            levels.pop(sock, None)
+        else:
+            levels[sock] = level
+        # replaced rather than modified so the sender never sees it change
+        self._client_levels = levels
+        self._update_min_level()
+
+    def client_log_level(self, sock):
+        """Return the logging level for a client.
+
+        Parameters
+        ----------
+        sock : socket.socket object
+            The client whose logging level to return.
+
+        Returns
+        -------
+        level : logging level constant
+            The client's own level if it has one, else the logger's level.
+        """
+        return self._client_levels.get(sock, self._log_level)
+
+    def _update_min_level(self):
+        """Recalculate the lowest level any client will be sent."""
+        self._min_level = min([self._log_level] +
+                              self._client_levels.values())
+
+    def enable_async(self, queue_size=None):
+        """Send log messages to clients from a background thread.
+
+        Parameters
+        ----------
+        queue_size : int or None
+            Maximum number of messages waiting to be sent. Messages logged
+            while the queue is full are dropped. Defaults to QUEUE_SIZE.
+        """
+        if self._sender is not None:
+            return
+        if queue_size is None:
+            queue_size = self.QUEUE_SIZE
+        self._queue = Queue.Queue(queue_size)
+        self._stop_sender = threading.Event()
+        self._sender = ExcepthookThread(target=self._run_sender,
+                                        args=(self._queue, self._stop_sender),
+                                        name="katcp-log-sender")
+        self._sender.setDaemon(True)
+        self._sender.start()
+
+    def disable_async(self, timeout=1.0):
+        """Stop the background sender, sending messages already queued.
+
+        Does not block on a full queue; the sender finishes once it has
+        sent what is queued, even if that takes longer than the timeout.
+
+        Parameters
+        ----------
+        timeout : float in seconds
+            Time to wait for the sender thread to finish.
+        """
+        sender, queue, stop = self._sender, self._queue, self._stop_sender
+        if sender is None:
+            return
+        self._sender, self._queue, self._stop_sender = None, None, None
+        stop.set()
+        try:
+            # wake the sender if it is waiting for messages
+            queue.put_nowait(None)
+        except Queue.Full:
+            # the sender has messages to take and then sees the stop event
+            pass
+        sender.join(timeout)
+
+    def dropped(self):
+        """Return the number of log messages dropped because the queue was full."""
+        return self._dropped
+
+    def _run_sender(self, queue, stop):
+        """Send queued log messages until stop is set and the queue is empty.
+
+        None entries in the queue only wake the sender up.
+        """
+        _Empty = Queue.Empty
+        while not (stop.isSet() and queue.empty()):
+            item = queue.get()
+            batch = []
+            if item is not None:
+                batch.append(item)
+            try:
+                while len(batch) < self.BATCH_SIZE:
+                    item = queue.get_nowait()
+                    if item is not None:
+                        batch.append(item)
+            except _Empty:
+                pass
+            if not batch and not self._unreported:
+                continue
+
+            if self._unreported:
+                self._drop_lock.acquire()
+                try:
+                    unreported, self._unreported = self._unreported, 0
+                finally:
+                    self._drop_lock.release()
+                batch.append((self.WARN, self._device_server._log_msg(
+                    self.level_name(self.WARN),
+                    "%d log messages dropped" % (unreported,),
+                    self._root_logger_name)))
+
+            try:
+                self._forward(batch)
+            except Exception, e:
+                self._device_server._logger.exception(e)
+
+    def _forward(self, batch):
+        """Send a list of (level, #log message) pairs to interested clients."""
+        server = self._device_server
+        if getattr(server.inform, "im_func", None) is not \
+                DeviceServerBase.inform.im_func:
+            # keep subclasses that intercept inform working
+            for level, msg in batch:
+                self._send(level, msg)
+            return
+
+        levels, default = self._client_levels, self._log_level
+        encoded = [(level, str(msg) + "\n") for level, msg in batch]
+        for sock in server.get_sockets():
+            min_level = levels.get(sock, default)
+            data = "".join([chunk for level, chunk in encoded
+                            if level >= min_level])
+            if data:
+                server._send_data(sock, data)
+
+    def _send(self, level, msg):
+        """Send a #log message to the clients whose level it meets."""
+        levels = self._client_levels
+        if not levels:
+            if level >= self._log_level:
+                self._device_server.mass_inform(msg)
+            return
+        default = self._log_level
+        self._device_server.mass_inform(msg, sock_filter=lambda sock:
+                                        level >= levels.get(sock, default))
 
     def log(self, level, msg, *args, **kwargs):
         """Log a message and inform all clients.
@@ -1369,16 +2533,26 @@ class DeviceLogger(object):
         """
         if self._python_logger is not None:
             self._python_logger.log(self.PYTHON_LEVEL[level], msg, *args)
-        if level >= self._log_level:
+        if level >= self._min_level:
             name = kwargs.get("name")
             timestamp = kwargs.get("timestamp")
             if name is None:
                 name = self._root_logger_name
-            self._device_server.mass_inform(
-                self._device_server._log_msg(self.level_name(level), msg % args,
-                    name, timestamp=timestamp
-                )
-            )
+            log_msg = self._device_server._log_msg(self.level_name(level),
+                    msg % args, name, timestamp=timestamp)
+            queue = self._queue
+            if queue is None:
+                self._send(level, log_msg)
+                return
+            try:
+                queue.put_nowait((level, log_msg))
+            except Queue.Full:
+                self._drop_lock.acquire()
+                try:
+                    self._dropped += 1
+                    self._unreported += 1
+                finally:
+                    self._drop_lock.release()
 
     def trace(self, msg, *args, **kwargs):
         """Log a trace message."""
@@ -9,6 +9,7 @@
 
 import unittest
 from katcp.tx import test as tx
+import test_benchmark
 import test_client
 import test_core
 import test_kattypes
@@ -27,6 +28,7 @@ def suite():
     loader = unittest.TestLoader()
     suite = unittest.TestSuite()
     suite.addTest(tx.suite())
+    suite.addTests(loader.loadTestsFromModule(test_benchmark))
     suite.addTests(loader.loadTestsFromModule(test_client))
     suite.addTests(loader.loadTestsFromModule(test_core))
     suite.addTests(loader.loadTestsFromModule(test_kattypes))
@@ -0,0 +1,58 @@
+# test_benchmark.py
+# -*- coding: utf8 -*-
+# vim:fileencoding=utf8 ai ts=4 sts=4 et sw=4
+# Copyright 2009 SKA South Africa (http://ska.ac.za/)
+# BSD license - see COPYING for details
+
+"""Tests for the benchmark module."""
+
+import unittest
+import StringIO
+from katcp.benchmark import Benchmark, percentile, parse_mix, \
+                            dispatch_benchmark
+
+
+class TestBenchmarkHelpers(unittest.TestCase):
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles."""
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 99.9), 100)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_parse_mix(self):
+        """Test parsing weighted request mixes."""
+        self.assertEqual(parse_mix("help:2,watchdog"),
+                         ["help", "help", "watchdog"])
+        self.assertRaises(ValueError, parse_mix, "")
+        self.assertRaises(ValueError, parse_mix, "help:-1")
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run(self):
+        """Test a short benchmark run and its report."""
+        benchmark = Benchmark(clients=1, duration=0.5, sensors=5,
+                              subscriptions=2, period=50, window=2)
+        recorder = benchmark.run()
+        self.assertEqual(recorder.failures, 0)
+        self.assertTrue(sum([len(l) for l in recorder.latencies.values()]) > 0)
+        self.assertTrue(benchmark.status_updates > 0)
+        out = StringIO.StringIO()
+        benchmark.report(out)
+        report = out.getvalue()
+        self.assertTrue("total" in report)
+        self.assertTrue("seed 0" in report)
+
+
+class TestDispatchBenchmark(unittest.TestCase):
+
+    def test_dispatch(self):
+        """Test that both dispatch methods run and are reported."""
+        out = StringIO.StringIO()
+        times = dispatch_benchmark(100, out)
+        self.assertEqual(sorted(times.keys()), ["compiled", "generic"])
+        self.assertTrue("speedup" in out.getvalue())
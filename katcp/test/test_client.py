@@ -11,6 +11,7 @@ import unittest
 import time
 import logging
 import threading
+import socket
 import katcp
 from katcp.testutils import TestLogHandler, \
     DeviceTestClient, CallbackTestClient, DeviceTestServer, \
@@ -137,6 +138,57 @@ class TestDeviceClient(unittest.TestCase, TestUtilMixin):
         finally:
             self.client._running = old_running
 
+    def test_reconnect_delay(self):
+        """Test the exponential backoff between connection attempts."""
+        client = self.client
+        delays = []
+        for failures in range(1, 12):
+            client._connect_failures = failures
+            delays.append(client._reconnect_delay())
+        client._connect_failures = 0
+        limit = client.RECONNECT_DELAY_MIN
+        for delay in delays:
+            self.assertTrue(limit / 2.0 <= delay <= limit)
+            limit = min(limit * 2, client.RECONNECT_DELAY_MAX)
+        self.assertTrue(delays[-1] >= client.RECONNECT_DELAY_MAX / 2.0)
+
+    def test_start_clients(self):
+        """Test starting a mix of reachable and unreachable clients."""
+        host, port = self.server._sock.getsockname()
+        unused = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        unused.bind(("127.0.0.1", 0))
+        dead_port = unused.getsockname()[1]
+        unused.close()
+
+        good = DeviceTestClient(host, port)
+        bad = DeviceTestClient("127.0.0.1", dead_port)
+        start = time.time()
+        try:
+            connected, failed = katcp.start_clients([good, bad], timeout=0.5)
+            self.assertTrue(time.time() - start < 0.75)
+            self.assertEqual(connected, [good])
+            self.assertEqual(failed, [bad])
+        finally:
+            for client in (good, bad):
+                client.stop()
+                client.join(timeout=1.0)
+                self.assertFalse(client._thread)
+
+    def test_start_clients_stop_failed(self):
+        """Test that clients which fail to connect can be stopped."""
+        unused = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        unused.bind(("127.0.0.1", 0))
+        dead_port = unused.getsockname()[1]
+        unused.close()
+
+        bad = DeviceTestClient("127.0.0.1", dead_port)
+        connected, failed = katcp.start_clients([bad], timeout=0.2,
+                                                stop_failed=True)
+        self.assertEqual((connected, failed), ([], [bad]))
+        self.assertFalse(bad.running())
+        bad.join(timeout=1.0)
+        self.assertFalse(bad._thread)
+
 
 class TestBlockingClient(unittest.TestCase):
     def setUp(self):
@@ -167,7 +219,7 @@ class TestBlockingClient(unittest.TestCase):
         reply, informs = self.client.blocking_request(
             katcp.Message.request("help"))
         assert reply.name == "help"
-        assert reply.arguments == ["ok", "13"]
+        assert reply.arguments == ["ok", "14"]
         assert len(informs) == int(reply.arguments[1])
 
     def test_timeout(self):
@@ -223,7 +275,7 @@ class TestCallbackClient(unittest.TestCase, TestUtilMixin):
 
         def help_reply(reply):
             self.assertEqual(reply.name, "help")
-            self.assertEqual(reply.arguments, ["ok", "13"])
+            self.assertEqual(reply.arguments, ["ok", "14"])
             self.assertEqual(len(help_informs), int(reply.arguments[1]))
             help_replies.append(reply)
 
@@ -240,7 +292,7 @@ class TestCallbackClient(unittest.TestCase, TestUtilMixin):
 
         time.sleep(0.2)
         self.assertEqual(len(help_replies), 1)
-        self.assertEqual(len(help_informs), 13)
+        self.assertEqual(len(help_informs), 14)
 
     def test_no_callback(self):
         """Test request without callback."""
@@ -255,8 +307,8 @@ class TestCallbackClient(unittest.TestCase, TestUtilMixin):
         self._assert_msgs_like(msgs,
             [("#version ", "")] +
             [("#build-state ", "")] +
-            [("#help ", "")]*13 +
-            [("!help ok 13", "")]
+            [("#help ", "")]*14 +
+            [("!help ok 14", "")]
         )
 
     def test_timeout(self):
@@ -327,7 +379,7 @@ class TestCallbackClient(unittest.TestCase, TestUtilMixin):
 
         time.sleep(0.1)
         self.assertEqual(len(help_replies), 1)
-        self.assertEqual(len(help_informs), 13)
+        self.assertEqual(len(help_informs), 14)
 
     def test_twenty_thread_mayhem(self):
         """Test using callbacks from twenty threads simultaneously."""
@@ -372,10 +424,10 @@ class TestCallbackClient(unittest.TestCase, TestUtilMixin):
             done.wait(1.0)
             self.assertEqual(len(replies), 1)
             self.assertEqual(replies[0].arguments[0], "ok")
-            if len(informs) != 13:
+            if len(informs) != 14:
                 print thread_id, len(informs)
                 print [x.arguments[0] for x in informs]
-            self.assertEqual(len(informs), 13)
+            self.assertEqual(len(informs), 14)
 
     def test_blocking_request(self):
         """Test the callback client's blocking request."""
@@ -384,8 +436,8 @@ class TestCallbackClient(unittest.TestCase, TestUtilMixin):
         )
 
         self.assertEqual(reply.name, "help")
-        self.assertEqual(reply.arguments, ["ok", "13"])
-        self.assertEqual(len(informs), 13)
+        self.assertEqual(reply.arguments, ["ok", "14"])
+        self.assertEqual(len(informs), 14)
 
         reply, informs = self.client.blocking_request(
             katcp.Message.request("slow-command", "0.5"),
@@ -420,7 +472,7 @@ class TestCallbackClient(unittest.TestCase, TestUtilMixin):
 
         def help_reply(reply):
             self.assertEqual(reply.name, "help")
-            self.assertEqual(reply.arguments, ["ok", "13"])
+            self.assertEqual(reply.arguments, ["ok", "14"])
             self.assertEqual(len(help_informs), int(reply.arguments[1]))
             help_replies.append(reply)
 
@@ -437,7 +489,7 @@ class TestCallbackClient(unittest.TestCase, TestUtilMixin):
 
         time.sleep(0.2)
         self.assertEqual(len(help_replies), 1)
-        self.assertEqual(len(help_informs), 13)
+        self.assertEqual(len(help_informs), 14)
 
     def test_request_fail_on_raise(self):
         """Test that the callback is called even if send_message raises
@@ -457,3 +509,105 @@ class TestCallbackClient(unittest.TestCase, TestUtilMixin):
         self.assertEqual(len(replies), 1)
         self.assertEqual(replies[0].name, "foo")
         self.assertEqual(replies[0].arguments, ["fail", "Error foo"])
+
+
+class TestClientReactor(unittest.TestCase, TestUtilMixin):
+    def setUp(self):
+        self.server = DeviceTestServer('', 0)
+        self.server.start(timeout=0.1)
+
+        host, port = self.server._sock.getsockname()
+
+        self.reactor = katcp.ClientReactor()
+        self.reactor.start(timeout=0.1)
+
+        self.clients = [CallbackTestClient(host, port) for _i in range(5)]
+        for client in self.clients:
+            client.start(timeout=0.5, reactor=self.reactor)
+
+    def tearDown(self):
+        if self.reactor.running():
+            self.reactor.stop()
+            self.reactor.join()
+        if self.server.running():
+            self.server.stop()
+            self.server.join()
+
+    def test_requests(self):
+        """Test requests from several clients sharing a reactor."""
+        self.assertEqual(len(self.reactor.clients()), 5)
+        for client in self.clients:
+            reply, informs = client.blocking_request(
+                katcp.Message.request("help"), timeout=1.0)
+            self.assertEqual(reply.arguments, ["ok", "14"])
+            self.assertEqual(len(informs), 14)
+        self._assert_msgs_equal(self.server.messages(), ["?help"] * 5)
+
+    def test_stop_client(self):
+        """Test stopping one client leaves the others running."""
+        client = self.clients[0]
+        client.stop(timeout=0.1)
+        client.join(timeout=1.0)
+        self.assertFalse(client.running())
+        self.assertFalse(client.is_connected())
+        self.assertEqual(client._reactor, None)
+        self.assertEqual(len(self.reactor.clients()), 4)
+
+        reply, informs = self.clients[1].blocking_request(
+            katcp.Message.request("watchdog"), timeout=1.0)
+        self.assertEqual(reply.arguments, ["ok"])
+
+        client.start(timeout=0.5, reactor=self.reactor)
+        self.assertTrue(client.is_connected())
+
+    def test_reconnect(self):
+        """Test that clients on a reactor reconnect after losing a socket."""
+        client = self.clients[2]
+        sock = client._sock
+        sockname = sock.getpeername()
+        sock.shutdown(socket.SHUT_RDWR)
+        time.sleep(0.5)
+
+        self.assertTrue(sock is not client._sock)
+        self.assertEqual(sockname, client._sock.getpeername())
+
+    def test_closed_socket(self):
+        """Test that a socket closed behind the reactor's back is noticed."""
+        client = self.clients[3]
+        sock = client._sock
+        sock.close()
+        time.sleep(1.25)
+
+        self.assertTrue(sock is not client._sock)
+        self.assertTrue(client.is_connected())
+
+    def test_unreachable_client(self):
+        """Test that an unreachable host does not hold up other clients."""
+        unused = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        unused.bind(("127.0.0.1", 0))
+        dead_port = unused.getsockname()[1]
+        unused.close()
+
+        bad = CallbackTestClient("127.0.0.1", dead_port)
+        bad.start(reactor=self.reactor)
+        time.sleep(0.1)
+        self.assertTrue(bad.running())
+        self.assertFalse(bad.is_connected())
+        self.assertTrue(bad._connect_failures >= 1)
+
+        reply, informs = self.clients[0].blocking_request(
+            katcp.Message.request("watchdog"), timeout=1.0)
+        self.assertEqual(reply.arguments, ["ok"])
+
+        bad.stop()
+        bad.join(timeout=1.0)
+        self.assertFalse(bad.running())
+
+    def test_stop_reactor(self):
+        """Test that stopping the reactor stops its clients."""
+        self.reactor.stop()
+        self.reactor.join(timeout=1.0)
+        for client in self.clients:
+            client.join(timeout=1.0)
+            self.assertFalse(client.running())
+            self.assertFalse(client.is_connected())
@@ -9,7 +9,15 @@
 
 import unittest
 import logging
+import socket
+import select
 import katcp
+from katcp.core import SocketSelector
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from katcp.testutils import TestLogHandler, DeviceTestSensor
 
 log_handler = TestLogHandler()
@@ -147,6 +155,50 @@ class TestMessageParser(unittest.TestCase):
         self.assertEqual(m.mid, "1234")
 
 
+class TestSocketSelector(unittest.TestCase):
+    def _check_selector(self, selector):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(listener.getsockname())
+        server, _addr = listener.accept()
+        try:
+            selector.register(server)
+            selector.register(client, SocketSelector.WRITE)
+            self.assertEqual(len(selector), 2)
+            self.assertEqual(selector.select(0.1),
+                             [(client, SocketSelector.WRITE)])
+
+            selector.modify(client, SocketSelector.READ)
+            client.send("?watchdog\n")
+            self.assertEqual(selector.select(0.1),
+                             [(server, SocketSelector.READ)])
+
+            selector.unregister(server)
+            selector.unregister(server)
+            self.assertFalse(server in selector)
+            self.assertEqual(selector.select(0.01), [])
+
+            # closed sockets can still be unregistered
+            client.close()
+            selector.unregister(client)
+            self.assertEqual(len(selector), 0)
+        finally:
+            selector.close()
+            for sock in (listener, client, server):
+                sock.close()
+
+    def test_select(self):
+        """Test the select.select based selector."""
+        self._check_selector(SocketSelector(use_epoll=False))
+
+    def test_epoll(self):
+        """Test the epoll based selector."""
+        if hasattr(select, "epoll"):
+            self._check_selector(SocketSelector(use_epoll=True))
+
+
 class TestSensor(unittest.TestCase):
     def test_int_sensor(self):
         """Test integer sensor."""
@@ -244,6 +296,57 @@ class TestSensor(unittest.TestCase):
         self.assertAlmostEqual(s.parse_value("1002100"), 1002.1)
         self.assertRaises(ValueError, s.parse_value, "bicycle")
 
+    def test_ndarray_sensor(self):
+        """Test ndarray sensor."""
+        if numpy is None:
+            self.skipTest("numpy not installed")
+        s = DeviceTestSensor(
+            katcp.Sensor.NDARRAY, "a.spectrum", "An array sensor.", "counts",
+            None,
+            timestamp=12345, status=katcp.Sensor.NOMINAL,
+            value=numpy.array([1, 2], dtype="<u1")
+        )
+        self.assertEqual(s.read_formatted(),
+                         ("12345000", "nominal", "|u1:2:\x01\x02"))
+        self.assertEqual(list(s.parse_value("<i2:1:\x05\x00")), [5])
+        self.assertRaises(ValueError, s.parse_value, "bicycle")
+        self.assertEqual(katcp.Sensor.parse_type("ndarray"),
+                         katcp.Sensor.NDARRAY)
+
+    def test_vector_sensor(self):
+        """Test vector sensor."""
+        if numpy is None:
+            self.skipTest("numpy not installed")
+        s = katcp.Sensor(katcp.Sensor.VECTOR, "a.bandpass", "A vector.", "dB",
+                         [4])
+        self.assertEqual(s.formatted_params, ["4"])
+        self.assertEqual(list(s.value()), [0, 0, 0, 0])
+        s.set_value(numpy.array([1.0, 2.0, 3.0, 4.0]), timestamp=12345)
+        self.assertEqual(s.read_formatted(), ("12345000", "nominal", "1,2,3,4"))
+        self.assertRaises(ValueError, s.set_value, numpy.zeros(3))
+
+        s.set_formatted("12346000", "warn", "~0=-1,3=0.5")
+        self.assertEqual(list(s.value()), [-1, 2, 3, 0.5])
+        s.set_formatted("12347000", "nominal", "5,6,7,8")
+        self.assertEqual(list(s.value()), [5, 6, 7, 8])
+
+        s = katcp.Sensor(katcp.Sensor.VECTOR, "a.count", "A vector.", "",
+                         [2, "int32"])
+        self.assertEqual(s.formatted_params, ["2", "int32"])
+        self.assertEqual(s.value().dtype, numpy.dtype("int32"))
+        self.assertEqual(katcp.Sensor.parse_params(katcp.Sensor.VECTOR,
+                                                   ["2", "int32"]),
+                         [2, "int32"])
+
+        # the length is required
+        self.assertRaises(ValueError, katcp.Sensor, katcp.Sensor.VECTOR,
+                          "a.vector", "A vector.", "", [])
+        self.assertRaises(ValueError, katcp.Sensor, katcp.Sensor.VECTOR,
+                          "a.vector", "A vector.", "", None,
+                          default=numpy.zeros(3))
+        self.assertRaises(ValueError, katcp.Sensor.parse_params,
+                          katcp.Sensor.VECTOR, [])
+
     def test_set_and_get_value(self):
         """Test getting and setting a sensor value."""
         s = DeviceTestSensor(
@@ -261,3 +364,124 @@ class TestSensor(unittest.TestCase):
         self.assertEqual(s.read(), (12345, katcp.Sensor.NOMINAL, 3))
 
         self.assertRaises(ValueError, s.set_value, 5)
+
+
+class RecordingObserver(object):
+    def __init__(self):
+        self.updates = []
+
+    def update(self, sensor):
+        self.updates.append(sensor)
+
+
+class BatchObserver(RecordingObserver):
+    def update_batch(self, sensors):
+        self.updates.append(list(sensors))
+
+
+class TestSensorBatch(unittest.TestCase):
+    def setUp(self):
+        self.sensors = [katcp.Sensor(katcp.Sensor.FLOAT, "beam%02d.rms" % i,
+                                     "ADC RMS.", "", [0.0, 10.0])
+                        for i in range(3)]
+
+    def test_commit(self):
+        """Test that a batch notifies each observer once."""
+        plain, batched = RecordingObserver(), BatchObserver()
+        for s in self.sensors:
+            s.attach(plain)
+            s.attach(batched)
+
+        with katcp.SensorBatch(timestamp=12345.0) as batch:
+            for i, s in enumerate(self.sensors):
+                batch.set_value(s, float(i))
+            batch.set_value(self.sensors[0], 5.0, katcp.Sensor.WARN)
+            self.assertEqual(plain.updates, [])
+            self.assertEqual(self.sensors[0].value(), 0.0)
+
+        self.assertEqual(plain.updates, self.sensors)
+        self.assertEqual(batched.updates, [self.sensors])
+        self.assertEqual(self.sensors[0].read(),
+                         (12345.0, katcp.Sensor.WARN, 5.0))
+        self.assertEqual([s.value() for s in self.sensors[1:]], [1.0, 2.0])
+
+    def test_commit_stores_like_set(self):
+        """Test that a batch stores readings the way Sensor.set does."""
+        stored = []
+
+        class LoggedSensor(katcp.Sensor):
+            def _set_reading(self, timestamp, status, value):
+                stored.append((self.name, value))
+                katcp.Sensor._set_reading(self, timestamp, status, value)
+
+        sensor = LoggedSensor(katcp.Sensor.FLOAT, "beam.power", "Power.", "",
+                              [0.0, 10.0])
+        sensor.set_value(1.0)
+        with katcp.SensorBatch(timestamp=12345.0) as batch:
+            batch.set_value(sensor, 2.0)
+        self.assertEqual(stored, [("beam.power", 1.0), ("beam.power", 2.0)])
+        self.assertEqual(sensor.read(), (12345.0, katcp.Sensor.NOMINAL, 2.0))
+
+    def test_discard(self):
+        """Test that a failing batch leaves the sensors untouched."""
+        observer = RecordingObserver()
+        self.sensors[0].attach(observer)
+        batch = katcp.SensorBatch()
+        batch.set_value(self.sensors[0], 1.0)
+        self.assertRaises(ValueError, batch.set_value, self.sensors[1], 11.0)
+        try:
+            with batch:
+                batch.set_value(self.sensors[2], 11.0)
+        except ValueError:
+            pass
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(observer.updates, [])
+        self.assertEqual([s.value() for s in self.sensors], [0.0] * 3)
+
+
+class TestSensorHistory(unittest.TestCase):
+    def setUp(self):
+        if numpy is None:
+            self.skipTest("numpy not installed")
+
+    def test_ring_buffer(self):
+        """Test that the history keeps the most recent readings in order."""
+        s = katcp.Sensor(katcp.Sensor.INTEGER, "an.int", "An integer.", "count",
+                         [0, 100])
+        self.assertEqual(s.history, None)
+        s.enable_history(4)
+        for i in range(6):
+            s.set_value(i, timestamp=10.0 + i)
+        self.assertEqual(len(s.history), 4)
+
+        timestamps, statuses, values = s.history.last()
+        self.assertEqual(list(timestamps), [12.0, 13.0, 14.0, 15.0])
+        self.assertEqual(list(statuses), [katcp.Sensor.NOMINAL] * 4)
+        self.assertEqual(list(values), [2, 3, 4, 5])
+
+        timestamps, statuses, values = s.history.last(2)
+        self.assertEqual(list(values), [4, 5])
+        self.assertEqual(len(s.history.last(0)[0]), 0)
+
+        timestamps, statuses, values = s.history.window(13.0, 14.5)
+        self.assertEqual(list(timestamps), [13.0, 14.0])
+        self.assertEqual(list(values), [3, 4])
+        self.assertEqual(list(s.history.window(start=15.0)[2]), [5])
+        self.assertEqual(list(s.history.window(end=12.0)[2]), [2])
+
+        s.disable_history()
+        self.assertEqual(s.history, None)
+
+    def test_partial_and_string_history(self):
+        """Test a history that is not yet full and holds strings."""
+        s = katcp.Sensor(katcp.Sensor.STRING, "a.string", "A string.", "")
+        s.enable_history(10)
+        s.set(1.0, katcp.Sensor.WARN, "foo")
+        s.set(2.0, katcp.Sensor.ERROR, "bar")
+        timestamps, statuses, values = s.history.last(5)
+        self.assertEqual(list(timestamps), [1.0, 2.0])
+        self.assertEqual(list(statuses), [katcp.Sensor.WARN,
+                                          katcp.Sensor.ERROR])
+        self.assertEqual(list(values), ["foo", "bar"])
+        s.history.clear()
+        self.assertEqual(len(s.history), 0)
@@ -8,11 +8,17 @@
    """
 
 import unittest
-from katcp import Message, FailReply, AsyncReply
+from katcp import Message, MessageParser, FailReply, AsyncReply
 from katcp.kattypes import request, inform, return_reply, send_reply,  \
                            Bool, Discrete, Float, Int, Lru, Timestamp, \
                            Str, Struct, Regex, DiscreteMulti, TimestampOrNow, \
-                           StrictTimestamp
+                           StrictTimestamp, unpack_types, pack_types, \
+                           compile_unpacker, compile_packer, NdArray, Vector
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class TestType(unittest.TestCase):
     def setUp(self):
@@ -347,6 +353,115 @@ class TestStruct(TestType):
         ]
 
 
+class TestNdArray(unittest.TestCase):
+
+    def setUp(self):
+        if numpy is None:
+            self.skipTest("numpy not installed")
+
+    def test_pack_unpack(self):
+        """Test round trips through NdArray."""
+        basic = NdArray()
+        spectrum = NdArray("<f4", (None, 4))
+        value = numpy.arange(8, dtype=">i2").reshape(2, 4)
+
+        packed = basic.pack(value)
+        self.assertTrue(packed.startswith(">i2:2,4:"))
+        self.assertEqual(len(packed), len(">i2:2,4:") + 16)
+        unpacked = basic.unpack(packed)
+        self.assertEqual(unpacked.dtype, value.dtype)
+        self.assertTrue(numpy.array_equal(unpacked, value))
+        self.assertFalse(unpacked.flags.writeable)
+
+        unpacked = spectrum.unpack(spectrum.pack(value))
+        self.assertEqual(unpacked.dtype, numpy.dtype("<f4"))
+        self.assertTrue(numpy.array_equal(unpacked, value))
+        unpacked = spectrum.unpack(packed)
+        self.assertEqual(unpacked.dtype, numpy.dtype("<f4"))
+
+        scalar = basic.unpack(basic.pack(numpy.float64(2.5)))
+        self.assertEqual(scalar.shape, ())
+        self.assertEqual(scalar, 2.5)
+        self.assertEqual(list(basic.unpack(basic.pack([1, 2]))), [1, 2])
+
+    def test_errors(self):
+        """Test NdArray checks."""
+        basic = NdArray()
+        spectrum = NdArray("<f4", (None, 4))
+        self.assertRaises(ValueError, basic.pack, None)
+        self.assertRaises(ValueError, basic.pack, numpy.array([None]))
+        self.assertRaises(ValueError, spectrum.pack, numpy.zeros(4))
+        self.assertRaises(ValueError, spectrum.pack, numpy.zeros((2, 3)))
+        self.assertRaises(ValueError, NdArray("i4").pack, numpy.zeros(4))
+        self.assertRaises(ValueError, NdArray, [("a", "f4")])
+        for packed in ["", "<f4:3", "<f4:3:abc", "<f4:x:abcd", "O:1:abcdefgh",
+                       "<f4:4:abcdabcdabcdabcd"]:
+            self.assertRaises(ValueError, spectrum.unpack, packed)
+        self.assertEqual(NdArray(optional=True).unpack(None), None)
+
+    def test_decorators(self):
+        """Test NdArray parameters through a message."""
+        class Device(object):
+            @request(NdArray("<f8"))
+            @return_reply(NdArray("<f8"))
+            def request_double(self, sock, spectrum):
+                return ("ok", spectrum * 2)
+
+        value = numpy.linspace(0, 1, 64)
+        msg = Message.request("double", NdArray().pack(value))
+        parsed = MessageParser().parse(str(msg))
+        reply = MessageParser().parse(str(Device().request_double("", parsed)))
+        self.assertEqual(reply.arguments[0], "ok")
+        self.assertTrue(numpy.array_equal(NdArray().unpack(reply.arguments[1]),
+                                          value * 2))
+
+
+class TestVector(unittest.TestCase):
+
+    def setUp(self):
+        if numpy is None:
+            self.skipTest("numpy not installed")
+
+    def test_pack_unpack(self):
+        """Test packing and unpacking full vectors."""
+        floats = Vector(3)
+        ints = Vector(dtype="int32")
+        self.assertEqual(floats.pack([1.5, 2, -0.25]), "1.5,2,-0.25")
+        self.assertEqual(ints.pack(numpy.arange(4)), "0,1,2,3")
+        self.assertEqual(list(floats.unpack("1.5,2,-0.25")), [1.5, 2, -0.25])
+        self.assertEqual(ints.unpack("7,8").dtype, numpy.dtype("int32"))
+        self.assertEqual(list(floats.unpack(None)), [0, 0, 0])
+        self.assertEqual(len(ints.unpack("")), 0)
+        self.assertRaises(ValueError, floats.pack, [1, 2])
+        self.assertRaises(ValueError, floats.pack, [[1, 2, 3]])
+        self.assertRaises(ValueError, ints.pack, [1.5])
+        self.assertRaises(ValueError, floats.unpack, "1,2")
+        self.assertRaises(ValueError, ints.unpack, "1,x")
+        self.assertRaises(ValueError, ints.unpack, None)
+        self.assertRaises(ValueError, Vector, 3, "S4")
+
+    def test_delta(self):
+        """Test packing and unpacking vector deltas."""
+        vector = Vector(4)
+        last = numpy.array([1.0, 2.0, 3.0, 4.0])
+        value = last.copy()
+        value[2] = 7.5
+        self.assertEqual(vector.encode_delta(value, None), "1,2,7.5,4")
+        self.assertEqual(vector.encode_delta(value, last), "~2=7.5")
+        self.assertEqual(vector.encode_delta(last, last), "~")
+        self.assertEqual(vector.encode_delta(last * 2, last), "2,4,6,8")
+
+        self.assertEqual(list(vector.decode_delta("~2=7.5", last)),
+                         [1, 2, 7.5, 4])
+        self.assertEqual(list(last), [1, 2, 3, 4])
+        self.assertEqual(list(vector.decode_delta("~", last)), [1, 2, 3, 4])
+        self.assertEqual(list(vector.decode_delta("5,6,7,8", None)),
+                         [5, 6, 7, 8])
+        self.assertRaises(ValueError, vector.decode_delta, "~1=2", None)
+        self.assertRaises(ValueError, vector.decode_delta, "~4=2", last)
+        self.assertRaises(ValueError, vector.decode_delta, "~1", last)
+
+
 class TestRegex(TestType):
 
     def setUp(self):
@@ -573,3 +688,37 @@ class TestDecorator(unittest.TestCase):
         """Test server request with a message argument."""
         sock = ""
         self.assertEqual(str(self.device.request_eight(sock, Message.request("eight", "8"))), "!eight ok 8 eight")
+
+
+class TestCompiled(unittest.TestCase):
+
+    TYPES = (Int(), Int(min=1, max=3), Float(), Float(min=0.0),
+             Str(), Bool(), Discrete(("a", "b")), Int(default=7))
+    NAMES = ["i", "j", "f", "g", "s", "b", "d"]
+
+    def outcome(self, func, *args):
+        try:
+            return func(*args)
+        except (FailReply, ValueError), e:
+            return (type(e), str(e))
+
+    def test_unpacker(self):
+        """Test compiled unpackers against unpack_types."""
+        unpacker = compile_unpacker(self.TYPES, self.NAMES)
+        good = ["1", "2", "1.5", "0.5", "x", "1", "a", "4"]
+        for args in [good, good[:-1], good[:4], good + ["extra"],
+                     ["x"] + good[1:], ["1", "4"] + good[2:],
+                     good[:2] + ["y"] + good[3:], good[:3] + ["-1"] + good[4:],
+                     good[:5] + ["2"] + good[6:], good[:6] + ["c", "1"]]:
+            self.assertEqual(self.outcome(unpacker, args),
+                    self.outcome(unpack_types, self.TYPES, args, self.NAMES))
+
+    def test_packer(self):
+        """Test compiled packers against pack_types."""
+        packer = compile_packer(self.TYPES)
+        good = [1, 2, 1.5, 0.5, "x", True, "a", 4]
+        for args in [good, good[:-1], good[:4], good + ["extra"],
+                     [1, 4] + good[2:], good[:3] + [-1.0] + good[4:],
+                     good[:5] + [False] + good[6:], good[:6] + ["c", 1]]:
+            self.assertEqual(self.outcome(packer, args),
+                    self.outcome(pack_types, self.TYPES, args))
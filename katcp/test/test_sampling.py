@@ -9,6 +9,8 @@
 
 import unittest
 import time
+import random
+import threading
 import logging
 import katcp
 from katcp.testutils import TestLogHandler, DeviceTestSensor
@@ -45,6 +47,8 @@ class TestSampling(unittest.TestCase):
         sampling.SamplePeriod(None, s, 10)
         sampling.SampleEvent(None, s)
         sampling.SampleDifferential(None, s, 2)
+        sampling.SampleEventRate(None, s, 10, 100)
+        sampling.SampleEventRate(None, s, 10, 0)
         self.assertRaises(ValueError, sampling.SampleNone, None, s, "foo")
         self.assertRaises(ValueError, sampling.SampleAuto, None, s, "bar")
         self.assertRaises(ValueError, sampling.SamplePeriod, None, s)
@@ -54,12 +58,16 @@ class TestSampling(unittest.TestCase):
         self.assertRaises(ValueError, sampling.SampleDifferential, None, s)
         self.assertRaises(ValueError, sampling.SampleDifferential, None, s, "-1")
         self.assertRaises(ValueError, sampling.SampleDifferential, None, s, "1.5")
+        self.assertRaises(ValueError, sampling.SampleEventRate, None, s, 10)
+        self.assertRaises(ValueError, sampling.SampleEventRate, None, s, 100, 10)
+        self.assertRaises(ValueError, sampling.SampleEventRate, None, s, -1, 0)
 
         sampling.SampleStrategy.get_strategy("none", None, s)
         sampling.SampleStrategy.get_strategy("auto", None, s)
         sampling.SampleStrategy.get_strategy("period", None, s, "15")
         sampling.SampleStrategy.get_strategy("event", None, s)
         sampling.SampleStrategy.get_strategy("differential", None, s, "2")
+        sampling.SampleStrategy.get_strategy("event-rate", None, s, "10", "100")
         self.assertRaises(ValueError, sampling.SampleStrategy.get_strategy, "random", None, s)
         self.assertRaises(ValueError, sampling.SampleStrategy.get_strategy, "period", None, s, "foo")
         self.assertRaises(ValueError, sampling.SampleStrategy.get_strategy, "differential", None, s, "bar")
@@ -75,6 +83,146 @@ class TestSampling(unittest.TestCase):
         self.sensor.set_value(2)
         self.assertEqual(len(self.calls), 2)
 
+    def test_event_ndarray(self):
+        """Test SampleEvent strategy on an ndarray sensor."""
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy not installed")
+        sensor = katcp.Sensor(katcp.Sensor.NDARRAY, "an.array", "An array.", "")
+        event = sampling.SampleEvent(self.inform, sensor)
+        event.attach()
+        self.assertEqual(len(self.calls), 1)
+
+        sensor.set_value(numpy.arange(3))
+        sensor.set_value(numpy.arange(3))
+        self.assertEqual(len(self.calls), 2)
+        sensor.set_value(numpy.arange(4))
+        sensor.set_value(numpy.ones(4))
+        self.assertEqual(len(self.calls), 4)
+
+    def test_vector(self):
+        """Test event and differential sampling of a vector sensor."""
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy not installed")
+        sensor = katcp.Sensor(katcp.Sensor.VECTOR, "a.vector", "A vector.", "",
+                              [4])
+        sensor.set_value(numpy.zeros(4))
+        event = sampling.SampleEvent(self.inform, sensor)
+        event.attach()
+        diff = sampling.SampleDifferential(self.inform, sensor, 1.0)
+        diff.attach()
+        self.assertEqual([msg.arguments[4] for msg in self.calls],
+                         ["0,0,0,0", "0,0,0,0"])
+        del self.calls[:]
+
+        sensor.set_value(numpy.array([0.0, 0.5, 0.0, 0.0]))
+        self.assertEqual([msg.arguments[4] for msg in self.calls], ["~1=0.5"])
+        sensor.set_value(numpy.array([0.0, 2.0, 0.0, 3.0]))
+        self.assertEqual([msg.arguments[4] for msg in self.calls[1:]],
+                         ["~1=2,3=3", "~1=2,3=3"])
+        sensor.set_value(numpy.array([1.0, 2.0, 0.5, 3.0]), katcp.Sensor.WARN)
+        self.assertEqual([msg.arguments[4] for msg in self.calls[3:]],
+                         ["~0=1,2=0.5", "~0=1,2=0.5"])
+        sensor.set_value(numpy.array([2.0, 3.0, 4.0, 5.0]), katcp.Sensor.WARN)
+        self.assertEqual([msg.arguments[4] for msg in self.calls[5:]],
+                         ["2,3,4,5", "2,3,4,5"])
+
+        mirror = katcp.Sensor(katcp.Sensor.VECTOR, "a.vector", "A vector.", "",
+                              [4])
+        for msg in self.calls:
+            mirror.set_formatted(*[msg.arguments[i] for i in (0, 3, 4)])
+        self.assertEqual(list(mirror.value()), [2, 3, 4, 5])
+        self.assertRaises(ValueError, sampling.SampleDifferential,
+                          self.inform, sensor, -1)
+        event.detach()
+        diff.detach()
+
+    def test_vector_concurrent_informs(self):
+        """Test vector deltas stay in order with updates and periodic racing."""
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy not installed")
+
+        def check(make_strategy, *tickers):
+            sensor = katcp.Sensor(katcp.Sensor.VECTOR, "a.vector",
+                                  "A vector.", "", [4])
+            sent = []
+            delays = random.Random(0)
+            def inform(msg):
+                # widen the window between computing a delta and sending it
+                time.sleep(delays.random() * 0.0005)
+                sent.append(msg)
+            computed = []
+            strategy = make_strategy(inform, sensor, computed)
+            strategy.periodic(time.time())
+            sensor.attach(strategy)
+
+            setters_done = []
+            def set_values(seed):
+                rng = numpy.random.RandomState(seed)
+                for i in range(1, 201):
+                    value = sensor.value().copy()
+                    value[rng.randint(4)] = i
+                    sensor.set_value(value)
+                setters_done.append(seed)
+            def run_ticker(tick):
+                ticks = 0
+                while len(setters_done) < 2 or ticks < 100:
+                    tick(strategy)
+                    ticks += 1
+            threads = [threading.Thread(target=set_values, args=(0,)),
+                       threading.Thread(target=set_values, args=(1,))]
+            threads += [threading.Thread(target=run_ticker, args=(tick,))
+                        for tick in tickers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            sensor.detach(strategy)
+            tickers[0](strategy)
+
+            mirror = katcp.Sensor(katcp.Sensor.VECTOR, "a.vector",
+                                  "A vector.", "", [4])
+            for msg in sent:
+                mirror.set_formatted(*[msg.arguments[i] for i in (0, 3, 4)])
+            self.assertTrue(len(sent) > 2)
+            self.assertEqual([id(msg) for msg in sent],
+                             [id(msg) for msg in computed])
+            self.assertEqual(list(mirror.value()), list(sensor.value()))
+
+        def event_rate(inform, sensor, computed):
+            class RecordingEventRate(sampling.SampleEventRate):
+                def sample(self):
+                    msg = sampling.SampleEventRate.sample(self)
+                    computed.append(msg)
+                    return msg
+            return RecordingEventRate(inform, sensor, 0, 1)
+
+        check(event_rate, lambda strategy:
+              strategy.periodic(time.time() + 1.0))
+
+        def period(inform, sensor, computed):
+            class RecordingPeriod(sampling.SamplePeriod):
+                def sample(self):
+                    msg = sampling.SamplePeriod.sample(self)
+                    computed.append(msg)
+                    return msg
+            return RecordingPeriod(inform, sensor, 10)
+
+        # group ticks on one thread racing informs sent directly on
+        # another, as add_strategy sends the first one
+        group = sampling._PeriodGroup(0.01)
+        def group_tick(strategy):
+            if strategy not in group._members:
+                group.add(strategy)
+            group.periodic(time.time())
+
+        check(period, group_tick, lambda strategy: strategy.inform())
+
     def test_event_with_rate_limit(self):
         """Test SampleEvent strategy with a rate limit."""
         event = sampling.SampleEvent(self.inform, self.sensor, 100)
@@ -159,3 +307,221 @@ class TestReactor(unittest.TestCase):
 
         self.assertTrue(emin <= len(self.calls) <= emax, "Expect %d to %d informs, got:\n  %s"
             % (emin, emax, "\n  ".join(str(x) for x in self.calls)))
+
+    def test_periodic_groups(self):
+        """Test that strategies with equal periods are sampled together."""
+        batches = []
+
+        class BatchInformer(object):
+            def __call__(self, msg):
+                batches.append([msg])
+
+            def batch(self, msgs):
+                batches.append(msgs)
+
+        informer = BatchInformer()
+        other = DeviceTestSensor(
+                katcp.Sensor.INTEGER, "other.int", "An integer.", "count",
+                [-4, 3],
+                timestamp=12345, status=katcp.Sensor.NOMINAL, value=1
+        )
+        first = sampling.SamplePeriod(informer, self.sensor, 20)
+        second = sampling.SamplePeriod(informer, other, 20)
+        third = sampling.SamplePeriod(self.inform, self.sensor, 20)
+        for strategy in (first, second, third):
+            self.reactor.add_strategy(strategy)
+        self.assertEqual(len(self.reactor._groups), 1)
+        self.assertEqual(len(self.reactor._entries), 1)
+
+        time.sleep(0.1)
+        self.reactor.remove_strategy(second)
+        del batches[:]
+        time.sleep(0.05)
+        for strategy in (first, third):
+            self.reactor.remove_strategy(strategy)
+
+        ticks = len(self.calls)
+        self.assertTrue(ticks >= 6, "Expected at least 6 informs, got %d"
+                        % ticks)
+        # only one strategy using the batch informer is left
+        self.assertTrue(all(len(msgs) == 1 for msgs in batches))
+
+        self.assertEqual(self.reactor._groups, {})
+        self.assertEqual(self.reactor._entries, {})
+        self.assertFalse(any(self.reactor._wheel))
+
+    def test_batch_informs(self):
+        """Test that each group tick sends one batch per informer."""
+        batches = []
+
+        class BatchInformer(object):
+            def __call__(self, msg):
+                pass
+
+            def batch(self, msgs):
+                batches.append([m.arguments[2] for m in msgs])
+
+        informer = BatchInformer()
+        other = DeviceTestSensor(
+                katcp.Sensor.INTEGER, "other.int", "An integer.", "count",
+                [-4, 3],
+                timestamp=12345, status=katcp.Sensor.NOMINAL, value=1
+        )
+        for sensor in (self.sensor, other):
+            self.reactor.add_strategy(
+                sampling.SamplePeriod(informer, sensor, 20))
+        time.sleep(0.1)
+        self.assertTrue(len(batches) >= 3)
+        for names in batches:
+            self.assertEqual(sorted(names), ["an.int", "other.int"])
+
+    def test_custom_periodic(self):
+        """Test strategies that schedule themselves with periodic."""
+        calls = []
+
+        class Countdown(sampling.SampleStrategy):
+            def periodic(self, timestamp):
+                calls.append(timestamp)
+                if len(calls) < 3:
+                    return timestamp + 0.01
+
+        self.reactor.add_strategy(Countdown(self.inform, self.sensor))
+        time.sleep(0.1)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.reactor._entries, {})
+
+    def test_period_subclass(self):
+        """Test that SamplePeriod subclasses overriding periodic or inform
+        are scheduled on their own."""
+        ticks, informs = [], []
+
+        class Counted(sampling.SamplePeriod):
+            def periodic(self, timestamp):
+                ticks.append(timestamp)
+                return sampling.SamplePeriod.periodic(self, timestamp)
+
+        class Tagged(sampling.SamplePeriod):
+            def inform(self):
+                informs.append(self.sample())
+
+        counted = Counted(self.inform, self.sensor, 20)
+        tagged = Tagged(self.inform, self.sensor, 20)
+        plain = sampling.SamplePeriod(self.inform, self.sensor, 20)
+        for strategy in (counted, tagged, plain):
+            self.reactor.add_strategy(strategy)
+        self.assertEqual(self.reactor._grouped.keys(), [plain])
+        self.assertEqual(len(self.reactor._entries), 3)
+
+        time.sleep(0.1)
+        for strategy in (counted, tagged, plain):
+            self.reactor.remove_strategy(strategy)
+        self.assertTrue(len(ticks) >= 3, "Expected at least 3 ticks, got %d"
+                        % len(ticks))
+        self.assertTrue(len(informs) >= 3, "Expected at least 3 informs,"
+                        " got %d" % len(informs))
+        self.assertEqual(self.reactor._entries, {})
+
+    def test_next_deadline(self):
+        """Test finding the next deadline past moved and cancelled items."""
+        class Idle(object):
+            def periodic(self, timestamp):
+                pass
+
+        reactor = sampling.SampleReactor()
+        now = time.time()
+        first, second, third = Idle(), Idle(), Idle()
+        self.assertEqual(reactor._next_deadline(), None)
+        reactor.schedule(first, now + 1.0)
+        reactor.schedule(second, now + 2.0)
+        # further than a full turn of the wheel
+        reactor.schedule(third, now + 100.0)
+        self.assertEqual(reactor._next_deadline(), now + 1.0)
+        reactor.schedule(first, now + 3.0)
+        self.assertEqual(reactor._next_deadline(), now + 2.0)
+        reactor.cancel(second)
+        self.assertEqual(reactor._next_deadline(), now + 3.0)
+        reactor.cancel(first)
+        self.assertEqual(reactor._next_deadline(), now + 100.0)
+        reactor.cancel(third)
+        self.assertEqual(reactor._next_deadline(), None)
+
+        # moving an item around leaves nothing behind
+        for i in range(3 * reactor.WHEEL_SIZE):
+            reactor.schedule(first, now + i * reactor.RESOLUTION)
+        self.assertEqual(reactor._next_deadline(),
+                         now + i * reactor.RESOLUTION)
+        self.assertEqual(sorted(reactor._slot_min)[1:],
+                         [float("inf")] * (reactor.WHEEL_SIZE - 1))
+
+    def test_schedule_removed_strategy(self):
+        """Test that a removed strategy cannot be scheduled again."""
+        reactor = sampling.SampleReactor()
+        event = sampling.SampleEventRate(self.inform, self.sensor, 50, 0)
+        reactor.add_strategy(event)
+        reactor.remove_strategy(event)
+        # as if an update had been between releasing its lock and
+        # scheduling the delayed send when the strategy was removed
+        reactor.schedule(event, time.time())
+        self.assertEqual(reactor._entries, {})
+
+    def test_schedule(self):
+        """Test scheduling and cancelling one-off items."""
+        calls = []
+
+        class OneShot(object):
+            def periodic(self, timestamp):
+                calls.append(timestamp)
+
+        now = time.time()
+        first, second = OneShot(), OneShot()
+        self.reactor.schedule(first, now + 0.02)
+        self.reactor.schedule(second, now + 0.03)
+        self.reactor.cancel(second)
+        time.sleep(0.1)
+        self.assertEqual(calls, [now + 0.02])
+        self.assertEqual(self.reactor._entries, {})
+
+    def test_merge_sensor_status(self):
+        """Test merging sensor-status informs by timestamp."""
+        def status(timestamp, name, value):
+            return katcp.Message.inform("sensor-status", timestamp, "1",
+                                        name, "nominal", value)
+
+        merged = sampling.merge_sensor_status([
+            status("1000", "a", "1"),
+            status("1000", "b", "2"),
+            status("1000", "a", "3"),
+            status("2000", "b", "4"),
+        ])
+        self.assertEqual([str(m) for m in merged], [
+            "#sensor-status 1000 2 a nominal 1 b nominal 2",
+            "#sensor-status 1000 1 a nominal 3",
+            "#sensor-status 2000 1 b nominal 4",
+        ])
+        self.assertEqual(sampling.merge_sensor_status([]), [])
+
+    def test_event_rate(self):
+        """Test SampleEventRate strategy on the reactor."""
+        event = sampling.SampleEventRate(self.inform, self.sensor, 50, 200)
+        self.reactor.add_strategy(event)
+        self.assertEqual(len(self.calls), 1)
+
+        # a burst of changes sends the first one, holds back the rest
+        # and sends the final value once the shortest period is over
+        time.sleep(0.06)
+        for value in [-1, 0, 1, 2]:
+            self.sensor.set_value(value)
+        self.assertEqual(len(self.calls), 2)
+        time.sleep(0.08)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(self.calls[-1].arguments[4], "2")
+
+        # no changes, so the next update is the forced refresh
+        time.sleep(0.1)
+        self.assertEqual(len(self.calls), 3)
+        time.sleep(0.15)
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(self.calls[-1].arguments[4], "2")
+
+        self.reactor.remove_strategy(event)
+        self.assertEqual(self.reactor._entries, {})
@@ -62,6 +62,46 @@ class TestGenericSensorTree(BaseTreeTest):
         self.assertRaises(ValueError, self.tree.parents, self.sensor1)
         self.assertRaises(ValueError, self.tree.parents, self.sensor2)
 
+    def test_update_batch(self):
+        self.tree.add_links(self.sensor1, [self.sensor2, self.sensor3])
+        del self.calls[:]
+        with katcp.SensorBatch() as batch:
+            batch.set_value(self.sensor2, 5)
+            batch.set_value(self.sensor3, 6)
+        self.assertEqual(self.calls, [
+            (self.sensor1, [self.sensor2, self.sensor3]),
+        ])
+        self.assertSensorValues((self.sensor2, self.sensor3), (5, 6))
+
+
+    def test_deferred(self):
+        self.tree.add_links(self.sensor1, [self.sensor2, self.sensor3])
+        del self.calls[:]
+        with self.tree.deferred():
+            self.sensor2.set_value(1)
+            self.sensor3.set_value(2)
+            self.sensor2.set_value(3)
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, [
+            (self.sensor1, [self.sensor2, self.sensor3]),
+        ])
+
+    def test_hold_and_flush(self):
+        self.tree.add_links(self.sensor1, [self.sensor2])
+        del self.calls[:]
+        self.tree.hold_updates()
+        self.sensor2.set_value(1)
+        self.tree.flush()
+        self.assertEqual(self.calls, [(self.sensor1, [self.sensor2])])
+        self.tree.flush()
+        self.sensor2.set_value(2)
+        self.tree.remove_links(self.sensor1, [self.sensor2])
+        del self.calls[:]
+        self.tree.release_updates()
+        # the removed parent is not recalculated
+        self.assertEqual(self.calls, [])
+        self.assertRaises(ValueError, self.tree.release_updates)
+
 
 class TestBooleanSensorTree(BaseTreeTest):
 
@@ -94,6 +134,31 @@ class TestBooleanSensorTree(BaseTreeTest):
         tree.remove(s0, s1)
         self.assertSensorValues(sensors, (True, False, False, False))
 
+    def test_deferred(self):
+        tree = katcp.BooleanSensorTree()
+        root, beam0, beam1 = self.make_sensors(3, katcp.Sensor.BOOLEAN)
+        flags = self.make_sensors(20, katcp.Sensor.BOOLEAN)
+        tree.add(root, beam0)
+        tree.add(root, beam1)
+        for i, flag in enumerate(flags):
+            tree.add(i % 2 and beam1 or beam0, flag)
+
+        recalculated = []
+        recalculate = tree.recalculate
+        def recording(parent, updates):
+            recalculated.append(parent)
+            recalculate(parent, updates)
+        tree.recalculate = recording
+
+        with tree.deferred():
+            for flag in flags:
+                flag.set_value(True)
+        self.assertSensorValues((root, beam0, beam1), (True, True, True))
+        self.assertEqual(sorted(recalculated), sorted([beam0, beam1, root]))
+
+        flags[3].set_value(False)
+        self.assertSensorValues((root, beam0, beam1), (False, True, False))
+
 
 class TestAggregateSensorTree(BaseTreeTest):
 
@@ -12,7 +12,8 @@ import katcp
 import time
 import logging
 import threading
-from katcp.testutils import TestLogHandler, \
+import socket
+from katcp.testutils import TestLogHandler, DeviceTestSensor, \
     BlockingTestClient, DeviceTestServer, TestUtilMixin
 
 log_handler = TestLogHandler()
@@ -134,6 +135,7 @@ class TestDeviceServer(unittest.TestCase, TestUtilMixin):
             (r"!log-level ok trace", ""),
             (r"!log-level fail Unknown\_logging\_level\_name\_'unknown'", ""),
             (r"#help client-list", ""),
+            (r"#help client-log-level", ""),
             (r"#help halt", ""),
             (r"#help help", ""),
             (r"#help log-level", ""),
@@ -146,7 +148,7 @@ class TestDeviceServer(unittest.TestCase, TestUtilMixin):
             (r"#help sensor-value", ""),
             (r"#help slow-command", ""),
             (r"#help watchdog", ""),
-            (r"!help ok 13", ""),
+            (r"!help ok 14", ""),
             (r"#help watchdog", ""),
             (r"!help ok 1", ""),
             (r"!help fail", ""),
@@ -224,6 +226,7 @@ class TestDeviceServer(unittest.TestCase, TestUtilMixin):
             (r"!log-level[4] ok trace", ""),
             (r"!log-level[5] fail Unknown\_logging\_level\_name\_'unknown'", ""),
             (r"#help[6] client-list", ""),
+            (r"#help[6] client-log-level", ""),
             (r"#help[6] halt", ""),
             (r"#help[6] help", ""),
             (r"#help[6] log-level", ""),
@@ -236,7 +239,7 @@ class TestDeviceServer(unittest.TestCase, TestUtilMixin):
             (r"#help[6] sensor-value", ""),
             (r"#help[6] slow-command", ""),
             (r"#help[6] watchdog", ""),
-            (r"!help[6] ok 13", ""),
+            (r"!help[6] ok 14", ""),
             (r"#help[7] watchdog", ""),
             (r"!help[7] ok 1", ""),
             (r"!help[8] fail", ""),
@@ -370,6 +373,31 @@ class TestDeviceServer(unittest.TestCase, TestUtilMixin):
         self.assertFalse(self.server._running.isSet())
         self.server.start(timeout=1.0)
 
+    def test_mass_inform(self):
+        """Test that mass_inform encodes once and honours filters."""
+        encoded = []
+
+        class CountingMessage(katcp.Message):
+            __slots__ = []
+
+            def __str__(self):
+                encoded.append(self.name)
+                return super(CountingMessage, self).__str__()
+
+        time.sleep(0.1)
+        self.client.clear_messages()
+        self.server.mass_inform(CountingMessage(katcp.Message.INFORM,
+                                                "broadcast", ["one"]))
+        self.server.mass_inform(CountingMessage(katcp.Message.INFORM,
+                                                "filtered", ["two"]),
+                                sock_filter=lambda sock: False)
+        time.sleep(0.1)
+
+        self.assertEqual(encoded, ["broadcast"])
+        self._assert_msgs_equal(self.client.messages(), [
+            r"#broadcast one",
+        ])
+
     def test_bad_client_socket(self):
         """Test what happens when select is called on a dead client socket."""
         # wait for client to arrive
@@ -463,7 +491,9 @@ class TestDeviceServer(unittest.TestCase, TestUtilMixin):
         msgs = self.client.messages()
         updates = [x for x in msgs if x.name == "sensor-status"]
         others = [x for x in msgs if x.name != "sensor-status"]
-        self.assertTrue(abs(len(updates) - 12) < 2, "Expected 12 informs, saw %d." % len(updates))
+        self.assertTrue(abs(len(updates) - 11) < 2, "Expected 11 informs, saw %d." % len(updates))
+        # no samples once the strategy has been removed
+        self.assertEqual(msgs[-1].name, "sensor-sampling")
 
         self._assert_msgs_equal(others, [
             r"#version device_stub-0.1",
@@ -480,3 +510,458 @@ class TestDeviceServer(unittest.TestCase, TestUtilMixin):
         self.server.remove_sensor(an_int)
         self.server.add_sensor(an_int)
         self.test_sampling()
+
+    def test_memoized_lists(self):
+        """Test that ?help and ?sensor-list are sent in one write and follow
+           sensor changes."""
+        writes = []
+        send_data = self.server._send_data
+        def counting_send_data(sock, data):
+            # ignore anything else still being sent to the client
+            if "help" in data or "sensor-list" in data:
+                writes.append(data)
+            send_data(sock, data)
+        self.server._send_data = counting_send_data
+
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("help"))
+        self.assertTrue(reply.reply_ok())
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(writes[0].count("\n"), len(informs) + 1)
+        self.assertEqual(reply.arguments[1], str(len(informs)))
+
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("sensor-list", "an.int"))
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(str(informs[0]),
+                         r"#sensor-list an.int An\_Integer. count integer -5 5")
+
+        an_int = self.server._sensors["an.int"]
+        self.server.remove_sensor(an_int)
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("sensor-list", "an.int"))
+        self.assertFalse(reply.reply_ok())
+        an_int.description = "A replaced integer."
+        self.server.add_sensor(an_int)
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("sensor-list", "an.int"))
+        self.assertEqual(str(informs[0]), r"#sensor-list an.int"
+                         r" A\_replaced\_integer. count integer -5 5")
+
+    def test_sensor_status_batching(self):
+        """Test combining sensor updates into multi-sensor informs."""
+        an_int = self.server._sensors["an.int"]
+        other = DeviceTestSensor(katcp.Sensor.INTEGER, "other.int",
+                                 "An Integer.", "count", [-5, 5],
+                                 timestamp=12345, status=katcp.Sensor.NOMINAL,
+                                 value=1)
+        self.server.add_sensor(other)
+        self.server.set_sensor_status_batching(0.05)
+
+        for name in ("an.int", "other.int"):
+            reply, informs = self.client.blocking_request(
+                katcp.Message.request("sensor-sampling", name, "auto"))
+            self.assertTrue(reply.reply_ok())
+        time.sleep(0.1)
+        self.client.clear_messages()
+
+        an_int.set(12346, katcp.Sensor.NOMINAL, 2)
+        other.set(12346, katcp.Sensor.WARN, 4)
+        an_int.set(12347, katcp.Sensor.NOMINAL, 1)
+        an_int.set(12347, katcp.Sensor.NOMINAL, 0)
+        time.sleep(0.01)
+        self.assertEqual(self.client.messages(), [])
+        time.sleep(0.1)
+
+        self._assert_msgs_equal(self.client.messages(), [
+            r"#sensor-status 12346000 2 an.int nominal 2 other.int warn 4",
+            r"#sensor-status 12347000 1 an.int nominal 1",
+            r"#sensor-status 12347000 1 an.int nominal 0",
+        ])
+
+        # switching batching off sends updates straight away
+        self.server.set_sensor_status_batching(None)
+        self.client.clear_messages()
+        other.set(12348, katcp.Sensor.NOMINAL, 5)
+        time.sleep(0.05)
+        self._assert_msgs_equal(self.client.messages(), [
+            r"#sensor-status 12348000 1 other.int nominal 5",
+        ])
+
+
+class TestDeviceServerLoad(unittest.TestCase):
+    NUM_CLIENTS = 300
+
+    def setUp(self):
+        self.server = DeviceTestServer('', 0)
+        self.server.start(timeout=0.1)
+        self.socks = []
+
+    def tearDown(self):
+        for sock in self.socks:
+            sock.close()
+        if self.server.running():
+            self.server.stop()
+            self.server.join()
+
+    def _read_until(self, sock, marker):
+        data = ""
+        while marker not in data:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def test_many_clients(self):
+        """Test a server with hundreds of clients connected at once."""
+        host, port = self.server._sock.getsockname()
+        for _i in range(self.NUM_CLIENTS):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(10.0)
+            sock.connect(("127.0.0.1", port))
+            self.socks.append(sock)
+
+        start = time.time()
+        while len(self.server._socks) < self.NUM_CLIENTS \
+                and time.time() - start < 10.0:
+            time.sleep(0.05)
+        self.assertEqual(len(self.server._socks), self.NUM_CLIENTS)
+
+        for sock in self.socks:
+            sock.sendall("?watchdog\n")
+        for sock in self.socks:
+            data = self._read_until(sock, "!watchdog")
+            self.assertTrue("!watchdog ok" in data)
+
+        # every client sees a mass inform
+        self.server.mass_inform(katcp.Message.inform("load-test", "done"))
+        for sock in self.socks:
+            self.assertTrue("#load-test done" in
+                            self._read_until(sock, "#load-test done"))
+
+        # the server notices clients leaving
+        for sock in self.socks[:self.NUM_CLIENTS // 2]:
+            sock.close()
+        start = time.time()
+        while len(self.server._socks) > self.NUM_CLIENTS // 2 \
+                and time.time() - start < 10.0:
+            time.sleep(0.05)
+        self.assertEqual(len(self.server._socks), self.NUM_CLIENTS // 2)
+        self.assertEqual(len(self.server._selector), self.NUM_CLIENTS // 2 + 1)
+
+
+class TestDeviceServerHandlerPool(unittest.TestCase, TestUtilMixin):
+    def setUp(self):
+        self.server = DeviceTestServer('', 0, handler_threads=2)
+        self.server.start(timeout=0.1)
+
+        host, port = self.server._sock.getsockname()
+
+        self.client = BlockingTestClient(self, host, port)
+        self.client.start(timeout=0.1)
+        self.other = BlockingTestClient(self, host, port)
+        self.other.start(timeout=0.1)
+
+    def tearDown(self):
+        for client in (self.client, self.other):
+            if client.running():
+                client.stop()
+                client.join()
+        if self.server.running():
+            self.server.stop()
+            self.server.join()
+
+    def test_slow_handler_does_not_block(self):
+        """Test that other clients are answered while a handler is slow."""
+        time.sleep(0.1)
+        self.client.request(katcp.Message.request("slow-command", "0.5"))
+        time.sleep(0.05)
+
+        start = time.time()
+        reply, informs = self.other.blocking_request(
+            katcp.Message.request("watchdog"), timeout=1.0)
+        self.assertTrue(reply.reply_ok())
+        reply, informs = self.other.blocking_request(
+            katcp.Message.request("new-command"), timeout=1.0)
+        self.assertTrue(reply.reply_ok())
+        self.assertTrue(time.time() - start < 0.3)
+
+    def test_replies_ordered_per_client(self):
+        """Test that replies to a single client keep the request order."""
+        time.sleep(0.1)
+        self.client.clear_messages()
+        self.client.raw_send("?slow-command 0.3\n?watchdog\n?new-command\n"
+                             "?slow-command 0.1\n?sensor-value an.int\n")
+        time.sleep(0.6)
+        self._assert_msgs_equal(self.client.messages(), [
+            r"!slow-command ok",
+            r"!watchdog ok",
+            r"!new-command ok param1 param2",
+            r"!slow-command ok",
+            r"#sensor-value 12345000 1 an.int nominal 3",
+            r"!sensor-value ok 1",
+        ])
+
+
+class TestSensorNameIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = katcp.server.SensorNameIndex()
+        for name in ["beam1.rms", "beam1.power", "beam10.rms", "beam2.rms",
+                     "adc.clip", "beam1.rms"]:
+            self.index.add(name)
+
+    def test_regex_literal_prefix(self):
+        """Test extracting literal prefixes from anchored regexes."""
+        prefix = katcp.server.regex_literal_prefix
+        self.assertEqual(prefix("beam1"), None)
+        self.assertEqual(prefix("^beam1\\.rms"), "beam1.rms")
+        self.assertEqual(prefix("^beam1.*"), "beam1")
+        self.assertEqual(prefix("^beam1*"), "beam")
+        self.assertEqual(prefix("^beam1?x"), "beam")
+        self.assertEqual(prefix("^beam[12]"), "beam")
+        self.assertEqual(prefix("^beam\\d"), "beam")
+        self.assertEqual(prefix("^beam|adc"), None)
+        self.assertEqual(prefix("^beam(?i)"), None)
+
+    def test_match(self):
+        """Test exact, regex and prefix queries."""
+        self.assertEqual(self.index.match(None), (False,
+            ["adc.clip", "beam1.power", "beam1.rms", "beam10.rms",
+             "beam2.rms"]))
+        self.assertEqual(self.index.match("beam2.rms"), (True, ["beam2.rms"]))
+        self.assertEqual(self.index.match("beam3.rms"), (True, []))
+        self.assertEqual(self.index.match("/rms/"), (False,
+            ["beam1.rms", "beam10.rms", "beam2.rms"]))
+        self.assertEqual(self.index.match("/^beam1\\./"), (False,
+            ["beam1.power", "beam1.rms"]))
+        self.assertEqual(self.index.match("/^beam1/"), (False,
+            ["beam1.power", "beam1.rms", "beam10.rms"]))
+        self.assertEqual(self.index.match("/^Beam/"), (False, []))
+
+    def test_cache_invalidation(self):
+        """Test that cached query results follow additions and removals."""
+        self.assertEqual(self.index.match("/^beam2/"), (False, ["beam2.rms"]))
+        self.index.add("beam2.power")
+        self.assertEqual(self.index.match("/^beam2/"), (False,
+            ["beam2.power", "beam2.rms"]))
+        self.index.remove("beam2.rms")
+        self.index.remove("no.such.sensor")
+        self.assertEqual(self.index.match("/^beam2/"), (False,
+            ["beam2.power"]))
+
+
+class TestDeviceLogger(unittest.TestCase, TestUtilMixin):
+    def setUp(self):
+        self.server = DeviceTestServer('', 0)
+        self.server.start(timeout=0.1)
+
+        host, port = self.server._sock.getsockname()
+
+        self.client = BlockingTestClient(self, host, port)
+        self.client.start(timeout=0.1)
+        self.other = BlockingTestClient(self, host, port)
+        self.other.start(timeout=0.1)
+        time.sleep(0.1)
+        self.client.clear_messages()
+        self.other.clear_messages()
+
+    def tearDown(self):
+        self.server.log.disable_async()
+        for client in (self.client, self.other):
+            if client.running():
+                client.stop()
+                client.join()
+        if self.server.running():
+            self.server.stop()
+            self.server.join()
+
+    def _log_texts(self, client):
+        return [msg.arguments[3] for msg in client.messages()
+                if msg.name == "log"]
+
+    def test_client_levels(self):
+        """Test that clients can have their own logging levels."""
+        log = self.server.log
+        sock = self.server.get_sockets()[0]
+        client, other = (self.client, self.other)
+        if client._sock.getsockname() != sock.getpeername():
+            client, other = other, client
+
+        log.set_client_log_level(sock, log.DEBUG)
+        self.assertEqual(log.client_log_level(sock), log.DEBUG)
+        log.debug("debug-msg")
+        log.warn("warn-msg")
+        time.sleep(0.1)
+        self.assertEqual(self._log_texts(client), ["debug-msg", "warn-msg"])
+        self.assertEqual(self._log_texts(other), ["warn-msg"])
+
+        log.set_client_log_level(sock, None)
+        self.assertEqual(log.client_log_level(sock), log.WARN)
+        log.debug("ignored")
+        time.sleep(0.1)
+        self.assertEqual(self._log_texts(client), ["debug-msg", "warn-msg"])
+
+    def test_client_log_level_request(self):
+        """Test that ?client-log-level sets the requesting client's level."""
+        log = self.server.log
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("client-log-level"))
+        self.assertEqual(reply.arguments, ["ok", "warn"])
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("client-log-level", "debug"))
+        self.assertEqual(reply.arguments, ["ok", "debug"])
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("client-log-level", "unknown"))
+        self.assertEqual(reply.arguments[0], "fail")
+
+        log.debug("debug-msg")
+        time.sleep(0.1)
+        self.assertEqual(self._log_texts(self.client), ["debug-msg"])
+        self.assertEqual(self._log_texts(self.other), [])
+        self.assertEqual(log.level_name(), "warn")
+
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("client-log-level", "default"))
+        self.assertEqual(reply.arguments, ["ok", "warn"])
+        log.debug("ignored")
+        time.sleep(0.1)
+        self.assertEqual(self._log_texts(self.client), ["debug-msg"])
+
+    def test_async(self):
+        """Test sending log messages from the background sender."""
+        log = self.server.log
+        log.enable_async()
+        for i in range(20):
+            log.warn("msg %d", i)
+        log.info("ignored")
+        time.sleep(0.2)
+        expected = ["msg %d" % i for i in range(20)]
+        self.assertEqual(self._log_texts(self.client), expected)
+        self.assertEqual(self._log_texts(self.other), expected)
+        self.assertEqual(log.dropped(), 0)
+
+    def test_async_overload(self):
+        """Test that a full queue drops messages instead of blocking."""
+        log = self.server.log
+        release = threading.Event()
+        sent = []
+
+        # hold up the sender so that the queue fills
+        def forward(batch):
+            release.wait(1.0)
+            sent.extend(msg.arguments[3] for level, msg in batch)
+        log._forward = forward
+
+        log.enable_async(queue_size=5)
+        start = time.time()
+        for i in range(50):
+            log.warn("msg %d", i)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertTrue(log.dropped() >= 40)
+
+        release.set()
+        log.disable_async()
+        messages = [text for text in sent if text.startswith("msg")]
+        reports = [int(text.split()[0]) for text in sent
+                   if text.endswith("log messages dropped")]
+        self.assertEqual(len(messages), 50 - log.dropped())
+        self.assertEqual(sum(reports), log.dropped())
+
+
+    def test_disable_async_full_queue(self):
+        """Test that disabling the sender does not block on a full queue."""
+        log = self.server.log
+        release = threading.Event()
+        sent = []
+
+        def forward(batch):
+            release.wait(1.0)
+            sent.extend(msg.arguments[3] for level, msg in batch)
+        log._forward = forward
+
+        log.enable_async(queue_size=5)
+        sender = log._sender
+        for i in range(10):
+            log.warn("msg %d", i)
+        start = time.time()
+        log.disable_async(timeout=0.05)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertTrue(sender.isAlive())
+
+        release.set()
+        sender.join(1.0)
+        self.assertFalse(sender.isAlive())
+        messages = [text for text in sent if text.startswith("msg")]
+        self.assertEqual(len(messages), 10 - log.dropped())
+
+
+class PerformanceTestServer(DeviceTestServer):
+    PERFORMANCE_SENSORS = True
+
+
+class TestPerformanceSensors(unittest.TestCase, TestUtilMixin):
+    def setUp(self):
+        self.server = PerformanceTestServer('', 0)
+        self.server.start(timeout=0.1)
+
+        host, port = self.server._sock.getsockname()
+
+        self.client = BlockingTestClient(self, host, port)
+        self.client.start(timeout=0.1)
+
+    def tearDown(self):
+        if self.client.running():
+            self.client.stop()
+            self.client.join()
+        if self.server.running():
+            self.server.stop()
+            self.server.join()
+
+    def _value(self, name):
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("sensor-value", name))
+        self.assertTrue(reply.reply_ok(), str(reply))
+        return informs[0].arguments[4]
+
+    def test_sensors(self):
+        """Test reading the server performance sensors."""
+        for _i in range(5):
+            self.client.blocking_request(katcp.Message.request("watchdog"))
+        self.client.blocking_request(
+            katcp.Message.request("slow-command", "0.05"))
+
+        self.assertTrue(float(self._value("server.request-rate")) > 0)
+        self.assertTrue(float(self._value("server.inform-rate")) > 0)
+        self.assertEqual(self._value("server.clients"), "1")
+        self.assertEqual(self._value("server.pending-requests"), "0")
+        self.assertTrue(float(self._value(
+            "server.request.slow-command.latency-p50")) >= 50.0)
+        self.assertTrue(float(self._value(
+            "server.request.watchdog.latency-p99")) < 50.0)
+        self.assertEqual(float(self._value(
+            "server.request.halt.latency-p90")), 0.0)
+
+        sock = self.server.get_sockets()[0]
+        prefix = "server.client.%s:%d" % sock.getpeername()
+        self.assertTrue(int(self._value(prefix + ".bytes-in")) >= 5 * 10)
+        self.assertTrue(int(self._value(prefix + ".bytes-out")) >= 5 * 13)
+
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("sensor-list", "/^server\\.client\\./"))
+        self.assertEqual(len(informs), 3)
+
+    def test_client_sensors_removed(self):
+        """Test that a client's sensors go away when it disconnects."""
+        host, port = self.server._sock.getsockname()
+        other = BlockingTestClient(self, host, port)
+        other.start(timeout=0.1)
+        time.sleep(0.1)
+        self.assertEqual(len(self.server._client_sensors), 2)
+        other.stop()
+        other.join()
+        time.sleep(0.1)
+        self.assertEqual(len(self.server._client_sensors), 1)
+        reply, informs = self.client.blocking_request(
+            katcp.Message.request("sensor-list", "/^server\\.client\\./"))
+        self.assertEqual(len(informs), 3)
@@ -9,7 +9,7 @@ from katcp import MessageParser, Message, AsyncReply
 from katcp.core import FailReply
 from katcp.server import DeviceLogger, construct_name_filter
 from katcp.tx.sampling import (DifferentialStrategy, AutoStrategy,
-    EventStrategy, NoStrategy, PeriodicStrategy)
+    EventStrategy, EventRateStrategy, NoStrategy, PeriodicStrategy)
 import sys, traceback
 import time
 
@@ -49,18 +49,44 @@ class KatCP(LineReceiver):
     delimiter = '\n'
     MAX_LENGTH = 64*(2**20) # 64 MB should be fine
 
+    use_mids = False # tag requests with message ids, so replies can be
+                     # matched by id rather than by name and order
+
     def __init__(self):
         self.parser = MessageParser()
-        self.queries = []
+        self.queries = [] # (name, deferred, informs, mid) in sending order
+        self.mid_queries = {} # mid -> the matching entry of queries
+        self._last_mid = 0
 
     def send_request(self, name, *args):
         if not self.transport.connected:
             raise DeviceNotConnected()
         d = Deferred()
-        self.send_message(Message.request(name, *args))
-        self.queries.append((name, d, []))
+        mid = None
+        if self.use_mids:
+            self._last_mid += 1
+            mid = str(self._last_mid)
+        self.send_message(Message.request(name, *args, mid=mid))
+        query = (name, d, [], mid)
+        self.queries.append(query)
+        if mid is not None:
+            self.mid_queries[mid] = query
         return d
 
+    def _find_query(self, msg):
+        """ Find the outstanding request a reply or inform belongs to, by
+        message id if it has one we know and otherwise by name (the oldest
+        request of that name), or None
+        """
+        if msg.mid is not None:
+            query = self.mid_queries.get(msg.mid)
+            if query is not None:
+                return query
+        for query in self.queries:
+            if query[0] == msg.name:
+                return query
+        return None
+
     def dataReceived(self, data):
         # translate '\r' into '\n'
         return LineReceiver.dataReceived(self, data.replace('\r', '\n'))
@@ -99,11 +125,11 @@ class KatCP(LineReceiver):
         if meth is not None:
             meth(msg)
         elif self.queries:
-            name, d, queue = self.queries[0]
-            if name != msg.name:
+            query = self._find_query(msg)
+            if query is None:
                 return # instead of raising WrongQueryOrder, we discard informs
                        # that we don't know about
-            queue.append(msg) # unespace?
+            query[2].append(msg) # unespace?
         else:
             raise UnhandledMessage(msg)
 
@@ -116,9 +142,12 @@ class KatCP(LineReceiver):
                 raise ShouldReturnMessage('request_' + name + ' should return a'
                                           'message or raise AsyncReply, instead'
                                           'it returned %r' % rep_msg)
+            if rep_msg.mid is None:
+                rep_msg.mid = msg.mid
             self.send_message(rep_msg)
         except FailReply, fr:
-            self.send_message(Message.reply(name, "fail", str(fr)))
+            self.send_message(Message.reply(msg.name, "fail", str(fr),
+                                            mid=msg.mid))
         except AsyncReply:
             return
         except Exception:
@@ -128,16 +157,20 @@ class KatCP(LineReceiver):
                 e_type, e_value, trace, TB_LIMIT
                 ))
 
-            self.send_message(Message.reply(msg.name, "fail", reason))
+            self.send_message(Message.reply(msg.name, "fail", reason,
+                                            mid=msg.mid))
 
     def handle_reply(self, msg):
         if not self.queries:
             raise NoQuerriesProcessed()
-        name, d, queue = self.queries[0]
-        if name != msg.name:
-            d.errback("Wrong request order")
-        self.queries.pop(0) # hopefully it's not large
-        d.callback((queue, msg))
+        query = self._find_query(msg)
+        if query is None:
+            raise UnhandledMessage(msg)
+        name, d, informs, mid = query
+        self.queries.remove(query) # hopefully it's not large
+        if mid is not None:
+            del self.mid_queries[mid]
+        d.callback((informs, msg))
 
     def send_message(self, msg):
         # just serialize a message
@@ -146,9 +179,11 @@ class KatCP(LineReceiver):
     def connectionLost(self, failure):
         # errback all waiting queries
         self.connection_lost = True
-        for _, d, _ in self.queries:
-            d.errback(failure)
+        queries = self.queries
         self.queries = []
+        self.mid_queries = {}
+        for _, d, _, _ in queries:
+            d.errback(failure)
 
 class ClientKatCP(KatCP):
     def inform_log(self, msg):
@@ -160,6 +195,7 @@ class ClientKatCP(KatCP):
 class ServerFactory(Factory):
     def __init__(self):
         self.sensors = {}
+        self.samplers = {} # (sensor name, period) -> PeriodicSampler
         self.setup_sensors()
 
     def add_sensor(self, sensor):
@@ -176,6 +212,7 @@ class DeviceProtocol(KatCP):
                            'none'         : NoStrategy,
                            'auto'         : AutoStrategy,
                            'event'        : EventStrategy,
+                           'event-rate'   : EventRateStrategy,
                            'differential' : DifferentialStrategy}
 
     def __init__(self, *args, **kwds):
@@ -191,6 +228,9 @@ class DeviceProtocol(KatCP):
 
 
     def connectionLost(self, _):
+        for strategy in self.strategies.values():
+            strategy.cancel()
+        self.strategies = {}
         self.factory.deregister_client(self.transport.client)
 
     def read_formatted_from_sensor(self, sensor, callback, fail,
@@ -428,7 +468,7 @@ class DeviceProtocol(KatCP):
         ----------
         name : str
             Name of the sensor whose sampling strategy to query or configure.
-        strategy : {'none', 'auto', 'event', 'differential', 'period'}, optional
+        strategy : {'none', 'auto', 'event', 'differential', 'period', 'event-rate'}, optional
             Type of strategy to use to report the sensor value. The differential
             strategy type may only be used with integer or float sensors.
         params : list of str, optional
@@ -438,6 +478,9 @@ class DeviceProtocol(KatCP):
             updated value is sent. For the period strategy, the parameter is the
             period to sample at in milliseconds. For the event strategy, an
             optional minimum time between updates in milliseconds may be given.
+            For the event-rate strategy, the parameters are the shortest and
+            longest times between updates in milliseconds (a longest time of
+            zero means no updates are sent unless the sensor changes).
 
         Returns
         -------
@@ -445,7 +488,7 @@ class DeviceProtocol(KatCP):
             Whether the sensor-sampling request succeeded.
         name : str
             Name of the sensor queried or configured.
-        strategy : {'none', 'auto', 'event', 'differential', 'period'}
+        strategy : {'none', 'auto', 'event', 'differential', 'period', 'event-rate'}
             Name of the new or current sampling strategy for the sensor.
         params : list of str
             Additional strategy parameters (see description under Parameters).
@@ -599,6 +642,41 @@ class DeviceProtocol(KatCP):
                 raise FailReply(str(e))
         return Message.reply("log-level", "ok", self.factory.log.level_name())
 
+    def request_client_log_level(self, msg):
+        """Query or set the logging level for the requesting client only.
+
+        Parameters
+        ----------
+        level : {'all', 'trace', 'debug', 'info', 'warn', 'error', 'fatal', 'off', 'default'}, optional
+            Name of the logging level to send this client log messages at. 'default' makes the client follow the device server's level again (the default is to leave the client's level unchanged).
+
+        Returns
+        -------
+        success : {'ok', 'fail'}
+            Whether the request succeeded.
+        level : {'all', 'trace', 'debug', 'info', 'warn', 'error', 'fatal', 'off'}
+            The client's log level after processing the request.
+
+        Examples
+        --------
+        ::
+
+            ?client-log-level debug
+            !client-log-level ok debug
+        """
+        log = self.factory.log
+        if msg.arguments:
+            if msg.arguments[0] == "default":
+                level = None
+            else:
+                try:
+                    level = log.level_from_name(msg.arguments[0])
+                except ValueError, e:
+                    raise FailReply(str(e))
+            log.set_client_log_level(self, level)
+        return Message.reply("client-log-level", "ok",
+                             log.level_name(log.client_log_level(self)))
+
     def _request_unknown(self, msg):
         return Message.reply(msg.name, "invalid", "Unknown request.")
 
@@ -623,7 +701,8 @@ class DeviceServer(ServerFactory):
         self.clients[addr] = protocol
 
     def deregister_client(self, addr):
-        del self.clients[addr]
+        protocol = self.clients.pop(addr)
+        self.log.set_client_log_level(protocol, None)
 
     def buildProtocol(self, addr):
         protocol = ServerFactory.buildProtocol(self, addr)
@@ -653,6 +732,7 @@ class DeviceServer(ServerFactory):
                 msg,
         )
 
-    def mass_inform(self, msg):
+    def mass_inform(self, msg, sock_filter=None):
         for client in self.clients.itervalues():
-            client.send_message(msg)
+            if sock_filter is None or sock_filter(client):
+                client.send_message(msg)
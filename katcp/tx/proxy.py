@@ -1,25 +1,21 @@
 
 from katcp.tx.core import DeviceServer, ClientKatCP, DeviceProtocol
-from twisted.internet.defer import DeferredList
+from twisted.internet.defer import DeferredList, maybeDeferred
 from twisted.internet import reactor
 from twisted.internet.protocol import ClientFactory
-from katcp import Message, AsyncReply
-from katcp.kattypes import request, return_reply, Int
+from katcp import Message, AsyncReply, Sensor, KatcpSyntaxError
+from katcp.kattypes import request, return_reply, Int, Vector
 
-import re, time
-
-def value_only_formatted(func):
-    """ A decorator that changes a value-only read into read_formatted
-    format (using time.time and 'ok')
-    """
-    def new_func(self):
-        return time.time(), "ok", func(self)
-    new_func.func_name = func.func_name
-    return new_func
+import re, time, random
+from collections import deque
 
 class ProxiedSensor(object):
     """ A sensor which is a proxy for other sensor on the remote device.
-    Returns a deferred on read
+
+    The device handler subscribes to the remote sensor with the event
+    strategy and caches the readings it reports, so reads are answered
+    locally. Until the first reading arrives, read returns a deferred
+    for a fresh ?sensor-value on the remote device.
     """
     def __init__(self, name, description, units, stype, device, proxy,
                  *formatted_params):
@@ -30,12 +26,88 @@ class ProxiedSensor(object):
         self.units = units
         self.stype = stype
         self.formatted_params = formatted_params
+        self._reading = None # (timestamp_ms, status, value) as strings
+        self._observers = set()
+
+    def set_formatted(self, timestamp_ms, status, value):
+        """ Cache a reading from the remote device and notify observers
+
+        Vector deltas are applied to the cached value, so the cache always
+        holds a full reading.
+        """
+        if self.stype == 'vector' and value.startswith('~'):
+            if self._reading is None:
+                return # resynced by the next full reading
+            params = self.formatted_params
+            # vector sensors always list a length, but be lenient with
+            # remote devices that do not
+            kattype = Vector(params and int(params[0]) or None, *params[1:])
+            value = kattype.encode(kattype.decode_delta(value,
+                                       kattype.decode(self._reading[2])))
+        self._reading = (timestamp_ms, status, value)
+        for observer in list(self._observers):
+            observer.update(self)
 
     def read_formatted(self):
-        return self.device.send_request('sensor-value', self.basename)
+        if self._reading is not None:
+            return self._reading
+        # a device that is not connected fails the deferred, not the caller
+        return maybeDeferred(self.device.send_request, 'sensor-value',
+                             self.basename)
+
+    def default_formatted(self):
+        """ The formatted default value of the sensor's type
+
+        Reported, with unknown status, when the remote device cannot be
+        read in time.
+        """
+        try:
+            stype = Sensor.parse_type(self.stype)
+            params = Sensor.parse_params(stype, self.formatted_params)
+        except (KatcpSyntaxError, ValueError):
+            return ''
+        if not params and stype in (Sensor.INTEGER, Sensor.FLOAT,
+                                    Sensor.DISCRETE):
+            # the remote device did not list the range or the values
+            typeclass, value = Sensor.SENSOR_TYPES[stype]
+            if stype == Sensor.DISCRETE:
+                return value
+            return typeclass().pack(value)
+        sensor = Sensor(stype, self.basename, self.description, self.units,
+                        params)
+        return sensor.read_formatted()[2]
+
+    # the interface used by the observer sampling strategies
+
+    def attach(self, observer):
+        self._observers.add(observer)
+
+    def detach(self, observer):
+        self._observers.discard(observer)
+
+    def value(self):
+        if self._reading is None:
+            return None
+        value = self._reading[2]
+        if self.stype in ('integer', 'float'):
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        return value
+
+    @property
+    def _status(self):
+        if self._reading is None:
+            return None
+        return self._reading[1]
 
 class StateSensor(object):
     """ A device state sensor
+
+    The timestamp is the time of the last state change. While the device is
+    not synced its status is 'unknown', since the cached readings of its
+    proxied sensors have been stale since that time.
     """
     description = 'connection state'
     stype = 'discrete'
@@ -46,9 +118,14 @@ class StateSensor(object):
         self.device = device
         self.name = name
 
-    @value_only_formatted
     def read_formatted(self):
-        return DeviceHandler.STATE_NAMES[self.device.state]
+        device = self.device
+        if device.state == device.SYNCED:
+            status = 'ok'
+        else:
+            status = 'unknown'
+        return (str(int(device.state_changed * 1000)), status,
+                DeviceHandler.STATE_NAMES[device.state])
 
 class DeviceHandler(ClientKatCP):
     SYNCING, SYNCED, UNSYNCED = range(3)
@@ -56,6 +133,10 @@ class DeviceHandler(ClientKatCP):
 
     TYPE = 'full'
 
+    use_mids = True # so many requests of one name can be in flight at once
+
+    RESPONSE_SAMPLES = 100 # recent response times kept for statistics
+
     stopping = False
 
     _conn_counter = 0
@@ -67,33 +148,109 @@ class DeviceHandler(ClientKatCP):
         ClientKatCP.__init__(self)
         self.requests = []
         self.sensors = {}
-        self.state = self.UNSYNCED
+        self.response_times = deque(maxlen=self.RESPONSE_SAMPLES)
+        self.late_replies = 0
+        self.set_state(self.UNSYNCED)
+
+    def set_state(self, state):
+        """ Change the connection state, noting when it changed
+        """
+        self.state = state
+        self.state_changed = time.time()
 
     def connectionMade(self):
         """ This is called after connection has been made. Introspect server
         about it's capabilities
         """
         def got_help((informs, reply)):
-            for inform in informs:
-                self.requests.append(inform.arguments[0])
+            self.requests = [inform.arguments[0] for inform in informs]
             self.send_request('sensor-list').addCallback(got_sensor_list)
 
         def got_sensor_list((informs, reply)):
-            self.state = self.SYNCED
+            # on a resync only apply the differences to the sensors we
+            # have, so that unchanged sensors keep their cached readings
+            # and observers and the proxy's clients see no churn
+            listed = set()
             for inform in informs:
                 name, description, units, stype = inform.arguments[:4]
-                formatted_arguments = inform.arguments[4:]
-                sensor = ProxiedSensor(name, description,
-                                       units, stype,
-                                       self, self.proxy, *formatted_arguments)
-                self.sensors[name] = sensor
-                self.proxy.add_proxied_sensor(self, sensor)
+                formatted_arguments = tuple(inform.arguments[4:])
+                listed.add(name)
+                sensor = self.sensors.get(name)
+                if sensor is None:
+                    sensor = ProxiedSensor(name, description,
+                                           units, stype,
+                                           self, self.proxy,
+                                           *formatted_arguments)
+                    self.sensors[name] = sensor
+                    self.proxy.add_proxied_sensor(self, sensor)
+                else:
+                    sensor.description = description
+                    sensor.units = units
+                    sensor.stype = stype
+                    sensor.formatted_params = formatted_arguments
+            for name in set(self.sensors) - listed:
+                self.proxy.remove_proxied_sensor(self, self.sensors.pop(name))
+            # subscribe to changes, then prime the cache with one poll
+            wait_for = [self.send_request('sensor-sampling', name, 'event')
+                        for name in sorted(self.sensors)]
+            d = self.send_request('sensor-value')
+            d.addCallback(got_sensor_values)
+            wait_for.append(d)
+            DeferredList(wait_for, consumeErrors=True).addCallback(subscribed)
+
+        def got_sensor_values((informs, reply)):
+            for inform in informs:
+                self._cache_readings(inform.arguments)
+
+        def subscribed(_):
+            self.set_state(self.SYNCED)
             self.proxy.device_ready(self)
 
-        self.state = self.SYNCING
+        self.set_state(self.SYNCING)
         self.send_request('help').addCallback(got_help)
         self._conn_counter = 0
 
+    def send_request(self, name, *args):
+        """ Send a request, recording how long the device takes to reply
+        """
+        d = ClientKatCP.send_request(self, name, *args)
+        d.addBoth(self._record_response, time.time())
+        return d
+
+    def _record_response(self, result, start):
+        self.response_times.append(time.time() - start)
+        return result
+
+    def response_stats(self):
+        """ Return (replies, late replies, mean and max response time in
+        seconds) over the recent replies from the device
+        """
+        times = self.response_times
+        if not times:
+            return len(times), self.late_replies, 0.0, 0.0
+        return (len(times), self.late_replies, sum(times) / len(times),
+                max(times))
+
+    def _cache_readings(self, arguments):
+        """ Cache readings given as timestamp, count and then count
+        (name, status, value) triples, as in #sensor-status and
+        #sensor-value informs
+        """
+        try:
+            timestamp_ms, count = arguments[0], int(arguments[1])
+        except (IndexError, ValueError):
+            return
+        for i in range(2, min(2 + 3 * count, len(arguments) - 2), 3):
+            name, status, value = arguments[i:i + 3]
+            sensor = self.sensors.get(name)
+            if sensor is not None:
+                sensor.set_formatted(timestamp_ms, status, value)
+
+    def inform_sensor_status(self, msg):
+        """ Updates from our event subscriptions to the remote sensors
+        """
+        self._cache_readings(msg.arguments)
+
     def add_proxy(self, proxy):
         self.proxy = proxy
         proxy.add_sensor(StateSensor(self.name + '-' + 'state', self))
@@ -102,11 +259,11 @@ class DeviceHandler(ClientKatCP):
         reactor.connectTCP(self.host, self.port, self.proxy.client_factory)
 
     def connectionLost(self, failure):
-        self.state = self.UNSYNCED
+        self.set_state(self.UNSYNCED)
         ClientKatCP.connectionLost(self, failure)
         if not self.stopping:
-            reactor.callLater(self.proxy.CONN_DELAY_TIMEOUT,
-                              self.schedule_resyncing)
+            delay = self.proxy.client_factory.reconnect_delay(0)
+            reactor.callLater(delay, self.schedule_resyncing)
 
     def stop(self):
         """ A hook for stopping requested device, if necessary, does nothing
@@ -146,6 +303,47 @@ class ProxyProtocol(DeviceProtocol):
                               self.factory.devices[name].TYPE))
         return "ok", len(self.factory.devices)
 
+    @request(include_msg=True)
+    @return_reply(Int(min=0))
+    def request_device_stats(self, reqmsg):
+        """Return response time statistics for the devices.
+
+        The statistics cover each device's most recent replies.
+
+        Inform Arguments
+        ----------------
+        device : str
+            Name of a device.
+        replies : int
+            Number of replies the statistics are taken over.
+        late : int
+            Number of replies that missed the proxy's fan-out deadline.
+        mean : float
+            Mean response time in milliseconds.
+        max : float
+            Longest response time in milliseconds.
+
+        Returns
+        -------
+        success : {'ok', 'fail'}
+            Whether sending the statistics succeeded.
+        informs : int
+            Number of #device-stats informs sent.
+
+        Examples
+        --------
+        ?device-stats
+        #device-stats antenna 100 0 1.2 3.4
+        !device-stats ok 1
+        """
+        for name in sorted(self.factory.devices):
+            replies, late, mean, longest = \
+                self.factory.devices[name].response_stats()
+            self.send_message(Message.inform("device-stats", name, replies,
+                              late, "%.3f" % (mean * 1000),
+                              "%.3f" % (longest * 1000)))
+        return "ok", len(self.factory.devices)
+
     def request_sensor_list(self, msg):
         """Request the list of sensors.
 
@@ -218,42 +416,77 @@ class ProxyProtocol(DeviceProtocol):
 
     def _send_all_sensors(self, filter=None):
         """ Sends all sensor values with given filter (None = all)
+
+        Proxied sensors are answered from their cached readings. Only
+        sensors without a reading yet are polled on their (synced) devices.
+        """
+        sensors, proxied = [], []
+        for name, sensor in sorted(self.factory.sensors.iteritems()):
+            if filter is not None and not re.match(filter, name):
+                continue
+            if not isinstance(sensor, ProxiedSensor):
+                sensors.append(sensor)
+            elif (sensor._reading is not None or
+                  sensor.device.state == sensor.device.SYNCED):
+                proxied.append(sensor)
+            # otherwise we have no value to send
+        self._send_sensor_values(sensors + proxied)
+
+    def _send_sensor_values(self, sensors):
+        """ Send #sensor-value informs for sensors, followed by the reply
+
+        Values are sent as they arrive. Sensors whose device fails the
+        poll, or still has to answer it when the factory's FANOUT_TIMEOUT
+        expires, are reported with unknown status and the default value
+        of their type, so one slow device cannot hold up the reply.
         """
         counter = [0] # this has to be a list or an object, thanks to
         # python lexical scoping rules (we could not write count += 1
         # in a function)
-
-        def device_ok((informs, reply), device):
-            for inform in informs:
-                inform.arguments[2] = device.name + '.' + \
-                                      inform.arguments[2]
-                if filter is None or re.match(filter, inform.arguments[2]):
-                    self.send_message(inform)
-                    counter[0] += 1
-
-        def all_ok(_):
+        answered = set()
+        polled = []
+        done = []
+
+        def send(name, timestamp_ms, status, value):
+            self.send_message(Message.inform('sensor-value', timestamp_ms,
+                                             "1", name, status, value))
+            counter[0] += 1
+
+        def one_ok(sensor, timestamp_ms, status, value):
+            if not done:
+                answered.add(sensor.name)
+                send(sensor.name, timestamp_ms, status, value)
+
+        def one_fail(failure, sensor):
+            if not done:
+                answered.add(sensor.name)
+                send(sensor.name, str(int(time.time() * 1000)), 'unknown',
+                     sensor.default_formatted())
+
+        def finish(_=None):
+            if done:
+                return
+            done.append(True)
+            if deadline.active():
+                deadline.cancel()
+            timestamp_ms = str(int(time.time() * 1000))
+            for sensor in polled:
+                if sensor.name not in answered:
+                    sensor.device.late_replies += 1
+                    send(sensor.name, timestamp_ms, 'unknown',
+                         sensor.default_formatted())
             self.send_message(Message.reply('sensor-value', 'ok',
                                             str(counter[0])))
 
+        deadline = reactor.callLater(self.factory.FANOUT_TIMEOUT, finish)
         wait_for = []
-        for device in self.factory.devices.itervalues():
-            if device.state == device.SYNCED:
-                d = device.send_request('sensor-value')
-                d.addCallback(device_ok, device)
-                wait_for.append(d)
-            # otherwise we don't have the list of sensors, so we don't
-            # send the message
-        DeferredList(wait_for).addCallback(all_ok)
-        for name, sensor in self.factory.sensors.iteritems():
-            if not isinstance(sensor, ProxiedSensor):
-                if filter is None or re.match(filter, name):
-                    timestamp_ms, status, value = sensor.read_formatted()
-                    counter[0] += 1
-                    self.send_message(Message.inform('sensor-value',
-                                                     timestamp_ms, "1",
-                                                     name, status,
-                                                     value))
-
+        for sensor in sensors:
+            outstanding = len(wait_for)
+            self.read_formatted_from_sensor(sensor, one_ok, one_fail,
+                                            wait_for)
+            if len(wait_for) > outstanding:
+                polled.append(sensor)
+        DeferredList(wait_for).addCallback(finish)
 
     def request_sensor_value(self, msg):
         """Poll a sensor value or value(s).
@@ -313,8 +546,11 @@ class ProxyProtocol(DeviceProtocol):
             # regex case
             self._send_all_sensors(name[1:-1])
             raise AsyncReply()
-        else:
-            return DeviceProtocol.request_sensor_value(self, msg)
+        sensor = self.factory.sensors.get(name, None)
+        if isinstance(sensor, ProxiedSensor):
+            self._send_sensor_values([sensor])
+            raise AsyncReply()
+        return DeviceProtocol.request_sensor_value(self, msg)
 
     def request_halt(self, msg):
         """ drops connection to specified device
@@ -341,23 +577,31 @@ class ProxyProtocol(DeviceProtocol):
         # TODO: These proxied methods should appear in the ?help for the proxy
         # but currently don't.
 
-        def request_returned((informs, reply)):
-            assert informs == [] # for now
-            # we *could* in theory just change message name, but let's copy
-            # just in case
-            self.send_message(Message.reply(dev_name + "-" + req_name,
-                                            *reply.arguments))
-
-        def request_failed(failure):
+        def request_returned((informs, reply), msg):
+            # the device replied to our own message id, so send the client
+            # copies carrying its id (and the name it used)
+            full_name = dev_name + "-" + req_name
+            for inform in informs:
+                name = inform.name
+                if name == req_name:
+                    name = full_name
+                self.send_message(Message.inform(name, *inform.arguments,
+                                                 mid=msg.mid))
+            self.send_message(Message.reply(full_name, *reply.arguments,
+                                            mid=msg.mid))
+
+        def request_failed(failure, msg):
             self.send_message(Message.reply(dev_name + '-' + req_name,
-                                            "fail", failure.getErrorMessage()))
+                                            "fail", failure.getErrorMessage(),
+                                            mid=msg.mid))
 
         def callback(msg):
             if device.state is device.UNSYNCED:
                 return Message.reply(dev_name + "-" + req_name, "fail",
                                      "Device not synced")
             d = device.send_request(req_name, *msg.arguments)
-            d.addCallbacks(request_returned, request_failed)
+            d.addCallbacks(request_returned, request_failed,
+                           callbackArgs=(msg,), errbackArgs=(msg,))
             raise AsyncReply()
 
         if not attr.startswith('request_'):
@@ -373,20 +617,33 @@ class ProxyProtocol(DeviceProtocol):
 
 class ClientDeviceFactory(ClientFactory):
     """ A factory that does uses prebuilt device handler objects
+
+    Reconnects back off exponentially from conn_delay_timeout up to
+    max_conn_delay, with random jitter so that devices which dropped out
+    together (after a network blip, say) do not all resync at once.
     """
     def __init__(self, addr_mapping, max_reconnects, conn_delay_timeout,
-                 proxy):
+                 proxy, max_conn_delay=30):
         self.addr_mapping = addr_mapping # shared dict with proxy
         self.max_reconnects = max_reconnects
         self.conn_delay_timeout = conn_delay_timeout
+        self.max_conn_delay = max_conn_delay
         self.proxy = proxy
 
+    def reconnect_delay(self, attempt):
+        """ Seconds to wait before the given reconnect attempt (counting
+        from zero), drawn uniformly up to the backed off delay
+        """
+        delay = min(self.conn_delay_timeout * 2 ** attempt,
+                    self.max_conn_delay)
+        return random.uniform(0, delay)
+
     def clientConnectionFailed(self, connector, reason):
         addr = connector.host, connector.port
         device = self.addr_mapping[addr]
         if device._conn_counter < self.max_reconnects:
             device._conn_counter += 1
-            reactor.callLater(self.conn_delay_timeout,
+            reactor.callLater(self.reconnect_delay(device._conn_counter),
                               device.schedule_resyncing)
         else:
             self.proxy.devices_scan_failed()
@@ -402,6 +659,8 @@ class ProxyKatCP(DeviceServer):
 
     MAX_RECONNECTS = 10
     CONN_DELAY_TIMEOUT = 1
+    MAX_CONN_DELAY = 30 # longest backed off delay between reconnects
+    FANOUT_TIMEOUT = 1 # seconds to wait for devices polled for values
 
     def __init__(self, *args, **kwds):
         DeviceServer.__init__(self, *args, **kwds)
@@ -409,7 +668,7 @@ class ProxyKatCP(DeviceServer):
         self.client_factory = ClientDeviceFactory(self.addr_mapping,
                                                   self.MAX_RECONNECTS,
                                                   self.CONN_DELAY_TIMEOUT,
-                                                  self)
+                                                  self, self.MAX_CONN_DELAY)
         self.ready_devices = 0
         self.devices = {}
         self.setup_devices()
@@ -437,6 +696,9 @@ class ProxyKatCP(DeviceServer):
     def add_proxied_sensor(self, device, sensor):
         self.sensors[sensor.name] = sensor
 
+    def remove_proxied_sensor(self, device, sensor):
+        self.sensors.pop(sensor.name, None)
+
     def devices_scan_complete(self):
         """ A callback called when devices are properly set up and read.
         Override if needed
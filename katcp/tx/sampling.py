@@ -1,5 +1,7 @@
 
 from twisted.internet import reactor
+from katcp import Message
+from katcp.sampling import value_changed
 
 class SamplingStrategy(object):
     """ Base class for all sampling strategies
@@ -18,19 +20,83 @@ class SamplingStrategy(object):
         """
         pass
 
-class PeriodicStrategy(SamplingStrategy):
+class PeriodicSampler(object):
+    """ Samples one sensor at one period for every protocol subscribed to
+    it, so the sensor is read and the #sensor-status formatted once per tick
+    however many clients ask for it. Samplers are kept in the factory's
+    samplers dict, keyed by sensor name and period, while they have
+    subscribers.
+    """
     next = None
 
+    def __init__(self, samplers, sensor, period):
+        self.samplers = samplers
+        self.key = (sensor.name, period)
+        self.sensor = sensor
+        self.period = period
+        self.protocols = []
+
+    @classmethod
+    def subscribe(cls, protocol, sensor, period):
+        """ Add protocol to the shared sampler for sensor and period,
+        creating the sampler if needed
+        """
+        samplers = protocol.factory.samplers
+        sampler = samplers.get((sensor.name, period))
+        if sampler is None:
+            sampler = cls(samplers, sensor, period)
+            samplers[sampler.key] = sampler
+        sampler.add(protocol)
+        return sampler
+
+    def add(self, protocol):
+        self.protocols.append(protocol)
+        if self.next is None:
+            self._run_once()
+        else:
+            # a new subscriber gets its first sample straight away
+            protocol.send_sensor_status(self.sensor)
+
+    def remove(self, protocol):
+        self.protocols.remove(protocol)
+        if self.protocols:
+            return
+        if self.next is not None and self.next.active():
+            self.next.cancel()
+        self.next = None
+        if self.samplers.get(self.key) is self:
+            del self.samplers[self.key]
+
+    def _send(self, msg):
+        line = str(msg)
+        for protocol in list(self.protocols):
+            protocol.transport.write(line + protocol.delimiter)
+
     def _run_once(self):
-        self.protocol.send_sensor_status(self.sensor)
+        def ok(sensor, timestamp_ms, status, value):
+            self._send(Message.inform('sensor-status', timestamp_ms, "1",
+                                      sensor.name, status, value))
+
+        def fail(_, sensor):
+            self._send(Message.inform('log', 'Connection lost.'))
+
+        self.protocols[0].read_formatted_from_sensor(self.sensor, ok, fail)
         self.next = reactor.callLater(self.period, self._run_once)
 
+class PeriodicStrategy(SamplingStrategy):
+    """ Subscribes to the shared sampler for the sensor and period
+    """
+    sampler = None
+
     def cancel(self):
-        self.next.cancel()
+        if self.sampler is not None:
+            self.sampler.remove(self.protocol)
+            self.sampler = None
 
     def run(self, period):
         self.period = float(period) / 1000
-        self._run_once()
+        self.sampler = PeriodicSampler.subscribe(self.protocol, self.sensor,
+                                                 self.period)
 
 class NoStrategy(SamplingStrategy):
     def run(self):
@@ -60,11 +126,78 @@ class EventStrategy(ObserverStrategy):
     def update(self, sensor):
         newval = sensor.value()
         newstatus = sensor._status
-        if self.status != newstatus or self.value != newval:
+        if self.status != newstatus or value_changed(newval, self.value):
             self.status = newstatus
             self.value = newval
             self.protocol.send_sensor_status(sensor)
 
+class EventRateStrategy(ObserverStrategy):
+    """ Send changes no more often than the shortest period, sending the
+    latest value once the period is over, and refresh after the longest
+    period (unless it is zero). A single delayed call is kept and reset
+    rather than one per update.
+    """
+    next = None
+    pending = False
+
+    def __init__(self, protocol, sensor):
+        ObserverStrategy.__init__(self, protocol, sensor)
+        self.value = sensor.value()
+        self.status = sensor._status
+
+    def run(self, shortest, longest=0):
+        self.shortest = float(shortest) / 1000
+        self.longest = float(longest) / 1000
+        if self.shortest < 0 or self.longest < 0:
+            raise ValueError("The event-rate periods must not be negative.")
+        if self.longest and self.longest < self.shortest:
+            raise ValueError("The longest period must be zero or at least"
+                             " as long as the shortest period.")
+        self.last_sent = reactor.seconds()
+        ObserverStrategy.run(self)
+        self._schedule()
+
+    def _schedule(self):
+        if self.pending:
+            when = self.last_sent + self.shortest
+        elif self.longest:
+            when = self.last_sent + self.longest
+        else:
+            if self.next is not None and self.next.active():
+                self.next.cancel()
+            return
+        delay = max(when - reactor.seconds(), 0)
+        if self.next is not None and self.next.active():
+            self.next.reset(delay)
+        else:
+            self.next = reactor.callLater(delay, self._send)
+
+    def _send(self):
+        self.value = self.sensor.value()
+        self.status = self.sensor._status
+        self.last_sent = reactor.seconds()
+        self.pending = False
+        self.protocol.send_sensor_status(self.sensor)
+        self._schedule()
+
+    def update(self, sensor):
+        if (self.status == sensor._status and
+            not value_changed(sensor.value(), self.value)):
+            if self.pending:
+                self.pending = False
+                self._schedule()
+            return
+        if reactor.seconds() >= self.last_sent + self.shortest:
+            self._send()
+        elif not self.pending:
+            self.pending = True
+            self._schedule()
+
+    def cancel(self):
+        ObserverStrategy.cancel(self)
+        if self.next is not None and self.next.active():
+            self.next.cancel()
+
 class DifferentialStrategy(ObserverStrategy):
     def __init__(self, protocol, sensor):
         ObserverStrategy.__init__(self, protocol, sensor)
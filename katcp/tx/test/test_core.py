@@ -7,6 +7,7 @@ from twisted.internet import reactor
 from twisted.internet.defer import Deferred, DeferredList
 from twisted.internet.protocol import ClientCreator
 from twisted.internet.base import DelayedCall
+from twisted.test.proto_helpers import StringTransport
 from katcp.core import FailReply
 
 DelayedCall.debug = True
@@ -42,7 +43,7 @@ class TestKatCP(TestCase):
 
     def test_help(self):
         def received_help((msgs, reply_msg), protocol):
-            assert len(msgs) == 9
+            assert len(msgs) == 10
             protocol.send_request('halt')
 
         def connected(protocol):
@@ -367,6 +368,42 @@ class TestDeviceServer(TestCase):
 
         return self._base_test(('sensor-sampling', 'int_sensor', 'event'), reply)
 
+    def test_sensor_sampling_event_rate(self):
+        def send_halt(_, protocol):
+            protocol.send_request('halt').addCallback(self._end_test)
+
+        def called_later(protocol):
+            # only the final value of the burst is sent
+            self.assertEquals(len(self.client.status_updates), 1)
+            self.assertEquals(self.client.status_updates[0].arguments[2:],
+                              ['int_sensor', 'nominal', '3'])
+            self.client.send_request('sensor-sampling', 'int_sensor',
+                                     'none').addCallback(send_halt, protocol)
+
+        def reply((informs, reply), protocol):
+            self.assertEquals(informs, [])
+            self.assertEquals(reply, Message.reply('sensor-sampling', 'ok',
+                                                   'int_sensor', 'event-rate',
+                                                   '100', '0'))
+            for value in (1, 2, 3):
+                self.factory.sensors['int_sensor'].set_value(value)
+            self.assertEquals(len(self.client.status_updates), 0)
+            reactor.callLater(0.3, called_later, protocol)
+            return True
+
+        return self._base_test(('sensor-sampling', 'int_sensor', 'event-rate',
+                                '100', '0'), reply)
+
+    def test_sensor_sampling_event_rate_periods(self):
+        def reply((informs, reply), protocol):
+            self.assertEquals(reply.arguments[0], 'fail')
+            assert ("The longest period must be zero or at least as long as"
+                    " the shortest period." in reply.arguments[1])
+            self.flushLoggedErrors()
+
+        return self._base_test(('sensor-sampling', 'int_sensor', 'event-rate',
+                                '100', '50'), reply)
+
     def test_sensor_sampling_differential(self):
         def first((informs, reply), protocol):
             self.assertEquals(len(self.client.status_updates), 1)
@@ -562,6 +599,41 @@ class TestDeviceServer(TestCase):
         return self._base_test(('log-level',), log_level1,
                               client_cls=TestProtocol)
 
+class TestPeriodicSampler(TestCase):
+    def test_shared_sampler(self):
+        factory = DeviceServer(0, '127.0.0.1')
+        factory.add_sensor(Sensor(Sensor.INTEGER, "int_sensor", "descr",
+                                  "count", [0, 10]))
+        protocols = []
+        for i in range(2):
+            protocol = DeviceProtocol()
+            protocol.factory = factory
+            protocol.makeConnection(StringTransport())
+            protocol.transport.clear()
+            protocols.append(protocol)
+
+        for protocol in protocols:
+            reply = protocol.request_sensor_sampling(Message.request(
+                'sensor-sampling', 'int_sensor', 'period', '100'))
+            self.assertEquals(reply.arguments[0], 'ok')
+        self.assertEquals(factory.samplers.keys(), [('int_sensor', 0.1)])
+        sampler = factory.samplers[('int_sensor', 0.1)]
+        self.assertEquals(sampler.protocols, protocols)
+        for protocol in protocols:
+            # both got their first sample straight away
+            self.assertEquals(
+                protocol.transport.value().count('#sensor-status'), 1)
+
+        # the sampler stays while any client is subscribed
+        protocols[0].request_sensor_sampling(Message.request(
+            'sensor-sampling', 'int_sensor', 'none'))
+        self.assertEquals(factory.samplers.keys(), [('int_sensor', 0.1)])
+        self.assertEquals(sampler.protocols, protocols[1:])
+        protocols[1].request_sensor_sampling(Message.request(
+            'sensor-sampling', 'int_sensor', 'none'))
+        self.assertEquals(factory.samplers, {})
+        self.assertEquals(sampler.next, None)
+
 class TestMisc(TestCase):
     def test_requests(self):
         from katcp.server import DeviceServer
@@ -1,10 +1,11 @@
 
 from katcp.tx.core import DeviceServer, ClientKatCP
-from katcp.tx.proxy import ProxyKatCP, DeviceHandler, DeviceProtocol
+from katcp.tx.proxy import ProxyKatCP, DeviceHandler, DeviceProtocol, \
+     ClientDeviceFactory, ProxiedSensor
 from twisted.trial.unittest import TestCase
 from twisted.internet.protocol import ClientCreator
 from twisted.internet.defer import Deferred
-from katcp import Sensor, Message
+from katcp import Sensor, Message, AsyncReply
 from katcp.kattypes import request, return_reply, Int
 from twisted.internet import reactor
 
@@ -17,9 +18,25 @@ class ExampleProtocol(DeviceProtocol):
     def request_req(self, msg):
         return "ok", 3
 
+    def request_slow(self, msg):
+        # reply after the given delay, so replies can overtake each other
+        delay = float(msg.arguments[0])
+        reactor.callLater(delay, self.send_message,
+                          Message.reply(msg.name, "ok", msg.arguments[0],
+                                        mid=msg.mid))
+        raise AsyncReply()
+
+    def request_sensor_value(self, msg):
+        self.factory.sensor_value_requests += 1
+        if self.factory.stalled:
+            raise AsyncReply() # never reply
+        return DeviceProtocol.request_sensor_value(self, msg)
+
 
 class ExampleDevice(DeviceServer):
     protocol = ExampleProtocol
+    sensor_value_requests = 0
+    stalled = False
 
     def setup_sensors(self):
         sensor = Sensor(int, "sensor1", "Test sensor 1", "count",
@@ -34,6 +51,8 @@ class ExampleDevice(DeviceServer):
 class ExampleProxy(ProxyKatCP):
     on_device_ready = None
     CONN_DELAY_TIMEOUT = 0.05
+    MAX_CONN_DELAY = 0.1
+    FANOUT_TIMEOUT = 0.2
 
     def __init__(self, port, finish):
         self.connect_to = port
@@ -57,8 +76,11 @@ class ExampleProxy(ProxyKatCP):
             self.on_device_ready = None
         ProxyKatCP.device_ready(self, device)
 
+class MidClient(ClientKatCP):
+    use_mids = True
+
 class TestProxyBase(TestCase):
-    def _base_test(self, request, callback):
+    def _base_test(self, request, callback, client_cls=ClientKatCP):
         def devices_scan_complete(_):
             if request is None:
                 # we don't want to send any requests, simply call callback and
@@ -69,7 +91,7 @@ class TestProxyBase(TestCase):
                 self.proxy.stop()
                 finish.callback(None)
                 return
-            cc = ClientCreator(reactor, ClientKatCP)
+            cc = ClientCreator(reactor, client_cls)
             host = self.proxy.port.getHost()
             cc.connectTCP('localhost', host.port).addCallback(connected)
 
@@ -112,6 +134,33 @@ class TestProxyBase(TestCase):
 
         return self._base_test(('device-req',), callback)
 
+    def test_forwarding_out_of_order(self):
+        replies = []
+
+        def got_reply((informs, reply)):
+            replies.append(reply)
+            if len(replies) < 2:
+                return
+            # the fast reply overtook the slow one and each got to the
+            # request it belongs to
+            self.assertEquals([r.arguments for r in replies],
+                              [['ok', '0'], ['ok', '0.2']])
+            # and carries the id of the request sent just after the slow one
+            self.assertEquals(int(replies[0].mid), int(replies[1].mid) + 1)
+            self.port.stopListening()
+            self.proxy.stop()
+            self.client.transport.loseConnection()
+            self.finish.callback(None)
+
+        def callback(_):
+            self.client.send_request('device-slow', '0.2').addCallback(
+                got_reply)
+            self.client.send_request('device-slow', '0').addCallback(
+                got_reply)
+            return True
+
+        return self._base_test(('watchdog',), callback, client_cls=MidClient)
+
     def test_forwarding_unsynced(self):
         def callback((informs, reply)):
             self.assertEquals(reply, Message.reply('device2-req', 'fail',
@@ -163,6 +212,68 @@ class TestProxyBase(TestCase):
 
         return self._base_test(('sensor-value', 'device-state',), callback)
 
+    def test_state_sensor_unsynced(self):
+        def callback((informs, reply)):
+            assert len(informs) == 1
+            assert informs[0].arguments[3:] == ['unknown', 'unsynced']
+
+        return self._base_test(('sensor-value', 'device2-state',), callback)
+
+    def test_cached_sensor_value(self):
+        def callback((informs, reply)):
+            self.assertEquals(reply, Message.reply('sensor-value', 'ok', '4'))
+            # only the poll priming the cache reached the device
+            self.assertEquals(self.example_device.sensor_value_requests, 1)
+
+        return self._base_test(('sensor-value',), callback)
+
+    def test_cached_sensor_updates(self):
+        def check():
+            sensor = self.proxy.sensors['device.sensor1']
+            if sensor.read_formatted()[1:] != ('nominal', '7'):
+                reactor.callLater(0.01, check)
+                return
+            self.assertEquals(self.example_device.sensor_value_requests, 1)
+            self.port.stopListening()
+            self.proxy.stop()
+            self.finish.callback(None)
+
+        def callback(_):
+            self.example_device.sensors['sensor1'].set_value(7)
+            check()
+            return True
+
+        return self._base_test(None, callback)
+
+    def test_stalled_device(self):
+        def polled((informs, reply)):
+            self.assertEquals(reply, Message.reply('sensor-value', 'ok', '4'))
+            sensor1 = [msg for msg in informs
+                       if msg.arguments[2] == 'device.sensor1']
+            self.assertEquals(sensor1[0].arguments[3:], ['unknown', '0'])
+            device = self.proxy.devices['device']
+            self.assertEquals(device.late_replies, 1)
+            self.client.send_request('device-stats').addCallback(stats)
+
+        def stats((informs, reply)):
+            self.assertEquals(reply, Message.reply('device-stats', 'ok', '2'))
+            self.assertEquals(informs[0].arguments[:3],
+                              ['device', str(len(self.proxy.devices[
+                                  'device'].response_times)), '1'])
+            self.port.stopListening()
+            self.proxy.stop()
+            self.client.transport.loseConnection()
+            self.finish.callback(None)
+
+        def callback(_):
+            # forget the cached value so that the device is polled
+            self.proxy.sensors['device.sensor1']._reading = None
+            self.example_device.stalled = True
+            self.client.send_request('sensor-value').addCallback(polled)
+            return True
+
+        return self._base_test(('watchdog',), callback)
+
     def test_sensor_list(self):
         def callback((informs, reply)):
             assert len(informs) == 4
@@ -208,6 +319,37 @@ class TestProxyBase(TestCase):
 
         return self._base_test(('watchdog',), callback)
 
+    def test_incremental_resync(self):
+        before = {}
+
+        def ready(device):
+            assert device.state == device.SYNCED
+            sensors = self.proxy.sensors
+            # unchanged sensors are kept, not re-registered
+            self.assertTrue(sensors['device.sensor1'] is before['sensor1'])
+            self.assertEquals(before['sensor1'].description, 'Changed')
+            self.assertFalse('device.sensor2' in sensors)
+            self.assertFalse('sensor2' in device.sensors)
+            self.assertEquals(sensors['device.sensor3'].description,
+                              'Test sensor 3')
+            self.port.stopListening()
+            self.proxy.stop()
+            self.client.transport.loseConnection()
+            self.finish.callback(None)
+
+        def callback(_):
+            before['sensor1'] = self.proxy.sensors['device.sensor1']
+            sensors = self.example_device.sensors
+            del sensors['sensor2']
+            sensors['sensor1'].description = 'Changed'
+            self.example_device.add_sensor(Sensor(int, "sensor3",
+                "Test sensor 3", "count", [0, 10]))
+            self.proxy.on_device_ready = Deferred().addCallback(ready)
+            self.example_device.clients.values()[0].transport.loseConnection()
+            return True
+
+        return self._base_test(('watchdog',), callback)
+
     def test_halt(self):
         def callback((informs, reply)):
             self.assertEquals(reply, Message.reply('halt', 'device', 'ok'))
@@ -216,11 +358,39 @@ class TestProxyBase(TestCase):
         return self._base_test(('halt', 'device'), callback)
 
 
+class TestReconnectDelay(TestCase):
+    def test_backoff(self):
+        factory = ClientDeviceFactory({}, 10, 0.1, None, max_conn_delay=1.0)
+        for attempt in range(10):
+            delay = factory.reconnect_delay(attempt)
+            self.assertTrue(0 <= delay <= min(0.1 * 2 ** attempt, 1.0))
+
+class TestProxiedVector(TestCase):
+    def test_vector_delta(self):
+        class Device(object):
+            name = 'device'
+        sensor = ProxiedSensor('spectrum', 'descr', '', 'vector', Device(),
+                               None, '4')
+        sensor.set_formatted('1000', 'nominal', '~1=5')
+        self.assertEquals(sensor._reading, None)
+        sensor.set_formatted('1000', 'nominal', '1,2,3,4')
+        sensor.set_formatted('2000', 'warn', '~1=5,3=0.5')
+        self.assertEquals(sensor.read_formatted(),
+                          ('2000', 'warn', '1,5,3,0.5'))
+
+        # a remote vector sensor without a length parameter
+        sensor = ProxiedSensor('spectrum', 'descr', '', 'vector', Device(),
+                               None)
+        sensor.set_formatted('1000', 'nominal', '1,2')
+        sensor.set_formatted('2000', 'nominal', '~0=7')
+        self.assertEquals(sensor.read_formatted(), ('2000', 'nominal', '7,2'))
+
 class RogueSensor(object):
     description = 'descr'
     units = 'some'
     stype = 'integer'
     formatted_params = ()
+    _status = None
 
     def __init__(self, name, device):
         self.device = device
@@ -228,9 +398,20 @@ class RogueSensor(object):
 
     def read_formatted(self):
         for client in self.device.clients.values():
-            client.transport._closeSocket() # force a connection drop
+            client.transport.abortConnection() # force a connection drop
         return 1, 2, 3
 
+    # the proxy subscribes to every sensor, but this one never changes
+
+    def value(self):
+        return None
+
+    def attach(self, observer):
+        pass
+
+    def detach(self, observer):
+        pass
+
 class RogueDevice(DeviceServer):
     def setup_sensors(self):
         self.add_sensor(RogueSensor('rogue', self))
@@ -256,8 +437,10 @@ class TestReconnect(TestCase):
         def worked((informs, reply)):
             self.flushLoggedErrors() # clean up error about conn lost
             self.proxy.on_device_ready = Deferred().addCallback(back)
-            self.assertEquals(informs, [Message.inform("sensor-value", "device.rogue",
-                                                   "Sensor reading failed.")])
+            self.assertEquals(len(informs), 1)
+            self.assertEquals(informs[0].arguments[1:],
+                              ["1", "device.rogue", "unknown", "0"])
+            self.assertEquals(reply, Message.reply("sensor-value", "ok", "1"))
 
         def back(_):
             self.port.stopListening()
@@ -131,12 +131,26 @@ def runThreads(fpgalist, threadqueue):
     threadqueue.join()
 
 
+def connectFpgas(roachlist, timeout=10):
+    """ Connect to all roach boards in parallel.
+
+    Boards that have not connected after timeout seconds are reported,
+    their clients are stopped and they are left out of the returned list,
+    so one dead board does not hold up the rest.
+    """
+    print("Connecting to ROACH boards...")
+    fpgalist = [katcp_wrapper.FpgaClient(roach, config.katcp_port, timeout=timeout) for roach in roachlist]
+    connected, failed = katcp_wrapper.start_clients(fpgalist, timeout=timeout,
+                                                    stop_failed=True)
+    for fpga in failed:
+        print "Warning: could not connect to %s, skipping it" % fpga.host
+    return connected
+
+
 def reprogram(flavor):
     """ Reprogram FPGAs"""
     threadqueue = Queue.Queue()
-    print("Connecting to ROACH boards...")
-    roachlist = config.roachlist
-    fpgalist = [katcp_wrapper.FpgaClient(roach, config.katcp_port, timeout=10) for roach in roachlist]
+    fpgalist = connectFpgas(config.roachlist)
     for i in range(len(fpgalist)):
         t = FpgaProgrammer(threadqueue, flavor)
         t.setDaemon(True)
@@ -148,9 +162,7 @@ def reprogram(flavor):
 def reconfigure(flavor):
     """ Reconfigure FPGAs"""
     threadqueue = Queue.Queue()
-    print("Connecting to ROACH boards...")
-    roachlist = config.roachlist
-    fpgalist = [katcp_wrapper.FpgaClient(roach, config.katcp_port, timeout=10) for roach in roachlist]
+    fpgalist = connectFpgas(config.roachlist)
     for i in range(len(fpgalist)):
         t = FpgaConfigurer(threadqueue, flavor)
         t.setDaemon(True)
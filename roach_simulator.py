@@ -0,0 +1,645 @@
+# encoding: utf-8
+"""
+roach_simulator.py
+==================
+
+Simulated ROACH boards for exercising the HIPSR control code without hardware.
+
+RoachSimulator is a katcp DeviceServer speaking the subset of the
+tcpborphserver protocol used by katcp_wrapper.FpgaClient and katcp_helpers:
+listdev, listbof, progdev, read, bulkread, write and uploadbof. Programming
+one of the bof files in config.fpga_config loads the register and snap block
+map for that firmware flavor. The snap blocks capture synthetic spectra, and
+o_acc_cnt advances once per accumulation as set by the acc_len register.
+
+Running this module starts one simulator per board in config.roachlist, each
+on its own loopback address:
+
+    python -m hipsr_core.roach_simulator --flavor hipsr_400_8192 --latency 0.001
+"""
+
+import time, random, socket, struct, threading, logging, optparse
+import numpy as np
+
+from katcp import DeviceServer, Message, FailReply
+from katcp.kattypes import request, return_reply, Str, Int
+
+import hipsr_core.config as config
+
+log = logging.getLogger("roach_simulator")
+
+# Registers present in every ROACH design
+SYS_REGISTERS = ["sys_board_id", "sys_rev", "sys_rev_rcs", "sys_scratchpad",
+                 "sys_clkcounter"]
+
+# Registers written by the FPGA, which clients may only read
+READONLY_PREFIXES = ("o_", "sys_board_id", "sys_rev", "sys_clkcounter")
+
+# Noise diode snap blocks shared by all flavors: name -> product
+NAR_SNAPS = {
+    "nar_snap_x_on"  : "xx_cal_on",
+    "nar_snap_x_off" : "xx_cal_off",
+    "nar_snap_y_on"  : "yy_cal_on",
+    "nar_snap_y_off" : "yy_cal_off",
+}
+
+# Words in each noise diode snap block
+NAR_WORDS = 16
+
+# Bytes in the ADC sample snap block read by getSpectrum_rms_levels
+MUX_BYTES = 4096
+
+############
+# Firmware flavors
+#
+# n_chans:    channels in the full spectrum
+# vector_len: FPGA clock cycles per accumulated spectrum
+# fpga_clock: nominal FPGA clock in Hz; one dump takes
+#             acc_len * vector_len / fpga_clock seconds
+# registers:  software registers besides the config.fpga_config keys
+# snaps:      snap name -> (product, first channel, channel step, roll),
+#             so the BRAM holds np.roll(product[first::step], roll)
+# cross:      whether the design computes the XY cross products
+############
+
+FLAVORS = {
+    "hipsr_400_8192" : {
+        "n_chans"    : 8192,
+        "vector_len" : 4096,
+        "fpga_clock" : 200e6,
+        "registers"  : ["master_reset", "sync_pps_arm", "o_acc_cnt",
+                        "o_adc0_clip", "o_fft_of"],
+        "snaps"      : {
+            "snap_xx0"    : ("xx", 0, 2, 0),
+            "snap_xx1"    : ("xx", 1, 2, 0),
+            "snap_yy0"    : ("yy", 0, 2, 0),
+            "snap_yy1"    : ("yy", 1, 2, 0),
+            "snap_re_xy0" : ("re_xy", 0, 2, 0),
+            "snap_re_xy1" : ("re_xy", 1, 2, 0),
+            "snap_im_xy0" : ("im_xy", 0, 2, 0),
+            "snap_im_xy1" : ("im_xy", 1, 2, 0),
+        },
+        "cross"      : True,
+    },
+    "hipsr_200_16384" : {
+        "n_chans"    : 16384,
+        "vector_len" : 16384,
+        "fpga_clock" : 200e6,
+        "registers"  : ["master_reset", "sync_pps_arm", "o_acc_cnt",
+                        "o_adc0_clip"],
+        "snaps"      : {
+            "snap_xx" : ("xx", 0, 1, 8192),
+            "snap_yy" : ("yy", 0, 1, 8192),
+        },
+        "cross"      : False,
+    },
+    "hipsr_12_4096" : {
+        "n_chans"    : 4096,
+        "vector_len" : 4096,
+        "fpga_clock" : 12.5e6,
+        "registers"  : ["rst", "sync_pps_arm", "o_acc_cnt", "o_adc0_clip"],
+        "snaps"      : {
+            "snap_xx" : ("xx", 0, 1, 2048),
+            "snap_yy" : ("yy", 0, 1, 2048),
+        },
+        "cross"      : False,
+    },
+}
+
+# Mean power per channel per accumulated spectrum (keeps 32 bit words
+# from overflowing at the longest configured acc_len)
+SPECTRUM_LEVEL = 1e4
+
+# ADC sample standard deviations seen by snap_mux for mux_sel 0 and 2
+ADC_RMS = {0: 20.0, 2: 18.0}
+
+
+def flavor_of(bof):
+    """ Return the firmware flavor of a bof file name, or None if unknown """
+    for flavor, cfg in config.fpga_config.items():
+        if cfg["firmware"] == bof:
+            return flavor
+    for flavor in FLAVORS:
+        # uploaded builds follow the <design>_<bw>_<chans>_<date>.bof pattern
+        if flavor.split("_", 1)[1] in bof:
+            return flavor
+    return None
+
+
+def bandpass(n_chans):
+    """ Smooth synthetic bandpass with rolled-off band edges """
+    x = (np.arange(n_chans) + 0.5) / n_chans - 0.5
+    return np.exp(-(x / 0.4) ** 8)
+
+
+class RoachSimulator(DeviceServer):
+    """ Simulated ROACH board serving synthetic HIPSR spectra over katcp.
+
+    Parameters
+    ----------
+    host, port: str, int
+      address to listen on
+    flavor: str
+      firmware flavor (key of config.fpga_config) to start programmed with,
+      with its registers set as by katcp_helpers.reconfigure; None starts
+      the board unprogrammed
+    latency: float
+      seconds to wait before handling each request; the wait happens on
+      the request handler threads, so the server keeps reading requests
+      meanwhile (requests marked inline_request, such as ?watchdog, are
+      answered without it)
+    jitter: float
+      maximum extra seconds, drawn uniformly, added to the latency
+    time_scale: float
+      factor applied to the accumulation period, e.g. 0.01 to dump 100
+      times faster than real hardware
+    seed: int
+      seed for the spectrum noise and the latency jitter
+    handler_threads: int
+      request handler threads, as for DeviceServer (default HANDLER_THREADS)
+    """
+
+    VERSION_INFO = ("roach-simulator", 0, 1)
+    BUILD_INFO = ("roach-simulator", 0, 1, "")
+
+    ## @brief Bytes of data per #bulkread inform.
+    BULKREAD_CHUNK = 16384
+
+    ## @brief Default number of request handler threads.
+    HANDLER_THREADS = 4
+
+    def __init__(self, host, port, flavor=None, latency=0.0, jitter=0.0,
+                 time_scale=1.0, seed=0, handler_threads=HANDLER_THREADS,
+                 **kwargs):
+        self._latency = latency
+        self._jitter = jitter
+        self._time_scale = time_scale
+        self._seed = seed
+        self._jitter_rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._bofs = [cfg["firmware"] for cfg in config.fpga_config.values()]
+        self._bofs.sort()
+        self._flavor = None
+        self._devices = {}      # device name -> bytearray contents
+        self._snaps = {}        # ctrl register name -> snap name
+        self._spectra = None    # (acc count, products) of the last capture
+        self._acc_base = (time.time(), 0)   # (start time, count at start)
+        self._clk_base = time.time()
+        super(RoachSimulator, self).__init__(host, port,
+                                             handler_threads=handler_threads,
+                                             **kwargs)
+        if flavor is not None:
+            self.program(config.fpga_config[flavor]["firmware"])
+            for key, value in config.fpga_config[flavor].items():
+                if key != "firmware" and key in self._devices:
+                    self._write(key, 0, struct.pack(">i" if value < 0 else ">I",
+                                                    value))
+
+    def setup_sensors(self):
+        """ The simulator has no sensors """
+        pass
+
+    def _dispatch_request(self, sock, msg):
+        """ Delay each pooled request by the configured latency and jitter """
+        handler = self._request_handlers.get(msg.name)
+        # unknown and inline requests are answered on the server thread
+        if handler is not None and not getattr(handler, "_inline_request",
+                                               False):
+            delay = self._latency + self._jitter * self._jitter_rng.random()
+            if delay > 0:
+                time.sleep(delay)
+        super(RoachSimulator, self)._dispatch_request(sock, msg)
+
+    ############
+    # Device model
+    ############
+
+    def program(self, bof):
+        """ Load the register map for a bof file (None deprograms the board) """
+        self._lock.acquire()
+        try:
+            self._devices = {}
+            self._snaps = {}
+            self._spectra = None
+            self._flavor = None
+            if bof is None:
+                return
+            for name in SYS_REGISTERS:
+                self._devices[name] = bytearray(4)
+            self._devices["sys_board_id"][:] = struct.pack(">I", 0xb00b)
+            flavor = flavor_of(bof)
+            if flavor is None:
+                return
+            self._flavor = flavor
+            layout = FLAVORS[flavor]
+            names = [k for k in config.fpga_config[flavor] if k != "firmware"]
+            for name in names + layout["registers"]:
+                self._devices[name] = bytearray(4)
+            snaps = [(name, 4 * len(range(first, layout["n_chans"], step)))
+                     for name, (_p, first, step, _r) in layout["snaps"].items()]
+            snaps += [(name, 4 * NAR_WORDS) for name in NAR_SNAPS]
+            snaps.append(("snap_mux", MUX_BYTES))
+            for name, size in snaps:
+                for suffix in ("_ctrl", "_status", "_addr"):
+                    self._devices[name + suffix] = bytearray(4)
+                self._devices[name + "_bram"] = bytearray(size)
+                self._snaps[name + "_ctrl"] = name
+            self._acc_base = (time.time(), 0)
+        finally:
+            self._lock.release()
+
+    def _register(self, name):
+        """ Return the unsigned value of a 32 bit register """
+        return struct.unpack(">I", str(self._devices[name][:4]))[0]
+
+    def _acc_period(self):
+        """ Seconds per accumulation, or None if acc_len is unset """
+        layout = FLAVORS[self._flavor]
+        acc_len = self._register("acc_len") if "acc_len" in self._devices else 0
+        if acc_len == 0:
+            return None
+        return (acc_len * layout["vector_len"] / layout["fpga_clock"]
+                * self._time_scale)
+
+    def _acc_count(self, now=None):
+        """ Accumulations completed since the last reset """
+        if self._flavor is None:
+            return 0
+        if now is None:
+            now = time.time()
+        start, count = self._acc_base
+        period = self._acc_period()
+        if period is None:
+            return count
+        return count + int((now - start) / period)
+
+    def _products(self, acc_cnt):
+        """ Synthetic spectra (as floats) for one accumulation """
+        if self._spectra is not None and self._spectra[0] == acc_cnt:
+            return self._spectra[1]
+        layout = FLAVORS[self._flavor]
+        n_chans = layout["n_chans"]
+        acc_len = max(self._register("acc_len"), 1)
+        rng = np.random.RandomState((self._seed * 1000003 + acc_cnt) % 2**32)
+        shape = bandpass(n_chans)
+        # a few narrow RFI spikes at fixed channels
+        shape[n_chans / 5::n_chans / 3] *= 20
+        level = SPECTRUM_LEVEL * acc_len
+        sigma = 1.0 / np.sqrt(acc_len)
+        products = {}
+        for pol, gain in (("xx", 1.0), ("yy", 0.9)):
+            products[pol] = level * gain * shape * \
+                (1 + sigma * rng.standard_normal(n_chans))
+            cal = level * gain * np.ones(NAR_WORDS)
+            products[pol + "_cal_off"] = cal * \
+                (1 + sigma * rng.standard_normal(NAR_WORDS))
+            products[pol + "_cal_on"] = 1.1 * cal * \
+                (1 + sigma * rng.standard_normal(NAR_WORDS))
+        if layout["cross"]:
+            for part in ("re_xy", "im_xy"):
+                products[part] = 0.1 * level * shape * \
+                    rng.standard_normal(n_chans)
+        self._spectra = (acc_cnt, products)
+        return products
+
+    def _capture(self, snap):
+        """ Fill a snap block's BRAM as the firmware does when triggered """
+        bram = self._devices[snap + "_bram"]
+        if snap == "snap_mux":
+            mux_sel = self._register("mux_sel") if "mux_sel" in self._devices \
+                else 0
+            rms = ADC_RMS.get(mux_sel, 0.0)
+            rng = np.random.RandomState(self._jitter_rng.getrandbits(32))
+            data = np.clip(np.round(rms * rng.standard_normal(len(bram))),
+                           -128, 127).astype('int8')
+        else:
+            products = self._products(self._acc_count())
+            if snap in NAR_SNAPS:
+                data = products[NAR_SNAPS[snap]]
+                dtype = '>u4'
+            else:
+                product, first, step, roll = FLAVORS[self._flavor]["snaps"][snap]
+                data = np.roll(products[product][first::step], roll)
+                dtype = '>u4' if product in ("xx", "yy") else '>i4'
+            if dtype == '>u4':
+                data = np.clip(data, 0, 2**32 - 1)
+            data = np.round(data).astype(dtype)
+        bram[:] = data.tostring()
+        self._devices[snap + "_addr"][:] = struct.pack(">I",
+            0x80000000 | (len(bram) / data.dtype.itemsize - 1))
+
+    def _read(self, name, offset, size):
+        """ Read bytes from a device, updating the FPGA driven registers """
+        if name not in self._devices:
+            raise FailReply("Unknown device %s." % name)
+        mem = self._devices[name]
+        if offset < 0 or size < 0 or offset + size > len(mem):
+            raise FailReply("Read of %d bytes at offset %d is outside %s "
+                            "(%d bytes)." % (size, offset, name, len(mem)))
+        if name == "o_acc_cnt":
+            mem[:] = struct.pack(">I", self._acc_count() & 0xffffffff)
+        elif name == "sys_clkcounter":
+            clock = FLAVORS[self._flavor]["fpga_clock"] if self._flavor \
+                else 200e6
+            ticks = int((time.time() - self._clk_base) * clock)
+            mem[:] = struct.pack(">I", ticks & 0xffffffff)
+        return str(mem[offset:offset + size])
+
+    def _write(self, name, offset, data):
+        """ Write bytes to a device, applying any side effects """
+        if name not in self._devices:
+            raise FailReply("Unknown device %s." % name)
+        if name.startswith(READONLY_PREFIXES):
+            raise FailReply("Device %s is read only." % name)
+        mem = self._devices[name]
+        if offset < 0 or offset + len(data) > len(mem):
+            raise FailReply("Write of %d bytes at offset %d is outside %s "
+                            "(%d bytes)." % (len(data), offset, name, len(mem)))
+        old = self._register(name) if len(mem) == 4 else None
+        if name == "acc_len":
+            # keep the count continuous across acc_len changes
+            now = time.time()
+            self._acc_base = (now, self._acc_count(now))
+        mem[offset:offset + len(data)] = data
+        if old is None:
+            return
+        new = self._register(name)
+        rising = (new & 1) and not (old & 1)
+        if name in ("master_reset", "rst") and rising:
+            self._acc_base = (time.time(), 0)
+        elif name in self._snaps and rising:
+            self._capture(self._snaps[name])
+
+    ############
+    # Requests
+    ############
+
+    def request_listdev(self, sock, msg):
+        """List the devices (registers, BRAMs) in the programmed design.
+
+        Informs
+        -------
+        device : str
+            The name of a device.
+
+        Returns
+        -------
+        success : {'ok'}
+        """
+        self._lock.acquire()
+        try:
+            names = sorted(self._devices.keys())
+        finally:
+            self._lock.release()
+        for name in names:
+            self.reply_inform(sock, Message.inform("listdev", name), msg)
+        return Message.reply("listdev", "ok")
+
+    @return_reply(Str())
+    def request_progdev(self, sock, msg):
+        """Program the FPGA with a bof file.
+
+        Parameters
+        ----------
+        bof : str, optional
+            The bof file to program. Deprograms the FPGA if omitted or empty.
+
+        Returns
+        -------
+        success : {'ok', 'fail'}
+        """
+        bof = msg.arguments[0] if msg.arguments and msg.arguments[0] else None
+        if bof is not None and bof not in self._bofs:
+            return ("fail", "Unknown bof file %s." % bof)
+        self.program(bof)
+        return ("ok", "")
+
+    @return_reply()
+    def request_listbof(self, sock, msg):
+        """List the bof files that can be programmed.
+
+        Informs
+        -------
+        bof : str
+            The name of a bof file.
+
+        Returns
+        -------
+        success : {'ok'}
+        """
+        self._lock.acquire()
+        try:
+            bofs = list(self._bofs)
+        finally:
+            self._lock.release()
+        for bof in bofs:
+            self.reply_inform(sock, Message.inform("listbof", bof), msg)
+        return ("ok",)
+
+    @request(Str(), Int(min=0), Int(min=0))
+    @return_reply(Str())
+    def request_read(self, sock, device, offset, size):
+        """Read bytes from a device.
+
+        Parameters
+        ----------
+        device : str
+            The register or BRAM to read.
+        offset : int
+            Byte offset to read from.
+        size : int
+            Number of bytes to read.
+
+        Returns
+        -------
+        success : {'ok', 'fail'}
+        data : str
+            The bytes read.
+        """
+        self._lock.acquire()
+        try:
+            return ("ok", self._read(device, offset, size))
+        finally:
+            self._lock.release()
+
+    def request_bulkread(self, sock, msg):
+        """Read bytes from a device as a series of #bulkread informs.
+
+        Parameters
+        ----------
+        device : str
+            The register or BRAM to read.
+        offset : int
+            Byte offset to read from.
+        size : int
+            Number of bytes to read.
+
+        Informs
+        -------
+        data : str
+            The next chunk of bytes read.
+
+        Returns
+        -------
+        success : {'ok', 'fail'}
+        """
+        if len(msg.arguments) != 3:
+            raise FailReply("Expected device, offset and size.")
+        device = msg.arguments[0]
+        try:
+            offset, size = int(msg.arguments[1]), int(msg.arguments[2])
+        except ValueError:
+            raise FailReply("Offset and size must be integers.")
+        self._lock.acquire()
+        try:
+            data = self._read(device, offset, size)
+        finally:
+            self._lock.release()
+        for start in range(0, len(data), self.BULKREAD_CHUNK):
+            self.reply_inform(sock, Message.inform("bulkread",
+                data[start:start + self.BULKREAD_CHUNK]), msg)
+        return Message.reply("bulkread", "ok")
+
+    @request(Str(), Int(min=0), Str())
+    @return_reply()
+    def request_write(self, sock, device, offset, data):
+        """Write bytes to a device.
+
+        Parameters
+        ----------
+        device : str
+            The register or BRAM to write.
+        offset : int
+            Byte offset to write at.
+        data : str
+            The bytes to write.
+
+        Returns
+        -------
+        success : {'ok', 'fail'}
+        """
+        self._lock.acquire()
+        try:
+            self._write(device, offset, data)
+        finally:
+            self._lock.release()
+        return ("ok",)
+
+    @request(Int(min=0, max=65535), Str(), Int(min=0))
+    @return_reply()
+    def request_uploadbof(self, sock, port, filename, size):
+        """Receive a bof file on a separate TCP port.
+
+        The file becomes available to ?listbof and ?progdev once all of
+        its bytes have arrived.
+
+        Parameters
+        ----------
+        port : int
+            Port to listen on for the upload.
+        filename : str
+            Name to store the bof file under.
+        size : int
+            Length of the bof file in bytes.
+
+        Returns
+        -------
+        success : {'ok', 'fail'}
+        """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind((self._bindaddr[0], port))
+        except socket.error, e:
+            listener.close()
+            raise FailReply("Could not listen on port %d: %s" % (port, e))
+        listener.listen(1)
+        t = threading.Thread(target=self._receive_bof,
+                             args=(listener, filename, size))
+        t.setDaemon(True)
+        t.start()
+        return ("ok",)
+
+    def _receive_bof(self, listener, filename, size):
+        """ Accept a single upload connection and store the received bof """
+        listener.settimeout(60.0)
+        received = 0
+        try:
+            try:
+                conn, _addr = listener.accept()
+                conn.settimeout(60.0)
+                while received < size:
+                    chunk = conn.recv(min(65536, size - received))
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                conn.close()
+            except socket.error, e:
+                log.warn("Upload of %s failed: %s" % (filename, e))
+        finally:
+            listener.close()
+        if received < size:
+            log.warn("Upload of %s stopped after %d of %d bytes"
+                     % (filename, received, size))
+            return
+        self._lock.acquire()
+        try:
+            if filename not in self._bofs:
+                self._bofs.append(filename)
+        finally:
+            self._lock.release()
+
+
+def start_simulators(names, flavor=None, address="127.0.0.1",
+                     port=config.katcp_port, **kwargs):
+    """ Start one simulator per board name, on consecutive loopback addresses.
+
+    Returns a list of (name, simulator) tuples. Linux routes all of 127/8 to
+    the loopback interface, so every board can use the same port, just as the
+    real boards do.
+    """
+    first = struct.unpack(">I", socket.inet_aton(address))[0]
+    sims = []
+    for i, name in enumerate(names):
+        host = socket.inet_ntoa(struct.pack(">I", first + i))
+        sim = RoachSimulator(host, port, flavor=flavor, seed=i, **kwargs)
+        sim.start(timeout=1.0, daemon=True)
+        sims.append((name, sim))
+    return sims
+
+
+def main(argv=None):
+    """ Run a simulator for every board in config.roachlist """
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-f", "--flavor", default="hipsr_400_8192",
+                      help="firmware to start programmed with (default %default)")
+    parser.add_option("-a", "--address", default="127.0.0.1",
+                      help="address of the first board (default %default)")
+    parser.add_option("-p", "--port", type="int", default=config.katcp_port,
+                      help="katcp port (default %default)")
+    parser.add_option("-l", "--latency", type="float", default=0.0,
+                      help="request latency in seconds (default %default)")
+    parser.add_option("-j", "--jitter", type="float", default=0.0,
+                      help="maximum extra latency in seconds (default %default)")
+    parser.add_option("-t", "--time-scale", type="float", default=1.0,
+                      help="accumulation period scale (default %default)")
+    opts, args = parser.parse_args(argv)
+
+    sims = start_simulators(sorted(config.roachlist.keys()),
+                            flavor=opts.flavor, address=opts.address,
+                            port=opts.port, latency=opts.latency,
+                            jitter=opts.jitter, time_scale=opts.time_scale)
+    for name, sim in sims:
+        print "%s\t%s:%d" % ((name,) + sim._bindaddr)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for name, sim in sims:
+        sim.stop()
+        sim.join(timeout=1.0)
+
+
+if __name__ == '__main__':
+    main()
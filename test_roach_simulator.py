@@ -0,0 +1,102 @@
+# encoding: utf-8
+"""
+test_roach_simulator.py
+=======================
+
+Tests for roach_simulator.py, driving simulated boards with the same
+katcp_wrapper.FpgaClient the HIPSR control code uses. Like the rest of
+hipsr_core, the modules are imported from the package, so run the tests
+from the directory holding hipsr_core:
+
+    python -m unittest hipsr_core.test_roach_simulator
+"""
+
+import time, struct, threading, unittest
+import numpy as np
+
+import hipsr_core.katcp_wrapper as katcp_wrapper
+import hipsr_core.roach_simulator as roach_simulator
+
+FLAVOR = "hipsr_400_8192"
+
+
+class TestRoachSimulator(unittest.TestCase):
+
+    def setUp(self):
+        # port 0 lets the OS pick a free port for the board
+        self.sims = roach_simulator.start_simulators(["roach0"], flavor=FLAVOR,
+                                                     port=0, time_scale=0.01)
+        self.sim = self.sims[0][1]
+        host, port = self.sim._bindaddr
+        self.fpga = katcp_wrapper.FpgaClient(host, port, timeout=5.0)
+        self.assertTrue(self.fpga.wait_connected(5.0))
+
+    def tearDown(self):
+        self.fpga.stop()
+        for name, sim in self.sims:
+            sim.stop()
+            sim.join(timeout=1.0)
+
+    def test_listdev(self):
+        """The programmed design lists its registers and snap blocks"""
+        devices = self.fpga.listdev()
+        for name in ("sys_board_id", "acc_len", "o_acc_cnt", "snap_xx0_ctrl",
+                     "snap_xx0_bram", "nar_snap_x_on_bram", "snap_mux_bram"):
+            self.assertTrue(name in devices, "%s not listed" % name)
+
+    def test_read_write_acc_len(self):
+        """acc_len reads back what was written and sets the dump rate"""
+        self.fpga.write_int("acc_len", 1024)
+        self.assertEqual(self.fpga.read_uint("acc_len"), 1024)
+        self.assertEqual(self.fpga.read("acc_len", 4), struct.pack(">I", 1024))
+        self.assertRaises(RuntimeError, self.fpga.write_int, "o_acc_cnt", 1)
+
+        # 1024 * 4096 / 200 MHz, scaled by 0.01
+        period = 1024 * 4096 / 200e6 * 0.01
+        start = self.fpga.read_uint("o_acc_cnt")
+        time.sleep(20 * period)
+        self.assertTrue(self.fpga.read_uint("o_acc_cnt") - start >= 10)
+
+    def test_snap_capture(self):
+        """Triggering a snap block captures a spectrum into its BRAM"""
+        snap = self.fpga.get_snap("snap_xx0", ["bram"], wait_period=0.01)
+        self.assertEqual(snap["length"], 4096)
+        xx = np.fromstring(snap["bram"], dtype=">u4")
+        self.assertEqual(len(xx), 4096)
+        self.assertTrue(xx.max() > 0)
+
+    def test_bulkread(self):
+        """bulkread returns the same bytes as read, over several informs"""
+        self.fpga.write_int("snap_yy0_ctrl", 0)
+        self.fpga.write_int("snap_yy0_ctrl", 1)
+        size = 4 * 4096
+        # several informs per read
+        self.sim.BULKREAD_CHUNK = 1000
+        data = self.fpga.bulkread("snap_yy0_bram", size)
+        self.assertEqual(len(data), size)
+        self.assertEqual(data, self.fpga.read("snap_yy0_bram", size))
+        self.assertEqual(self.fpga.bulkread("snap_yy0_bram", 64, offset=64),
+                         data[64:128])
+
+    def test_latency_off_server_thread(self):
+        """Slow requests do not hold up other clients"""
+        self.sim._latency = 0.5
+        host, port = self.sim._bindaddr
+        other = katcp_wrapper.FpgaClient(host, port, timeout=5.0)
+        try:
+            self.assertTrue(other.wait_connected(5.0))
+            slow = threading.Thread(target=self.fpga.read_uint,
+                                    args=("acc_len",))
+            slow.start()
+            time.sleep(0.05)
+            start = time.time()
+            # the watchdog request is answered inline, without the latency
+            other.ping()
+            self.assertTrue(time.time() - start < 0.25)
+            slow.join()
+        finally:
+            other.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()